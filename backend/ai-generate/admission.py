@@ -0,0 +1,237 @@
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from response import get_header
+
+SCHEMA = 't_p56286601_ai_app_creation_site'
+ADMISSION_ENABLED = os.environ.get('AI_ADMISSION', '1').lower() not in ('0', 'false', 'no', 'off')
+PLAN_CACHE_TTL = 60.0
+MAX_LOCAL_KEYS = 10000
+
+# requests_per_minute и burst - ведро запросов; tokens_per_hour - ведро токенов OpenAI,
+# списываемых по response.usage.total_tokens; priority - очередь за слотом upstream и задачами
+PLANS: Dict[str, Dict[str, float]] = {
+    'anonymous': {'requests_per_minute': 5, 'burst': 3, 'tokens_per_hour': 20000, 'priority': 0},
+    'basic': {'requests_per_minute': 20, 'burst': 5, 'tokens_per_hour': 100000, 'priority': 1},
+    'pro': {'requests_per_minute': 60, 'burst': 15, 'tokens_per_hour': 500000, 'priority': 2},
+    'enterprise': {'requests_per_minute': 240, 'burst': 40, 'tokens_per_hour': 2000000, 'priority': 3},
+}
+for _plan, _limits in json.loads(os.environ.get('AI_PLAN_LIMITS') or '{}').items():
+    PLANS[_plan] = {**PLANS.get(_plan, PLANS['basic']), **_limits}
+
+
+class Admission(NamedTuple):
+    allowed: bool
+    key: str
+    plan: str
+    priority: int
+    retry_after: int = 0
+
+
+class MemoryBuckets:
+    '''
+    Token bucket в памяти инстанса: take() пополняет ведро по времени и списывает cost,
+    если в нём не меньше require. Полные вёдра выбрасываются, когда ключей слишком много
+    '''
+
+    def __init__(self, max_keys: int = MAX_LOCAL_KEYS):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Tuple[float, float, float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float, cost: float, require: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            level, updated, _, _ = self._buckets.get(key, (capacity, now, capacity, rate))
+            level = min(capacity, level + (now - updated) * rate)
+            allowed = level >= require
+            if allowed:
+                level -= cost
+            self._buckets[key] = (level, now, capacity, rate)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return allowed, level
+
+    def _prune(self, now: float) -> None:
+        for key, (level, updated, capacity, rate) in list(self._buckets.items()):
+            if level + (now - updated) * rate >= capacity:
+                del self._buckets[key]
+
+
+class PostgresBuckets:
+    '''
+    Общие для всех инстансов вёдра в rate_limit_buckets: пополнение и списание - один UPSERT.
+    Ошибки базы не блокируют генерацию - решение принимает локальное ведро
+    '''
+
+    def __init__(self, fallback: MemoryBuckets):
+        self.fallback = fallback
+        self.errors = 0
+
+    def take(self, key: str, capacity: float, rate: float, cost: float, require: float) -> Tuple[bool, float]:
+        refilled = """LEAST(%(capacity)s, b.level + %(rate)s * EXTRACT(EPOCH FROM (NOW() - b.updated_at)))"""
+        params = {'key': key, 'capacity': float(capacity), 'rate': float(rate), 'cost': float(cost),
+                  'require': float(require)}
+        error = None
+        try:
+            from db import get_db_connection, release_db_connection
+            conn = get_db_connection()
+        except Exception:
+            self.errors += 1
+            return self.fallback.take(key, capacity, rate, cost, require)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""INSERT INTO {SCHEMA}.rate_limit_buckets AS b (bucket_key, level, admitted, updated_at)
+                    VALUES (
+                        %(key)s,
+                        CASE WHEN %(capacity)s >= %(require)s THEN %(capacity)s - %(cost)s ELSE %(capacity)s END,
+                        %(capacity)s >= %(require)s,
+                        NOW()
+                    )
+                    ON CONFLICT (bucket_key) DO UPDATE SET
+                        level = CASE WHEN {refilled} >= %(require)s THEN {refilled} - %(cost)s ELSE {refilled} END,
+                        admitted = {refilled} >= %(require)s,
+                        updated_at = NOW()
+                    RETURNING admitted, level""",
+                    params
+                )
+                admitted, level = cur.fetchone()
+            conn.commit()
+            return admitted, level
+        except Exception as e:
+            error = e
+            self.errors += 1
+            return self.fallback.take(key, capacity, rate, cost, require)
+        finally:
+            release_db_connection(conn, error)
+
+
+class AdmissionController:
+    '''
+    Два ведра на ключ (пользователь или IP): запросы в минуту и токены в час.
+    Токены списываются после ответа по фактическому usage, поэтому ведро может уйти в минус -
+    пока долг не погашен пополнением, запросы получают 429 с Retry-After
+    '''
+
+    def __init__(self, buckets: Any):
+        self.buckets = buckets
+        self._plans: Dict[int, Tuple[str, float]] = {}
+        self._plans_lock = threading.Lock()
+
+    def identify(self, event: Dict[str, Any], data: Any) -> Tuple[str, str]:
+        '''
+        Ключ и тариф: X-User-Id (или user_id в теле) с тарифом из users.plan, иначе IP клиента
+        '''
+        raw = get_header(event, 'X-User-Id') or (data.get('user_id') if isinstance(data, dict) else None)
+        try:
+            user_id = int(raw) if raw is not None else None
+        except (TypeError, ValueError):
+            user_id = None
+        if user_id is not None:
+            plan = self.plan_for(user_id)
+            if plan is not None:
+                return f'user:{user_id}', plan
+        identity = (event.get('requestContext') or {}).get('identity') or {}
+        return f"ip:{identity.get('sourceIp') or 'unknown'}", 'anonymous'
+
+    def plan_for(self, user_id: int) -> Optional[str]:
+        now = time.monotonic()
+        with self._plans_lock:
+            cached = self._plans.get(user_id)
+            if cached and cached[1] > now:
+                return cached[0]
+        plan = self._load_plan(user_id)
+        with self._plans_lock:
+            if len(self._plans) > MAX_LOCAL_KEYS:
+                self._plans.clear()
+            self._plans[user_id] = (plan, now + PLAN_CACHE_TTL)
+        return plan
+
+    def _load_plan(self, user_id: int) -> Optional[str]:
+        '''
+        Тариф из users.plan; None - пользователя нет. Без базы или при её ошибке - basic
+        '''
+        if not os.environ.get('DATABASE_URL'):
+            return 'basic'
+        error = None
+        try:
+            from db import get_db_connection, release_db_connection
+            conn = get_db_connection()
+        except Exception:
+            return 'basic'
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f'SELECT plan FROM {SCHEMA}.users WHERE id = %s', (user_id,))
+                row = cur.fetchone()
+            conn.commit()
+        except Exception as e:
+            error = e
+            return 'basic'
+        finally:
+            release_db_connection(conn, error)
+        if row is None:
+            return None
+        return row[0] if row[0] in PLANS else 'basic'
+
+    def admit(self, key: str, plan: str, cost: int = 1) -> Admission:
+        '''
+        Пропускает запрос, если токенов не в минусе и в ведре запросов есть cost (пакет - по числу элементов)
+        '''
+        limits = PLANS[plan]
+        priority = int(limits['priority'])
+        token_rate = limits['tokens_per_hour'] / 3600
+        allowed, level = self.buckets.take(f'{key}:tokens', limits['tokens_per_hour'], token_rate, 0, 1)
+        if not allowed:
+            return Admission(False, key, plan, priority, _seconds((1 - level) / token_rate))
+        request_rate = limits['requests_per_minute'] / 60
+        allowed, level = self.buckets.take(
+            f'{key}:requests', limits['burst'], request_rate, cost, min(cost, limits['burst'])
+        )
+        if not allowed:
+            return Admission(False, key, plan, priority, _seconds((min(cost, limits['burst']) - level) / request_rate))
+        return Admission(True, key, plan, priority)
+
+    def charge(self, key: str, plan: str, tokens: int) -> None:
+        limits = PLANS.get(plan)
+        if limits and tokens > 0:
+            self.buckets.take(
+                f'{key}:tokens', limits['tokens_per_hour'], limits['tokens_per_hour'] / 3600, tokens, -math.inf
+            )
+
+
+def _seconds(value: float) -> int:
+    return max(1, math.ceil(value))
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        buckets: Any = MemoryBuckets()
+        if os.environ.get('AI_ADMISSION_BACKEND') == 'postgres' and os.environ.get('DATABASE_URL'):
+            buckets = PostgresBuckets(buckets)
+        _controller = AdmissionController(buckets)
+    return _controller
+
+
+def admit_request(event: Dict[str, Any], data: Any, cost: int = 1) -> Admission:
+    '''
+    Решение по запросу на генерацию; с AI_ADMISSION=0 пропускает всех без ключа
+    '''
+    if not ADMISSION_ENABLED:
+        return Admission(True, '', '', 0)
+    controller = get_controller()
+    key, plan = controller.identify(event, data)
+    return controller.admit(key, plan, cost)
+
+
+def charge_tokens(admission: Admission, tokens: int) -> None:
+    if admission.key:
+        get_controller().charge(admission.key, admission.plan, tokens)
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+SCHEMA = 't_p56286601_ai_app_creation_site'
+
+
+def cache_key(prompt: str, language: str, model: str, temperature: float, max_tokens: int) -> str:
+    '''
+    Ключ кеша: промпт без лишних пробелов + язык, модель и параметры сэмплинга
+    '''
+    normalized = ' '.join(prompt.split())
+    raw = json.dumps([normalized, language.strip().lower(), model, temperature, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, max_entries: int = 256, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class PostgresCache:
+    '''
+    Общий для всех инстансов кеш в таблице ai_generation_cache.
+    Ошибки базы не ломают генерацию - считаются промахом
+    '''
+
+    def __init__(self, ttl: float = 3600.0):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._run(
+            f"""SELECT response FROM {SCHEMA}.ai_generation_cache
+            WHERE cache_key = %s AND expires_at > NOW()""",
+            (key,),
+            fetch=True
+        )
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        self._run(
+            f"""INSERT INTO {SCHEMA}.ai_generation_cache (cache_key, response, expires_at)
+            VALUES (%s, %s, NOW() + make_interval(secs => %s))
+            ON CONFLICT (cache_key) DO UPDATE
+            SET response = EXCLUDED.response, created_at = NOW(), expires_at = EXCLUDED.expires_at""",
+            (key, json.dumps(value), self.ttl)
+        )
+
+    def _run(self, query: str, params: tuple, fetch: bool = False) -> Any:
+        error = None
+        try:
+            from db import get_db_connection, release_db_connection
+            conn = get_db_connection()
+        except Exception:
+            self.errors += 1
+            return None
+        try:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                row = cur.fetchone() if fetch else None
+            conn.commit()
+            return row
+        except Exception as e:
+            error = e
+            self.errors += 1
+            return None
+        finally:
+            release_db_connection(conn, error)
+
+
+class GenerationCache:
+    '''
+    Двухуровневый кеш: локальный LRU, затем (опционально) Postgres
+    '''
+
+    def __init__(self, local: LRUCache, shared: Optional[PostgresCache] = None):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {'local': {'hits': self.local.hits, 'misses': self.local.misses}}
+        if self.shared is not None:
+            stats['shared'] = {
+                'hits': self.shared.hits,
+                'misses': self.shared.misses,
+                'errors': self.shared.errors
+            }
+        return stats
+
+
+_cache: Optional[GenerationCache] = None
+
+
+def get_cache() -> GenerationCache:
+    global _cache
+    if _cache is None:
+        ttl = float(os.environ.get('AI_CACHE_TTL', '3600'))
+        shared = None
+        if os.environ.get('AI_CACHE_BACKEND') == 'postgres' and os.environ.get('DATABASE_URL'):
+            shared = PostgresCache(ttl=ttl)
+        _cache = GenerationCache(
+            LRUCache(max_entries=int(os.environ.get('AI_CACHE_MAX_ENTRIES', '256')), ttl=ttl),
+            shared
+        )
+    return _cache
@@ -0,0 +1,260 @@
+import math
+import os
+import re
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+SCHEMA = 't_p56286601_ai_app_creation_site'
+CONTEXT_TOKENS = int(os.environ.get('AI_CONTEXT_TOKENS', '3000'))
+MAX_OUTPUT_TOKENS = int(os.environ.get('AI_MAX_OUTPUT_TOKENS', '4096'))
+MIN_OUTPUT_TOKENS = 256
+# доля бюджета на непрерывное окно вокруг курсора; остаток - объявления из остального файла
+WINDOW_SHARE = 0.75
+ENCODING = 'o200k_base'
+
+SELECTION_START = '<<<SELECTED>>>'
+SELECTION_END = '<<<END SELECTED>>>'
+CURSOR = '<<<CURSOR>>>'
+MODE_INSTRUCTIONS = {
+    'file': 'The user message contains the complete current file. Return the complete updated file.',
+    'selection': (
+        f'The user message contains the current file or an excerpt of it; the code to change is between '
+        f'{SELECTION_START} and {SELECTION_END}. Return only the replacement for the selected code, without the markers.'
+    ),
+    'insert': (
+        f'The user message contains an excerpt of the current file; {CURSOR} marks the insertion point. '
+        'Return only the code to insert there, without the marker.'
+    ),
+}
+DECLARATION = re.compile(
+    r'^\s*(export\s|import\s|from\s|async\s|function\s|class\s|def\s|interface\s|type\s|'
+    r'(const|let|var)\s+\w+\s*=\s*(async\s*)?(\(|function))'
+)
+
+
+class CodeChanged(Exception):
+    '''
+    Код проекта в базе отличается от base_hash клиента: смещения выделения относятся к другому тексту
+    '''
+
+    def __init__(self, current_hash: str):
+        super().__init__('Project code changed')
+        self.current_hash = current_hash
+
+
+class PromptContext(NamedTuple):
+    mode: str
+    text: str
+    replace_start: int
+    replace_end: int
+    tokens: int
+    max_tokens: int
+    truncated: bool
+
+    def info(self) -> Dict[str, Any]:
+        '''
+        Что вернуть клиенту: сгенерированный код заменяет [replace_start, replace_end) его текста
+        '''
+        return {key: value for key, value in self._asdict().items() if key != 'text'}
+
+
+_encoder: Any = None
+_encoder_failed = False
+_encoder_lock = threading.Lock()
+
+
+def _get_encoder() -> Any:
+    '''
+    tiktoken грузится при первом подсчёте; без пакета или без файла словаря
+    (его скачивают при первом get_encoding) - None, и дальше до перезапуска используется оценка
+    '''
+    global _encoder, _encoder_failed
+    if _encoder is None and not _encoder_failed:
+        with _encoder_lock:
+            if _encoder is None and not _encoder_failed:
+                try:
+                    import tiktoken
+
+                    _encoder = tiktoken.get_encoding(ENCODING)
+                except Exception:
+                    _encoder_failed = True
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    # ~4 байта UTF-8 на токен для кода; кириллица (2 байта на символ) выходит ~2 символа на токен
+    return math.ceil(len(text.encode('utf-8')) / 4)
+
+
+def parse_context_request(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    '''
+    project_id, selection {start, end} или cursor (смещения в символах Unicode) и base_hash из тела.
+    None - запрос без проекта; ValueError - некорректные параметры
+    '''
+    project_id = data.get('project_id')
+    if project_id is None:
+        return None
+    selection = data.get('selection')
+    cursor = data.get('cursor')
+    try:
+        project_id = int(project_id)
+        if selection is not None:
+            start, end = int(selection['start']), int(selection['end'])
+        elif cursor is not None:
+            start = end = int(cursor)
+        else:
+            # без курсора генерация дописывает конец файла
+            start = end = None
+    except (TypeError, ValueError, KeyError):
+        raise ValueError('project_id, cursor and selection {start, end} must be integers')
+    if start is not None and not 0 <= start <= end:
+        raise ValueError('selection must satisfy 0 <= start <= end')
+    return {'project_id': project_id, 'start': start, 'end': end, 'base_hash': data.get('base_hash')}
+
+
+def load_project_code(project_id: int) -> Optional[Tuple[str, str]]:
+    '''
+    Текущий код проекта и его хеш; код форка без своих изменений берётся из общего блоба
+    '''
+    from db import get_db_connection, release_db_connection
+
+    conn = get_db_connection()
+    error = None
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""SELECT COALESCE(p.code, (SELECT b.code FROM {SCHEMA}.code_blobs b WHERE b.hash = p.code_hash)),
+                    p.code_hash
+                FROM {SCHEMA}.projects p
+                WHERE p.id = %s""",
+                (project_id,)
+            )
+            row = cur.fetchone()
+        conn.commit()
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        release_db_connection(conn, error)
+    return (row[0] or '', row[1]) if row else None
+
+
+def prepare_context(request: Dict[str, Any], prompt: str, budget: int = CONTEXT_TOKENS,
+                    default_max_tokens: int = 1500) -> PromptContext:
+    '''
+    Контекст генерации по проекту. LookupError - проекта нет, CodeChanged - base_hash устарел,
+    ValueError - выделение за пределами кода или больше бюджета
+    '''
+    project = load_project_code(request['project_id'])
+    if project is None:
+        raise LookupError('Project not found')
+    code, code_hash = project
+    if request['base_hash'] and request['base_hash'] != code_hash:
+        raise CodeChanged(code_hash)
+    return build_context(code, request['start'], request['end'], max(budget - count_tokens(prompt), 0),
+                         default_max_tokens)
+
+
+def build_context(code: str, start: Optional[int], end: Optional[int], budget: int,
+                  default_max_tokens: int) -> PromptContext:
+    '''
+    Режим и текст контекста под бюджет токенов:
+    selection - непустое выделение, ответ заменяет его, max_tokens по размеру выделения;
+    file - без выделения и файл целиком помещается в бюджет, ответ - весь файл;
+    insert - без выделения, большой файл: окно вокруг курсора (без курсора - конец файла)
+    и объявления из остального файла, ответ вставляется в позицию курсора
+    '''
+    if start is None:
+        start = end = len(code)
+    if end > len(code):
+        raise ValueError('selection is outside of the project code')
+
+    if start < end:
+        selection_tokens = count_tokens(code[start:end])
+        if selection_tokens > budget:
+            raise ValueError('selection is too large for the context budget')
+        marked = code[:start] + SELECTION_START + code[start:end] + SELECTION_END + code[end:]
+        text, tokens, truncated = _excerpt(marked, start, end + len(SELECTION_START) + len(SELECTION_END), budget)
+        return PromptContext('selection', text, start, end, tokens, _output_tokens(selection_tokens, 2.0), truncated)
+
+    tokens = count_tokens(code)
+    if tokens <= budget:
+        return PromptContext('file', code, 0, len(code), tokens, _output_tokens(tokens, 1.25), False)
+
+    marked = code[:start] + CURSOR + code[start:]
+    text, tokens, truncated = _excerpt(marked, start, start + len(CURSOR), budget)
+    return PromptContext('insert', text, start, start, tokens, default_max_tokens, truncated)
+
+
+def _output_tokens(tokens: int, factor: float) -> int:
+    return max(MIN_OUTPUT_TOKENS, min(MAX_OUTPUT_TOKENS, math.ceil(tokens * factor) + MIN_OUTPUT_TOKENS))
+
+
+def _excerpt(code: str, start: int, end: int, budget: int) -> Tuple[str, int, bool]:
+    '''
+    Строки [start, end) целиком, затем окно вокруг них поровну вверх и вниз до WINDOW_SHARE бюджета,
+    затем строки-объявления из остального файла, ближние к окну - первыми. Пропуски помечаются
+    числом опущенных строк, на каждую пометку резервируется место в бюджете.
+    Токены считаются только для взятых строк - большой файл целиком не токенизируется.
+    Строки делятся только по \n, как и считаются номера строк у start/end: splitlines() резал бы
+    ещё по \r, \u2028 и т. п., и окно съезжало бы относительно выделения
+    '''
+    lines = code.split('\n')
+    lo = code.count('\n', 0, start)
+    hi = code.count('\n', 0, end) + 1
+    gap_cost = count_tokens(f'… {len(lines)} lines omitted …\n')
+    # пропуски до и после окна
+    used = sum(count_tokens(line + '\n') for line in lines[lo:hi]) + 2 * gap_cost
+
+    window_budget = max(budget * WINDOW_SHARE, used)
+    # окно растёт по строке вверх и вниз, пока очередная строка помещается
+    grow_up, grow_down = lo > 0, hi < len(lines)
+    while grow_up or grow_down:
+        if grow_up:
+            cost = count_tokens(lines[lo - 1] + '\n')
+            grow_up = used + cost <= window_budget
+            if grow_up:
+                lo -= 1
+                used += cost
+                grow_up = lo > 0
+        if grow_down:
+            cost = count_tokens(lines[hi] + '\n')
+            grow_down = used + cost <= window_budget
+            if grow_down:
+                hi += 1
+                used += cost
+                grow_down = hi < len(lines)
+
+    keep = set(range(lo, hi))
+    declarations = [i for i in range(len(lines)) if i not in keep and DECLARATION.match(lines[i])]
+    declarations.sort(key=lambda i: lo - i if i < lo else i - hi)
+    for index in declarations:
+        # объявление разрывает пропуск надвое - плюс одна пометка
+        cost = count_tokens(lines[index] + '\n') + gap_cost
+        if used + cost > budget:
+            break
+        keep.add(index)
+        used += cost
+
+    parts: List[str] = []
+    skipped = 0
+    for index, line in enumerate(lines):
+        if index in keep:
+            if skipped:
+                parts.append(f'… {skipped} lines omitted …')
+                skipped = 0
+            parts.append(line)
+        else:
+            skipped += 1
+    if skipped:
+        parts.append(f'… {skipped} lines omitted …')
+    text = '\n'.join(parts)
+    return text, count_tokens(text), len(keep) < len(lines)
+
+
+def render_context(context: PromptContext, language: str) -> str:
+    label = 'Current file (excerpt)' if context.truncated else 'Current file'
+    return f'{label}:\n```{language}\n{context.text}\n```'
@@ -1,26 +1,211 @@
+import hashlib
+import hmac
 import json
 import os
-from typing import Dict, Any
+import uuid
+from typing import Dict, Any, List, Optional
 
+# первым: при IMPORT_PROFILE=1 timing замеряет загрузку остальных модулей
+from timing import bind, instrumented, span
+from admission import Admission, admit_request, charge_tokens
+from cache import cache_key, get_cache
+from context import (
+    MODE_INSTRUCTIONS, CodeChanged, PromptContext, parse_context_request, prepare_context, render_context
+)
+from jobs import RetryableJobError, drain, enqueue, fetch, wait_for
+from llm import UpstreamUnavailable, create_completion, get_client, upstream_slot
+from response import error_response, get_header, json_response, options_response, raw_response
+from streaming import sse_event, stream_events, strip_code_fence
+
+MODEL = 'gpt-4o-mini'
+MAX_TOKENS = 1500
+TEMPERATURE = 0.7
+BATCH_MAX_ITEMS = int(os.environ.get('AI_BATCH_MAX_ITEMS', '10'))
+BATCH_CONCURRENCY = int(os.environ.get('AI_BATCH_CONCURRENCY', '4'))
+JOB_CONCURRENCY = int(os.environ.get('AI_JOB_CONCURRENCY', '4'))
+# long-poll короче 30-секундного таймаута клиента
+JOB_WAIT_MAX = 25.0
+WORKER_TIME_BUDGET = float(os.environ.get('AI_WORKER_TIME_BUDGET', '50'))
+# без Expose-Headers браузер не отдаёт клиенту с другого origin Retry-After и Location
+EXPOSE_HEADERS = 'Retry-After, Location'
+
+def sse_response(body: str, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return raw_response(
+        200, body.encode('utf-8'), 'text/event-stream',
+        headers={'Cache-Control': 'no-cache', **(headers or {})}
+    )
+
+def demo_code(prompt: str) -> str:
+    return f"""// Код сгенерирован по запросу: "{prompt}"
+// Для полноценной работы необходим OPENAI_API_KEY
+
+function generatedFunction() {{
+    // {prompt}
+    console.log('Функция создана по запросу');
+    return 'Success';
+}}
+
+generatedFunction();"""
+
+def demo_response(prompt: str, stream: bool, message: str, degraded: bool = False) -> Dict[str, Any]:
+    generated_code = demo_code(prompt)
+    
+    if stream:
+        return sse_response(sse_event({'delta': generated_code}) + sse_event(
+            {'done': True, 'demo': True, 'degraded': degraded, 'cached': False, 'tokens': 0, 'ttft_ms': 0}
+        ))
+    
+    return json_response(200, {
+        'code': generated_code,
+        'demo': True,
+        'degraded': degraded,
+        'message': message
+    })
+
+def build_messages(prompt: str, language: str, context: Optional[PromptContext] = None) -> List[Dict[str, str]]:
+    system_prompt = f"You are a code generation assistant. Generate clean, well-documented {language} code based on user requests. Only return the code, no explanations."
+    if context is None:
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+    return [
+        {"role": "system", "content": f"{system_prompt} {MODE_INSTRUCTIONS[context.mode]}"},
+        {"role": "user", "content": f"{render_context(context, language)}\n\n{prompt}"}
+    ]
+
+def request_key(prompt: str, language: str, context: Optional[PromptContext] = None) -> str:
+    '''
+    Ключ кеша; с контекстом проекта в него входят режим и хеш фрагмента кода -
+    тот же промпт к другому коду не попадает в чужую запись
+    '''
+    if context is None:
+        return cache_key(prompt, language, MODEL, TEMPERATURE, MAX_TOKENS)
+    digest = hashlib.sha256(context.text.encode('utf-8')).hexdigest()
+    return cache_key(f'{prompt} [{context.mode}:{digest}]', language, MODEL, TEMPERATURE, context.max_tokens)
+
+def generate(client: Any, prompt: str, language: str, use_cache: bool, priority: int = 0,
+             context: Optional[PromptContext] = None) -> Dict[str, Any]:
+    '''
+    Буферизованная генерация одного фрагмента: кеш, затем OpenAI.
+    С контекстом проекта max_tokens берётся из него, а в ответ добавляется context - куда вставить код
+    '''
+    extra = {'context': context.info()} if context is not None else {}
+    key = request_key(prompt, language, context)
+    cache = get_cache()
+    cached = cache.get(key) if use_cache else None
+    if cached is not None:
+        return {'code': cached['code'], 'demo': False, 'tokens': 0, 'cached': True, **extra}
+    
+    with upstream_slot(priority=priority):
+        response = create_completion(
+            client,
+            model=MODEL,
+            messages=build_messages(prompt, language, context),
+            max_tokens=context.max_tokens if context is not None else MAX_TOKENS,
+            temperature=TEMPERATURE
+        )
+    
+    generated_code = strip_code_fence(response.choices[0].message.content)
+    cache.set(key, {'code': generated_code})
+    return {'code': generated_code, 'demo': False, 'tokens': response.usage.total_tokens, 'cached': False, **extra}
+
+def generate_batch(items: List[Any], openai_key: Optional[str], use_cache: bool,
+                   priority: int = 0) -> List[Dict[str, Any]]:
+    '''
+    Параллельная генерация нескольких фрагментов; ошибки возвращаются по каждому элементу
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    
+    client = get_client(openai_key) if openai_key else None
+    
+    def run(index: int, item: Any) -> Dict[str, Any]:
+        if not isinstance(item, dict) or not item.get('prompt'):
+            return {'index': index, 'error': 'Prompt is required'}
+        prompt = item['prompt']
+        language = item.get('language', 'javascript')
+        if client is None:
+            return {'index': index, 'code': demo_code(prompt), 'demo': True}
+        try:
+            return {'index': index, **generate(client, prompt, language, use_cache, priority)}
+        except UpstreamUnavailable:
+            return {'index': index, 'code': demo_code(prompt), 'demo': True, 'degraded': True}
+        except Exception as e:
+            return {'index': index, 'error': str(e)}
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_CONCURRENCY, len(items)))) as pool:
+        return list(pool.map(bind(run), range(len(items)), items))
+
+def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Генерация для задачи из очереди; недоступный OpenAI - повтор задачи позже.
+    Токены списываются с того, кто поставил задачу
+    '''
+    openai_key = os.environ.get('OPENAI_API_KEY')
+    if not openai_key:
+        return {'code': demo_code(job['prompt']), 'demo': True, 'tokens': 0, 'cached': False}
+    context = PromptContext(**job['context']) if job.get('context') else None
+    try:
+        result = generate(
+            get_client(openai_key), job['prompt'], job['language'], job['use_cache'], job['priority'], context
+        )
+    except UpstreamUnavailable as e:
+        raise RetryableJobError(str(e)) from e
+    charge_tokens(Admission(True, job['owner'] or '', job['plan'] or '', job['priority']), result['tokens'])
+    return result
+
+def drain_jobs(time_budget: Optional[float], poll_interval: Optional[float] = None) -> Dict[str, Any]:
+    return drain(run_job, JOB_CONCURRENCY, time_budget, poll_interval)
+
+def too_many_requests(admission: Admission) -> Dict[str, Any]:
+    return json_response(429, {
+        'error': f'Rate limit exceeded for plan {admission.plan}',
+        'plan': admission.plan,
+        'retry_after': admission.retry_after
+    }, headers={'Retry-After': str(admission.retry_after), 'Access-Control-Expose-Headers': EXPOSE_HEADERS})
+
+def job_status(event: Dict[str, Any]) -> Dict[str, Any]:
+    params = event.get('queryStringParameters') or {}
+    try:
+        job_id = str(uuid.UUID(params.get('job_id') or ''))
+        wait = min(max(float(params.get('wait') or 0), 0.0), JOB_WAIT_MAX)
+    except ValueError:
+        return error_response(400, 'job_id must be a UUID and wait a number of seconds')
+    
+    job = wait_for(job_id, wait) if wait else fetch(job_id)
+    if job is None:
+        return error_response(404, 'Job not found')
+    headers = {} if job['status'] in ('done', 'failed') else {
+        'Retry-After': '1', 'Access-Control-Expose-Headers': EXPOSE_HEADERS
+    }
+    return json_response(200, job, event, headers)
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     OpenAI API integration для генерации кода
     POST /ai-generate - генерация кода по промпту
+    Ответы кешируются; cache: false или Cache-Control: no-cache - обойти кеш
+    stream: true или Accept: text/event-stream - ответ SSE-событиями {"delta"}, затем {"done"}
+    items: [{prompt, language}, ...] - пакетная генерация, результат по каждому элементу
+    async: true или Prefer: respond-async - 202 {job_id}, генерация в очереди generation_jobs
+    GET ?job_id=X&wait=N - статус задачи; wait (до 25 с) - long-poll до done/failed
+    POST {drain: true} - разобрать очередь (по расписанию); X-Worker-Token = AI_WORKER_TOKEN, без него - 403
+    Лимиты запросов и токенов по тарифу (X-User-Id или user_id, иначе IP): сверх лимита - 429 с Retry-After
+    project_id + selection {start, end} или cursor - генерация по коду проекта в пределах AI_CONTEXT_TOKENS:
+    ответ содержит context {mode, replace_start, replace_end} - какой диапазон кода заменить;
+    base_hash, отличный от текущего code_hash проекта, - 409
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+        return options_response('GET, POST, OPTIONS', 'Content-Type, Cache-Control, Accept, Prefer, X-Worker-Token, X-User-Id')
+    
+    if method == 'GET':
+        try:
+            return job_status(event)
+        except Exception as e:
+            return error_response(500, str(e))
     
     if method == 'POST':
         try:
@@ -33,113 +218,157 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             else:
                 data = body_str or {}
             
+            use_cache = not (
+                (isinstance(data, dict) and data.get('cache') is False)
+                or 'no-cache' in (get_header(event, 'Cache-Control') or '')
+            )
+            
+            if isinstance(data, dict) and data.get('drain'):
+                # без настроенного токена разбор очереди закрыт: иначе его мог бы запустить кто угодно
+                token = os.environ.get('AI_WORKER_TOKEN')
+                if not token or not hmac.compare_digest(get_header(event, 'X-Worker-Token') or '', token):
+                    return error_response(403, 'Forbidden')
+                return json_response(200, drain_jobs(WORKER_TIME_BUDGET))
+            
+            items = data.get('items') if isinstance(data, dict) else None
+            if items is not None:
+                if not isinstance(items, list) or not items or len(items) > BATCH_MAX_ITEMS:
+                    return error_response(400, f'items must be a list of 1 to {BATCH_MAX_ITEMS} prompts')
+                
+                admission = admit_request(event, data, len(items))
+                if not admission.allowed:
+                    return too_many_requests(admission)
+                
+                results = generate_batch(items, os.environ.get('OPENAI_API_KEY'), use_cache, admission.priority)
+                tokens = sum(r.get('tokens', 0) for r in results)
+                charge_tokens(admission, tokens)
+                return json_response(200, {'results': results, 'tokens': tokens}, event)
+            
             prompt = data.get('prompt', '') if isinstance(data, dict) else ''
             language = data.get('language', 'javascript') if isinstance(data, dict) else 'javascript'
             
             if not prompt:
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Prompt is required'}),
-                    'isBase64Encoded': False
-                }
+                return error_response(400, 'Prompt is required')
+            
+            try:
+                context_request = parse_context_request(data)
+            except ValueError as e:
+                return error_response(400, str(e))
+            
+            admission = admit_request(event, data)
+            if not admission.allowed:
+                return too_many_requests(admission)
+            
+            stream = (
+                (isinstance(data, dict) and bool(data.get('stream')))
+                or 'text/event-stream' in (get_header(event, 'Accept') or '')
+            )
+            
+            async_job = not stream and (
+                (isinstance(data, dict) and bool(data.get('async')))
+                or 'respond-async' in (get_header(event, 'Prefer') or '')
+            )
             
             openai_key = os.environ.get('OPENAI_API_KEY')
             
             if not openai_key:
-                generated_code = f"""// Код сгенерирован по запросу: "{prompt}"
-// Для полноценной работы необходим OPENAI_API_KEY
-
-function generatedFunction() {{
-    // {prompt}
-    console.log('Функция создана по запросу');
-    return 'Success';
-}}
-
-generatedFunction();"""
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({
-                        'code': generated_code,
-                        'demo': True,
-                        'message': 'Demo mode - add OPENAI_API_KEY for real AI generation'
-                    }),
-                    'isBase64Encoded': False
-                }
+                return demo_response(prompt, stream, 'Demo mode - add OPENAI_API_KEY for real AI generation')
             
-            try:
-                from openai import OpenAI
-                
-                client = OpenAI(
-                    api_key=openai_key,
-                    timeout=30.0
-                )
-                
-                system_prompt = f"You are a code generation assistant. Generate clean, well-documented {language} code based on user requests. Only return the code, no explanations."
-                
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=1500,
-                    temperature=0.7
+            context = None
+            if context_request is not None:
+                try:
+                    with span('context'):
+                        context = prepare_context(context_request, prompt, default_max_tokens=MAX_TOKENS)
+                except LookupError as e:
+                    return error_response(404, str(e))
+                except CodeChanged as e:
+                    return json_response(409, {'error': str(e), 'current_hash': e.current_hash})
+                except ValueError as e:
+                    return error_response(400, str(e))
+            context_info = {'context': context.info()} if context is not None else {}
+            
+            key = request_key(prompt, language, context)
+            cache = get_cache()
+            
+            if async_job:
+                # готовый ответ из кеша отдаётся сразу, в очередь идут только настоящие генерации
+                cached = cache.get(key) if use_cache else None
+                if cached is not None:
+                    return json_response(
+                        200, {'code': cached['code'], 'demo': False, 'tokens': 0, 'cached': True, **context_info},
+                        event, {'X-Cache': 'HIT'}
+                    )
+                job = enqueue(
+                    prompt, language, use_cache,
+                    admission.key or None, admission.plan or None, admission.priority,
+                    context._asdict() if context is not None else None
                 )
+                return json_response(202, job, event, {
+                    'Location': f"?job_id={job['job_id']}", 'Retry-After': '1',
+                    'Access-Control-Expose-Headers': EXPOSE_HEADERS
+                })
+            
+            # первым событием - куда клиенту вставлять код, он приходит до дельт
+            prelude = sse_event(context_info) if context is not None else ''
+            
+            if stream:
+                cached = cache.get(key) if use_cache else None
+                if cached is not None:
+                    return sse_response(prelude + sse_event({'delta': cached['code']}) + sse_event(
+                        {'done': True, 'demo': False, 'cached': True, 'tokens': 0, 'ttft_ms': 0}
+                    ), {'X-Cache': 'HIT'})
+            
+            try:
+                client = get_client(openai_key)
                 
-                generated_code = response.choices[0].message.content.strip()
+                if stream:
+                    with upstream_slot(priority=admission.priority):
+                        chunks = create_completion(
+                            client,
+                            model=MODEL,
+                            messages=build_messages(prompt, language, context),
+                            max_tokens=context.max_tokens if context is not None else MAX_TOKENS,
+                            temperature=TEMPERATURE,
+                            stream=True,
+                            stream_options={'include_usage': True}
+                        )
+                        with span('stream'):
+                            body = prelude + ''.join(stream_events(
+                                chunks,
+                                lambda code: cache.set(key, {'code': code}),
+                                lambda tokens: charge_tokens(admission, tokens)
+                            ))
+                    
+                    return sse_response(body, {'X-Cache': 'MISS' if use_cache else 'BYPASS'})
                 
-                if generated_code.startswith('```'):
-                    lines = generated_code.split('\n')
-                    generated_code = '\n'.join(lines[1:-1]) if len(lines) > 2 else generated_code
+                result = generate(client, prompt, language, use_cache, admission.priority, context)
+                charge_tokens(admission, result['tokens'])
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({
-                        'code': generated_code,
-                        'demo': False,
-                        'tokens': response.usage.total_tokens
-                    }),
-                    'isBase64Encoded': False
-                }
+                return json_response(200, result, event, {
+                    'X-Cache': 'HIT' if result['cached'] else ('MISS' if use_cache else 'BYPASS')
+                })
                 
+            except UpstreamUnavailable:
+                return demo_response(
+                    prompt, stream,
+                    'AI service is temporarily unavailable - demo output returned',
+                    degraded=True
+                )
+            
             except ImportError:
-                return {
-                    'statusCode': 500,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'OpenAI library not installed'}),
-                    'isBase64Encoded': False
-                }
+                return error_response(500, 'OpenAI library not installed')
             
         except Exception as e:
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': str(e)}),
-                'isBase64Encoded': False
-            }
+            return error_response(500, str(e))
+    
+    return error_response(405, 'Method not allowed')
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Process queued AI generation jobs')
+    parser.add_argument('--time-budget', type=float, help='stop claiming new jobs after this many seconds')
+    parser.add_argument('--poll-interval', type=float, help='keep waiting for new jobs, checking this often')
+    args = parser.parse_args()
     
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'}),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+    print(json.dumps(drain_jobs(args.time_budget, args.poll_interval), indent=2))
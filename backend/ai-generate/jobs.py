@@ -0,0 +1,187 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+from db import get_db_connection, release_db_connection
+from timing import span
+
+SCHEMA = 't_p56286601_ai_app_creation_site'
+LEASE_SECONDS = int(os.environ.get('AI_JOB_LEASE', '180'))
+MAX_ATTEMPTS = int(os.environ.get('AI_JOB_MAX_ATTEMPTS', '3'))
+RETENTION_SECONDS = int(os.environ.get('AI_JOB_RETENTION', '86400'))
+RETRY_DELAY = float(os.environ.get('AI_JOB_RETRY_DELAY', '5'))
+POLL_INTERVAL_MIN = 0.25
+POLL_INTERVAL_MAX = 1.0
+JOB_FIELDS = 'id, status, result, error, attempts, created_at, started_at, finished_at'
+
+
+class RetryableJobError(Exception):
+    '''
+    Временная ошибка: задача возвращается в очередь, пока не исчерпаны MAX_ATTEMPTS
+    '''
+
+
+@contextmanager
+def _cursor() -> Iterator[Any]:
+    conn = get_db_connection()
+    error = None
+    try:
+        with conn.cursor() as cur:
+            yield cur
+        conn.commit()
+    except Exception as e:
+        error = e
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn, error)
+
+
+def _job(row: Any) -> Dict[str, Any]:
+    job = dict(zip(('job_id', 'status', 'result', 'error', 'attempts', 'created_at', 'started_at', 'finished_at'), row))
+    job['job_id'] = str(job['job_id'])
+    return job
+
+
+def enqueue(prompt: str, language: str, use_cache: bool, owner: Optional[str] = None,
+            plan: Optional[str] = None, priority: int = 0,
+            context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    with _cursor() as cur:
+        cur.execute(
+            f"""INSERT INTO {SCHEMA}.generation_jobs (prompt, language, use_cache, owner, plan, priority, context)
+            VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING {JOB_FIELDS}""",
+            (prompt, language, use_cache, owner, plan, priority, json.dumps(context) if context is not None else None)
+        )
+        return _job(cur.fetchone())
+
+
+def fetch(job_id: str) -> Optional[Dict[str, Any]]:
+    with _cursor() as cur:
+        cur.execute(f'SELECT {JOB_FIELDS} FROM {SCHEMA}.generation_jobs WHERE id = %s', (job_id,))
+        row = cur.fetchone()
+    return _job(row) if row else None
+
+
+def wait_for(job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+    '''
+    Long-poll: перечитывает задачу, пока она не done/failed, не дольше timeout секунд.
+    Соединение берётся из пула только на время чтения - ожидающие клиенты не занимают пул
+    '''
+    deadline = time.monotonic() + timeout
+    interval = POLL_INTERVAL_MIN
+    while True:
+        job = fetch(job_id)
+        remaining = deadline - time.monotonic()
+        if job is None or job['status'] in ('done', 'failed') or remaining <= 0:
+            return job
+        with span('wait'):
+            time.sleep(min(interval, remaining))
+        interval = min(interval * 2, POLL_INTERVAL_MAX)
+
+
+def claim(limit: int) -> List[Dict[str, Any]]:
+    '''
+    Забирает до limit задач: queued (отложенные повторы - когда подойдёт locked_until)
+    и running с истёкшей арендой (упавший воркер); платные тарифы (priority) - первыми.
+    SKIP LOCKED - параллельные воркеры не ждут друг друга и не берут одну задачу дважды
+    '''
+    with _cursor() as cur:
+        cur.execute(
+            f"""UPDATE {SCHEMA}.generation_jobs
+            SET status = 'running', attempts = attempts + 1, started_at = NOW(),
+                locked_until = NOW() + make_interval(secs => %s)
+            WHERE id IN (
+                SELECT id FROM {SCHEMA}.generation_jobs
+                WHERE status IN ('queued', 'running') AND (locked_until IS NULL OR locked_until < NOW())
+                ORDER BY priority DESC, created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, prompt, language, use_cache, attempts, owner, plan, priority, context""",
+            (LEASE_SECONDS, limit)
+        )
+        rows = cur.fetchall()
+    return [
+        {'job_id': str(r[0]), 'prompt': r[1], 'language': r[2], 'use_cache': r[3], 'attempts': r[4],
+         'owner': r[5], 'plan': r[6], 'priority': r[7], 'context': r[8]}
+        for r in rows
+    ]
+
+
+def finish(job: Dict[str, Any], result: Optional[Dict[str, Any]] = None, error: Optional[str] = None,
+           retry: bool = False) -> str:
+    '''
+    Записывает итог; retry возвращает задачу в очередь, пока есть попытки.
+    Повтор откладывается на RETRY_DELAY * 2^(попытка - 1) секунд через locked_until
+    '''
+    status = 'done' if error is None else ('queued' if retry and job['attempts'] < MAX_ATTEMPTS else 'failed')
+    delay = RETRY_DELAY * 2 ** (job['attempts'] - 1) if status == 'queued' else None
+    with _cursor() as cur:
+        cur.execute(
+            f"""UPDATE {SCHEMA}.generation_jobs
+            SET status = %s, result = %s, error = %s,
+                locked_until = NOW() + make_interval(secs => %s),
+                finished_at = CASE WHEN %s = 'queued' THEN NULL ELSE NOW() END
+            WHERE id = %s AND status = 'running'""",
+            (status, json.dumps(result) if result is not None else None, error, delay, status, job['job_id'])
+        )
+    return status
+
+
+def purge_finished() -> int:
+    with _cursor() as cur:
+        cur.execute(
+            f"""DELETE FROM {SCHEMA}.generation_jobs
+            WHERE finished_at < NOW() - make_interval(secs => %s)""",
+            (RETENTION_SECONDS,)
+        )
+        return cur.rowcount
+
+
+def drain(process: Callable[[Dict[str, Any]], Dict[str, Any]], concurrency: int,
+          time_budget: Optional[float] = None, poll_interval: Optional[float] = None) -> Dict[str, Any]:
+    '''
+    Разбирает очередь: не больше concurrency задач одновременно, новые забираются по мере
+    освобождения слотов. Без poll_interval выходит, когда очередь пуста;
+    с poll_interval ждёт новых задач, пока не истечёт time_budget
+    '''
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    started = time.monotonic()
+    # errors - итог не записан (сбой базы); такая задача вернётся в очередь по истечении аренды
+    report = {'processed': 0, 'done': 0, 'failed': 0, 'queued': 0, 'errors': 0}
+
+    def run(job: Dict[str, Any]) -> str:
+        try:
+            return finish(job, result=process(job))
+        except RetryableJobError as e:
+            return finish(job, error=str(e), retry=True)
+        except Exception as e:
+            return finish(job, error=str(e))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        running: Set[Any] = set()
+        while True:
+            out_of_time = time_budget is not None and time.monotonic() - started >= time_budget
+            if not out_of_time and len(running) < concurrency:
+                for job in claim(concurrency - len(running)):
+                    running.add(pool.submit(run, job))
+            if not running:
+                if out_of_time or poll_interval is None:
+                    break
+                time.sleep(poll_interval)
+                continue
+            finished, running = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in finished:
+                report['processed'] += 1
+                try:
+                    report[future.result()] += 1
+                except Exception:
+                    report['errors'] += 1
+
+    report['purged'] = purge_finished()
+    report['elapsed'] = round(time.monotonic() - started, 2)
+    return report
@@ -0,0 +1,215 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Tuple
+
+from timing import span
+
+MAX_CONCURRENCY = int(os.environ.get('AI_MAX_CONCURRENCY', '4'))
+MAX_RETRIES = int(os.environ.get('AI_MAX_RETRIES', '3'))
+BACKOFF_BASE = float(os.environ.get('AI_BACKOFF_BASE', '0.5'))
+BACKOFF_CAP = float(os.environ.get('AI_BACKOFF_CAP', '8'))
+REQUEST_TIMEOUT = 30.0
+
+
+class UpstreamUnavailable(Exception):
+    '''
+    OpenAI недоступен: предохранитель разомкнут, ретраи исчерпаны или нет свободного слота
+    '''
+
+
+class CircuitBreaker:
+    '''
+    После failure_threshold подряд неудачных вызовов размыкается на reset_timeout секунд,
+    затем пропускает один пробный вызов
+    '''
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def _state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+
+class PrioritySlots:
+    '''
+    Семафор с очередью по приоритету: освободившийся слот получает ожидающий
+    с наибольшим priority, при равенстве - пришедший раньше
+    '''
+
+    def __init__(self, size: int):
+        self.free = size
+        self._waiters: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, priority: int = 0, timeout: float = REQUEST_TIMEOUT) -> bool:
+        deadline = time.monotonic() + timeout
+        entry = (-priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            while self.free == 0 or self._waiters[0] != entry:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                    return False
+                self._cond.wait(remaining)
+            heapq.heappop(self._waiters)
+            self.free -= 1
+            # следующий в очереди может занять ещё один свободный слот
+            self._cond.notify_all()
+            return True
+
+    def release(self) -> None:
+        with self._cond:
+            self.free += 1
+            self._cond.notify_all()
+
+
+breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get('AI_BREAKER_THRESHOLD', '5')),
+    reset_timeout=float(os.environ.get('AI_BREAKER_RESET', '30'))
+)
+_slots = PrioritySlots(MAX_CONCURRENCY)
+_client: Any = None
+_client_key: Optional[str] = None
+_client_lock = threading.Lock()
+
+
+def get_client(api_key: str) -> Any:
+    '''
+    Клиент OpenAI создаётся один раз на инстанс и держит keep-alive соединения
+    '''
+    global _client, _client_key
+    if _client is None or _client_key != api_key:
+        with _client_lock, span('client'):
+            if _client is None or _client_key != api_key:
+                import httpx
+                from openai import OpenAI
+
+                _client = OpenAI(
+                    api_key=api_key,
+                    base_url=os.environ.get('OPENAI_BASE_URL') or None,
+                    timeout=REQUEST_TIMEOUT,
+                    max_retries=0,
+                    http_client=httpx.Client(
+                        timeout=REQUEST_TIMEOUT,
+                        limits=httpx.Limits(
+                            max_connections=MAX_CONCURRENCY,
+                            max_keepalive_connections=MAX_CONCURRENCY,
+                            keepalive_expiry=120.0
+                        )
+                    )
+                )
+                _client_key = api_key
+    return _client
+
+
+@contextmanager
+def upstream_slot(timeout: float = REQUEST_TIMEOUT, priority: int = 0) -> Iterator[None]:
+    '''
+    Слот для вызова OpenAI; при нехватке слотов платные тарифы (больший priority) идут первыми
+    '''
+    with span('queue'):
+        acquired = _slots.acquire(priority, timeout)
+    if not acquired:
+        raise UpstreamUnavailable('Too many concurrent generations')
+    try:
+        yield
+    finally:
+        _slots.release()
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    '''
+    Экспоненциальная задержка с полным джиттером; Retry-After от сервера имеет приоритет
+    '''
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_CAP)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def create_completion(client: Any, **params: Any) -> Any:
+    '''
+    chat.completions.create с ретраями на 429/5xx и обрывы соединения.
+    Ошибки клиента (4xx) пробрасываются сразу и не размыкают предохранитель
+    '''
+    if not breaker.allow():
+        raise UpstreamUnavailable('OpenAI circuit is open')
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            with span('openai'):
+                response = client.chat.completions.create(**params)
+        except Exception as e:
+            if not _is_retryable(e):
+                breaker.record_success()
+                raise
+            if attempt == MAX_RETRIES:
+                breaker.record_failure()
+                raise UpstreamUnavailable(str(e)) from e
+            with span('backoff'):
+                time.sleep(backoff_delay(attempt, _retry_after(e)))
+            continue
+        breaker.record_success()
+        return response
@@ -0,0 +1,99 @@
+import json
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+
+def strip_code_fence(code: str) -> str:
+    code = code.strip()
+    if code.startswith('```'):
+        lines = code.split('\n')
+        code = '\n'.join(lines[1:-1]) if len(lines) > 2 else code
+    return code
+
+
+class FenceStripper:
+    '''
+    Потоковый аналог strip_code_fence: отбрасывает строку ```lang в начале
+    и последнюю строку в конце, придерживая только хвостовые пробелы
+    (и последнюю непустую строку, если код обёрнут в ```)
+    '''
+
+    def __init__(self):
+        self._head = ''
+        self._started = False
+        self._fenced = False
+        self._pending = ''
+
+    def feed(self, text: str) -> str:
+        if not self._started:
+            self._head = (self._head + text).lstrip()
+            if '\n' not in self._head:
+                return ''
+            first, rest = self._head.split('\n', 1)
+            self._fenced = first.startswith('```')
+            if self._fenced and '\n' not in rest.rstrip():
+                return ''
+            self._started = True
+            text = rest if self._fenced else self._head
+            self._head = ''
+        data = self._pending + text
+        safe = data.rstrip()
+        if self._fenced:
+            safe = safe[:max(safe.rfind('\n'), 0)]
+        self._pending = data[len(safe):]
+        return safe
+
+    def finish(self) -> str:
+        if not self._started:
+            return strip_code_fence(self._head)
+        return ''
+
+
+def sse_event(data: Dict[str, Any]) -> str:
+    return f'data: {json.dumps(data)}\n\n'
+
+
+def stream_events(
+    chunks: Iterable[Any],
+    on_complete: Optional[Callable[[str], None]] = None,
+    on_usage: Optional[Callable[[int], None]] = None
+) -> Iterator[str]:
+    '''
+    Превращает чанки OpenAI stream в SSE-события {"delta": ...},
+    последнее событие - {"done": true, "tokens": N, "ttft_ms": M}.
+    on_usage получает total_tokens, даже если клиент оборвал чтение
+    '''
+    started = time.monotonic()
+    stripper = FenceStripper()
+    parts = []
+    tokens = 0
+    ttft_ms = None
+
+    try:
+        for chunk in chunks:
+            usage = getattr(chunk, 'usage', None)
+            if usage:
+                tokens = usage.total_tokens
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content or ''
+            if not text:
+                continue
+            if ttft_ms is None:
+                ttft_ms = round((time.monotonic() - started) * 1000)
+            out = stripper.feed(text)
+            if out:
+                parts.append(out)
+                yield sse_event({'delta': out})
+    finally:
+        if on_usage is not None:
+            on_usage(tokens)
+
+    tail = stripper.finish()
+    if tail:
+        parts.append(tail)
+        yield sse_event({'delta': tail})
+
+    if on_complete is not None:
+        on_complete(''.join(parts))
+    yield sse_event({'done': True, 'demo': False, 'cached': False, 'tokens': tokens, 'ttft_ms': ttft_ms})
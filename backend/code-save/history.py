@@ -0,0 +1,365 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+SCHEMA = 't_p56286601_ai_app_creation_site'
+KEYFRAME_INTERVAL = int(os.environ.get('HISTORY_KEYFRAME_INTERVAL', '20'))
+MAX_DELTA_RATIO = 0.5
+
+
+def content_hash(code: str) -> str:
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+
+def project_code_sql(alias: str) -> str:
+    '''
+    SQL-выражение текущего кода проекта: собственная копия или, у форка без своих изменений,
+    общий блоб по code_hash
+    '''
+    return (
+        f'COALESCE({alias}.code, (SELECT fb.code FROM {SCHEMA}.code_blobs fb WHERE fb.hash = {alias}.code_hash))'
+    )
+
+
+def encode_delta(base: str, code: str) -> str:
+    '''
+    Построчный дифф: [start, end] - строки из базы, строка - вставленный текст
+    '''
+    from difflib import SequenceMatcher
+
+    base_lines = base.splitlines(keepends=True)
+    new_lines = code.splitlines(keepends=True)
+    ops: List[Any] = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, base_lines, new_lines).get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(new_lines[j1:j2]))
+    return json.dumps(ops, ensure_ascii=False, separators=(',', ':'))
+
+
+def apply_delta(base: str, delta: str) -> str:
+    base_lines = base.splitlines(keepends=True)
+    parts: List[str] = []
+    for op in json.loads(delta):
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(base_lines[op[0]:op[1]])
+    return ''.join(parts)
+
+
+def merge_messages(previous: Optional[str], message: str) -> str:
+    if not previous or previous == message or message in previous.split('; '):
+        return previous or message
+    return f'{previous}; {message}'[:500]
+
+
+def append_version(
+    conn: Any,
+    project_id: Any,
+    code: str,
+    change_message: str,
+    checkpoint: bool = False,
+    coalesce_window: float = 0
+) -> int:
+    '''
+    Добавляет версию в project_history: ссылка на уже сохранённый блоб с тем же хешем,
+    дельта к последнему ключевому кадру, либо новый ключевой кадр в code_blobs.
+    Если последняя версия моложе coalesce_window секунд и не является контрольной точкой,
+    она перезаписывается на месте вместо вставки новой строки; блоб перезаписанного кадра
+    удаляется, если на него больше ничего не ссылается
+    '''
+    code_hash = content_hash(code)
+    size = len(code.encode('utf-8'))
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""SELECT EXISTS (SELECT 1 FROM {SCHEMA}.code_blobs WHERE hash = %s),
+                k.id, k.code, k.dependents,
+                l.id, l.base_id, l.blob_hash, l.checkpoint, l.change_message, l.age, l.has_dependents
+            FROM (SELECT 1) one
+            LEFT JOIN LATERAL (
+                SELECT h.id, COALESCE(h.code, b.code) AS code,
+                    (SELECT COUNT(*) FROM {SCHEMA}.project_history d WHERE d.base_id = h.id) AS dependents
+                FROM {SCHEMA}.project_history h
+                LEFT JOIN {SCHEMA}.code_blobs b ON b.hash = h.blob_hash
+                WHERE h.project_id = %s AND (h.code IS NOT NULL OR h.blob_hash IS NOT NULL)
+                ORDER BY h.id DESC
+                LIMIT 1
+            ) k ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT h.id, h.base_id, h.blob_hash, h.checkpoint, h.change_message,
+                    EXTRACT(EPOCH FROM NOW() - h.created_at) AS age,
+                    EXISTS (SELECT 1 FROM {SCHEMA}.project_history d WHERE d.base_id = h.id) AS has_dependents
+                FROM {SCHEMA}.project_history h
+                WHERE h.project_id = %s
+                ORDER BY h.id DESC
+                LIMIT 1
+            ) l ON TRUE""",
+            (code_hash, project_id, project_id)
+        )
+        (blob_exists, keyframe_id, keyframe_code, dependents,
+         latest_id, latest_base_id, latest_blob_hash, latest_checkpoint, latest_message, latest_age,
+         latest_has_dependents) = cur.fetchone()
+
+        coalesce = (
+            coalesce_window > 0 and not checkpoint and latest_id is not None
+            and not latest_checkpoint and not latest_has_dependents
+            and latest_age is not None and latest_age < coalesce_window
+        )
+        if coalesce:
+            change_message = merge_messages(latest_message, change_message)
+            # перезаписываемая дельта остаётся привязанной к своему кадру;
+            # перезаписываемый кадр не может служить базой сам себе
+            use_delta = latest_base_id is not None and latest_base_id == keyframe_id
+        else:
+            use_delta = dependents is not None and dependents < KEYFRAME_INTERVAL - 1
+
+        delta = None
+        if not blob_exists and keyframe_id is not None and use_delta:
+            delta = encode_delta(keyframe_code, code)
+            if len(delta) > len(code) * MAX_DELTA_RATIO:
+                delta = None
+
+        if delta is None:
+            if not blob_exists:
+                cur.execute(
+                    f"""INSERT INTO {SCHEMA}.code_blobs (hash, code, size)
+                    VALUES (%s, %s, %s) ON CONFLICT (hash) DO NOTHING""",
+                    (code_hash, code, size)
+                )
+            payload = (None, code_hash, None, None)
+        else:
+            payload = (None, None, keyframe_id, delta)
+
+        if coalesce:
+            cur.execute(
+                f"""UPDATE {SCHEMA}.project_history
+                SET code = %s, blob_hash = %s, base_id = %s, delta = %s,
+                    content_hash = %s, code_size = %s, change_message = %s
+                WHERE id = %s RETURNING id""",
+                payload + (code_hash, size, change_message, latest_id)
+            )
+        else:
+            cur.execute(
+                f"""INSERT INTO {SCHEMA}.project_history
+                (project_id, code, blob_hash, base_id, delta, content_hash, code_size,
+                 change_message, checkpoint, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW()) RETURNING id""",
+                (project_id,) + payload + (code_hash, size, change_message, checkpoint)
+            )
+        version_id = cur.fetchone()[0]
+        if coalesce and latest_blob_hash and latest_blob_hash != payload[1]:
+            # перезаписанный кадр больше не держит свой блоб
+            _drop_unreferenced_blob(cur, latest_blob_hash)
+        return version_id
+
+
+def _drop_unreferenced_blob(cur: Any, blob_hash: str) -> None:
+    '''
+    Удаляет блоб, на который не ссылаются ни версии, ни форки без своей копии кода.
+    Параллельная запись, успевшая сослаться на тот же блоб, нарушила бы внешний ключ -
+    тогда блоб остаётся, его уберёт очистка в history-compact
+    '''
+    cur.execute('SAVEPOINT drop_blob')
+    try:
+        cur.execute(
+            f"""DELETE FROM {SCHEMA}.code_blobs b
+            WHERE b.hash = %s
+                AND NOT EXISTS (SELECT 1 FROM {SCHEMA}.project_history h WHERE h.blob_hash = b.hash)
+                AND NOT EXISTS (SELECT 1 FROM {SCHEMA}.projects p WHERE p.code_hash = b.hash AND p.code IS NULL)""",
+            (blob_hash,)
+        )
+    except Exception:
+        cur.execute('ROLLBACK TO SAVEPOINT drop_blob')
+    else:
+        cur.execute('RELEASE SAVEPOINT drop_blob')
+
+
+def fork_project(conn: Any, source_id: Any, user_id: Any, name: Optional[str] = None) -> Optional[int]:
+    '''
+    Копия при записи: новый проект ссылается на код источника по code_hash (projects.code = NULL),
+    история начинается с ключевого кадра на тот же блоб. Код копируется в code_blobs только если
+    его там ещё нет (один раз на источник); свою копию форк получает при первой записи с другим кодом.
+    None - источника нет
+    '''
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""WITH source AS (
+                SELECT id, name, description, language, code, code_hash,
+                    COALESCE(octet_length(code),
+                        (SELECT b.size FROM {SCHEMA}.code_blobs b WHERE b.hash = p.code_hash)) AS size
+                FROM {SCHEMA}.projects p
+                WHERE id = %s AND code_hash IS NOT NULL
+            ), blob AS (
+                INSERT INTO {SCHEMA}.code_blobs (hash, code, size)
+                SELECT code_hash, code, size FROM source WHERE code IS NOT NULL
+                ON CONFLICT (hash) DO NOTHING
+            ), forked AS (
+                INSERT INTO {SCHEMA}.projects
+                    (user_id, name, description, language, code, code_hash, status, forked_from)
+                SELECT %s, COALESCE(%s, name), description, language, NULL, code_hash, 'draft', id
+                FROM source
+                RETURNING id, code_hash
+            ), history AS (
+                INSERT INTO {SCHEMA}.project_history
+                    (project_id, blob_hash, content_hash, code_size, change_message, checkpoint, created_at)
+                SELECT forked.id, forked.code_hash, forked.code_hash, source.size,
+                    'Forked from project ' || source.id, TRUE, NOW()
+                FROM forked, source
+            )
+            SELECT id FROM forked""",
+            (source_id, user_id, name)
+        )
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def mark_checkpoint(conn: Any, project_id: Any, code: str, change_message: str) -> int:
+    '''
+    Закрывает текущую серию автосохранений: последняя версия с этим кодом
+    становится контрольной точкой, иначе добавляется новая
+    '''
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""SELECT id, change_message FROM {SCHEMA}.project_history
+            WHERE project_id = %s AND content_hash = %s
+                AND id = (SELECT MAX(id) FROM {SCHEMA}.project_history WHERE project_id = %s)""",
+            (project_id, content_hash(code), project_id)
+        )
+        latest = cur.fetchone()
+        if not latest:
+            return append_version(conn, project_id, code, change_message, checkpoint=True)
+        cur.execute(
+            f"""UPDATE {SCHEMA}.project_history SET checkpoint = TRUE, change_message = %s
+            WHERE id = %s""",
+            (merge_messages(latest[1], change_message), latest[0])
+        )
+        return latest[0]
+
+
+def project_stamp(conn: Any, project_id: Any) -> Optional[Tuple[Any, ...]]:
+    '''
+    Дешёвый валидатор для ETag без чтения кода: updated_at и хеш проекта,
+    id и хеш сообщения последней версии (mark_checkpoint меняет его без updated_at).
+    updated_at - TIMESTAMP без зоны, записанный NOW() в зоне сессии: он возвращается с этой зоной,
+    чтобы Last-Modified не сдвигался на её смещение. None - проекта нет
+    '''
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""SELECT p.updated_at AT TIME ZONE current_setting('TimeZone'), p.code_hash, l.id, l.message_hash
+            FROM {SCHEMA}.projects p
+            LEFT JOIN LATERAL (
+                SELECT h.id, md5(COALESCE(h.change_message, '')) AS message_hash
+                FROM {SCHEMA}.project_history h
+                WHERE h.project_id = p.id
+                ORDER BY h.id DESC
+                LIMIT 1
+            ) l ON TRUE
+            WHERE p.id = %s""",
+            (project_id,)
+        )
+        return cur.fetchone()
+
+
+def _lineage_sql() -> str:
+    '''
+    CTE lineage: проект и его предки по forked_from с тем же владельцем. Версии предка входят
+    в историю форка до точки форка - id первой версии потомка (id версий растут со временем);
+    у самого проекта граница before_id = NULL. Форк чужого шаблона начинает историю с себя:
+    черновики автора шаблона до публикации остаются закрытыми
+    '''
+    return f"""lineage AS (
+        SELECT p.id, p.user_id, p.forked_from, NULL::integer AS before_id
+        FROM {SCHEMA}.projects p
+        WHERE p.id = %s
+        UNION ALL
+        SELECT parent.id, parent.user_id, parent.forked_from,
+            COALESCE((SELECT MIN(c.id) FROM {SCHEMA}.project_history c WHERE c.project_id = child.id), 0)
+        FROM lineage child
+        JOIN {SCHEMA}.projects parent ON parent.id = child.forked_from AND parent.user_id = child.user_id
+    )"""
+
+
+def list_versions(
+    conn: Any,
+    project_id: Any,
+    limit: int,
+    cursor: Optional[Tuple[Any, ...]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[List[Any]]]:
+    '''
+    Метаданные версий без кода, keyset-пагинация по (created_at, id).
+    У форка за его версиями идут версии предков до точки форка (project_id - чья версия).
+    Возвращает страницу и ключ следующей страницы (или None)
+    '''
+    after = ''
+    params: List[Any] = [project_id]
+    if cursor:
+        after = 'AND (h.created_at, h.id) < (%s::timestamp, %s)'
+        params.extend(cursor[:2])
+    params.extend((limit + 1, limit + 1))
+    with conn.cursor() as cur:
+        # LIMIT внутри LATERAL - каждый проект цепочки читается по индексу (project_id, created_at)
+        cur.execute(
+            f"""WITH RECURSIVE {_lineage_sql()}
+            SELECT v.id, v.created_at, v.change_message, v.code_size, v.content_hash, v.project_id
+            FROM lineage l
+            CROSS JOIN LATERAL (
+                SELECT h.id, h.created_at, h.change_message, h.code_size, h.content_hash, h.project_id
+                FROM {SCHEMA}.project_history h
+                WHERE h.project_id = l.id AND (l.before_id IS NULL OR h.id < l.before_id) {after}
+                ORDER BY h.created_at DESC, h.id DESC
+                LIMIT %s
+            ) v
+            ORDER BY v.created_at DESC, v.id DESC
+            LIMIT %s""",
+            params
+        )
+        rows = cur.fetchall()
+
+    versions = [
+        {
+            'id': row[0],
+            'created_at': row[1],
+            'change_message': row[2],
+            'size': row[3],
+            'hash': row[4],
+            'project_id': row[5]
+        }
+        for row in rows[:limit]
+    ]
+    next_key = [rows[limit - 1][1], rows[limit - 1][0]] if len(rows) > limit else None
+    return versions, next_key
+
+
+def fetch_version(conn: Any, project_id: Any, version_id: Any) -> Optional[Dict[str, Any]]:
+    '''
+    Одна версия с восстановленным кодом (не более одной дельты); у форка - и версия предка
+    до точки форка, как в list_versions
+    '''
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""WITH RECURSIVE {_lineage_sql()}
+            SELECT h.id, h.created_at, h.change_message, h.code_size, h.content_hash,
+                COALESCE(h.code, hb.code), h.delta, COALESCE(k.code, kb.code), h.project_id
+            FROM {SCHEMA}.project_history h
+            LEFT JOIN {SCHEMA}.code_blobs hb ON hb.hash = h.blob_hash
+            LEFT JOIN {SCHEMA}.project_history k ON k.id = h.base_id
+            LEFT JOIN {SCHEMA}.code_blobs kb ON kb.hash = k.blob_hash
+            JOIN lineage l ON l.id = h.project_id AND (l.before_id IS NULL OR h.id < l.before_id)
+            WHERE h.id = %s""",
+            (project_id, version_id)
+        )
+        row = cur.fetchone()
+    if not row:
+        return None
+    return {
+        'id': row[0],
+        'created_at': row[1],
+        'change_message': row[2],
+        'size': row[3],
+        'hash': row[4],
+        'code': row[5] if row[5] is not None else apply_delta(row[7], row[6]),
+        'project_id': row[8]
+    }
@@ -1,167 +1,195 @@
 import json
 import os
-import psycopg2
 from typing import Dict, Any
 
+# первым: при IMPORT_PROFILE=1 timing замеряет загрузку остальных модулей
+from timing import instrumented
+from db import get_db_connection, release_db_connection
+from history import (
+    append_version, content_hash, fetch_version, list_versions, mark_checkpoint, project_code_sql,
+    project_stamp
+)
+from pagination import decode_cursor, encode_cursor, parse_keyset_cursor, parse_limit
+from patch import apply_edits
+from response import (
+    error_response, json_response, make_etag, matching_etag, not_modified_response,
+    options_response, validator_headers
+)
+
+COALESCE_WINDOW = float(os.environ.get('SAVE_COALESCE_WINDOW', '60'))
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Сохранение кода проекта с версионированием
     Методы: POST /save - сохранить код, GET /history - получить историю версий
+    POST: автосохранения в пределах SAVE_COALESCE_WINDOW секунд сливаются в одну версию,
+    checkpoint: true закрывает серию и создаёт отдельную версию
+    POST {base_hash, edits: [{start, end, text}]} - патч к текущему коду вместо полного code;
+    если код уже не совпадает с base_hash - 409 с current_hash, клиент отправляет код целиком
+    GET ?project_id=X - текущий код и первая страница истории (только метаданные)
+    GET ?project_id=X&cursor=C&limit=N - следующая страница истории
+    GET ?project_id=X&version_id=Y - код одной версии
+    Страницы истории отдаются с ETag; If-None-Match - 304 без чтения кода
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Project-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+        return options_response('GET, POST, OPTIONS', 'Content-Type, X-User-Id, X-Project-Id, If-None-Match')
     
     dsn = os.environ.get('DATABASE_URL')
     if not dsn:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'DATABASE_URL not configured'}),
-            'isBase64Encoded': False
-        }
+        return error_response(500, 'DATABASE_URL not configured')
     
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
+    # соединение берётся только после валидации: ошибки 400 не трогают пул и не загружают psycopg2
+    conn = None
+    cur = None
+    error = None
     
     try:
         if method == 'POST':
             body = json.loads(event.get('body', '{}'))
             project_id = body.get('project_id')
-            code = body.get('code', '')
+            edits = body.get('edits')
             change_message = body.get('change_message', 'Автосохранение')
+            checkpoint = bool(body.get('checkpoint', False))
             
             if not project_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'project_id required'}),
-                    'isBase64Encoded': False
-                }
+                return error_response(400, 'project_id required')
+            
+            if edits is not None:
+                base_hash = body.get('base_hash')
+                if not base_hash:
+                    return error_response(400, 'base_hash required for edits')
+            
+            conn = get_db_connection()
+            cur = conn.cursor()
+            if edits is not None:
+                cur.execute(
+                    f"""SELECT {project_code_sql('p')}, p.code_hash
+                    FROM t_p56286601_ai_app_creation_site.projects p 
+                    WHERE p.id = %s FOR UPDATE""",
+                    (project_id,)
+                )
+                current = cur.fetchone()
+                if not current:
+                    return error_response(404, 'Project not found')
+                if current[1] != base_hash:
+                    return json_response(409, {
+                        'error': 'Base version mismatch',
+                        'current_hash': current[1]
+                    })
+                try:
+                    code = apply_edits(current[0] or '', edits)
+                except ValueError as e:
+                    return error_response(400, str(e))
+            else:
+                code = body.get('code', '')
             
+            code_hash = content_hash(code)
             cur.execute(
-                "UPDATE t_p56286601_ai_app_creation_site.projects SET code = %s, updated_at = NOW() WHERE id = %s RETURNING id",
-                (code, project_id)
+                """UPDATE t_p56286601_ai_app_creation_site.projects 
+                SET code = %s, code_hash = %s, version = version + 1, updated_at = NOW() 
+                WHERE id = %s AND code_hash IS DISTINCT FROM %s 
+                RETURNING id, version""",
+                (code, code_hash, project_id, code_hash)
             )
             result = cur.fetchone()
             
             if not result:
-                conn.close()
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Project not found'}),
-                    'isBase64Encoded': False
-                }
+                cur.execute(
+                    "SELECT 1 FROM t_p56286601_ai_app_creation_site.projects WHERE id = %s",
+                    (project_id,)
+                )
+                if cur.fetchone():
+                    if checkpoint:
+                        mark_checkpoint(conn, project_id, code, change_message)
+                        conn.commit()
+                    return json_response(200, {
+                        'success': True,
+                        'unchanged': True,
+                        'message': 'Code unchanged',
+                        'hash': code_hash
+                    }, event)
+                return error_response(404, 'Project not found')
             
-            cur.execute(
-                """INSERT INTO t_p56286601_ai_app_creation_site.project_history 
-                (project_id, code, change_message, created_at) 
-                VALUES (%s, %s, %s, NOW())""",
-                (project_id, code, change_message)
+            version_id = append_version(
+                conn, project_id, code, change_message,
+                checkpoint=checkpoint, coalesce_window=COALESCE_WINDOW
             )
             
             conn.commit()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'message': 'Code saved successfully'
-                }),
-                'isBase64Encoded': False
-            }
+            
+            return json_response(200, {
+                'success': True,
+                'message': 'Code saved successfully',
+                'version_id': version_id,
+                'version': result[1],
+                'hash': code_hash
+            }, event)
         
         elif method == 'GET':
             params = event.get('queryStringParameters', {}) or {}
             project_id = params.get('project_id')
             
             if not project_id:
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'project_id required'}),
-                    'isBase64Encoded': False
-                }
+                return error_response(400, 'project_id required')
             
-            cur.execute(
-                """SELECT p.code as current_code, p.updated_at 
-                FROM t_p56286601_ai_app_creation_site.projects p 
-                WHERE p.id = %s""",
-                (project_id,)
-            )
-            project_data = cur.fetchone()
+            version_id = params.get('version_id')
+            if version_id:
+                conn = get_db_connection()
+                version = fetch_version(conn, project_id, version_id)
+                if not version:
+                    return error_response(404, 'Version not found')
+                return json_response(200, version, event)
             
-            if not project_data:
-                conn.close()
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Project not found'}),
-                    'isBase64Encoded': False
-                }
+            try:
+                cursor = parse_keyset_cursor(decode_cursor(params.get('cursor')))
+                limit = parse_limit(params.get('limit'), 50, 200)
+            except ValueError as e:
+                return error_response(400, str(e))
             
-            cur.execute(
-                """SELECT id, code, change_message, created_at 
-                FROM t_p56286601_ai_app_creation_site.project_history 
-                WHERE project_id = %s 
-                ORDER BY created_at DESC 
-                LIMIT 50""",
-                (project_id,)
-            )
-            history_rows = cur.fetchall()
-            
-            history = [
-                {
-                    'id': row[0],
-                    'code': row[1],
-                    'change_message': row[2],
-                    'created_at': row[3].isoformat() if row[3] else None
-                }
-                for row in history_rows
-            ]
-            
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'current_code': project_data[0],
-                    'updated_at': project_data[1].isoformat() if project_data[1] else None,
-                    'history': history
-                }),
-                'isBase64Encoded': False
-            }
+            conn = get_db_connection()
+            cur = conn.cursor()
+            stamp = project_stamp(conn, project_id)
+            if not stamp:
+                return error_response(404, 'Project not found')
+            
+            etag = make_etag('history', project_id, *stamp, params.get('cursor'), limit)
+            matched = matching_etag(event, etag)
+            if matched:
+                return not_modified_response(matched, stamp[0])
+            
+            response_data: Dict[str, Any] = {}
+            if cursor is None:
+                cur.execute(
+                    f"""SELECT {project_code_sql('p')} as current_code, p.updated_at, p.code_hash 
+                    FROM t_p56286601_ai_app_creation_site.projects p 
+                    WHERE p.id = %s""",
+                    (project_id,)
+                )
+                project_data = cur.fetchone()
+                
+                if not project_data:
+                    return error_response(404, 'Project not found')
+                
+                response_data['current_code'] = project_data[0]
+                response_data['updated_at'] = project_data[1]
+                response_data['code_hash'] = project_data[2]
+            
+            versions, next_key = list_versions(conn, project_id, limit, cursor)
+            response_data['history'] = versions
+            response_data['next_cursor'] = encode_cursor(*next_key) if next_key else None
+            
+            return json_response(200, response_data, event, validator_headers(etag, stamp[0]))
         
-        conn.close()
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+        return error_response(405, 'Method not allowed')
     
     except Exception as e:
+        error = e
+        return error_response(500, str(e))
+    finally:
         if conn:
-            conn.close()
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+            if cur and not conn.closed:
+                cur.close()
+            release_db_connection(conn, error)
@@ -0,0 +1,44 @@
+from typing import Any, List
+
+MAX_EDITS = 1000
+
+
+def apply_edits(code: str, edits: List[Any]) -> str:
+    '''
+    Применяет правки [{start, end, text}] к базовой версии кода.
+    Смещения - в UTF-16 code units (как индексы строк JS) относительно базы,
+    правки не должны пересекаться
+    '''
+    if not isinstance(edits, list) or len(edits) > MAX_EDITS:
+        raise ValueError(f'edits must be a list of at most {MAX_EDITS} items')
+
+    data = code.encode('utf-16-le')
+    units = len(data) // 2
+    spans = []
+    for edit in edits:
+        if not isinstance(edit, dict):
+            raise ValueError('Invalid edit')
+        start, end, text = edit.get('start'), edit.get('end', edit.get('start')), edit.get('text', '')
+        if (
+            not isinstance(start, int) or not isinstance(end, int) or not isinstance(text, str)
+            or isinstance(start, bool) or isinstance(end, bool)
+            or not 0 <= start <= end <= units
+        ):
+            raise ValueError('Invalid edit range')
+        spans.append((start, end, text))
+
+    spans.sort(key=lambda span: (span[0], span[1]))
+    parts: List[bytes] = []
+    position = 0
+    for start, end, text in spans:
+        if start < position:
+            raise ValueError('Overlapping edits')
+        parts.append(data[position * 2:start * 2])
+        parts.append(text.encode('utf-16-le', 'surrogatepass'))
+        position = end
+    parts.append(data[position * 2:])
+
+    try:
+        return b''.join(parts).decode('utf-16-le')
+    except UnicodeDecodeError:
+        raise ValueError('Edit splits a surrogate pair')
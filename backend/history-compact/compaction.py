@@ -0,0 +1,353 @@
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from history import KEYFRAME_INTERVAL, MAX_DELTA_RATIO, SCHEMA, apply_delta, content_hash, encode_delta
+
+KEEP_ALL_SECONDS = int(os.environ.get('HISTORY_KEEP_ALL_SECONDS', '3600'))
+KEEP_HOURLY_SECONDS = int(os.environ.get('HISTORY_KEEP_HOURLY_SECONDS', '86400'))
+KEEP_DAILY_SECONDS = int(os.environ.get('HISTORY_KEEP_DAILY_SECONDS', str(30 * 86400)))
+BATCH_SIZE = int(os.environ.get('HISTORY_COMPACT_BATCH', '500'))
+AUTO_MESSAGES = ['Автосохранение', 'Code updated']
+
+
+def _candidates(cur: Any, project_id: Any, limit: Optional[int]) -> List[Tuple[int, int]]:
+    '''
+    Версии, не попадающие в политику хранения: всё за последний KEEP_ALL_SECONDS,
+    последняя версия каждого часа за KEEP_HOURLY_SECONDS и каждого дня за KEEP_DAILY_SECONDS.
+    Контрольные точки, версии с собственным сообщением, последняя версия
+    и последний ключевой кадр проекта (на него пишет append_version) сохраняются всегда.
+    Новые версии идут первыми: к удалению кадра его удаляемые дельты уже удалены
+    и перекодировать приходится только оставшиеся. Возвращает (id, байты кода/дельты в строке)
+    '''
+    cur.execute(
+        f"""SELECT id, octet_length(COALESCE(code, '')) + octet_length(COALESCE(delta, ''))
+        FROM (
+            SELECT h.*,
+                ROW_NUMBER() OVER (ORDER BY created_at DESC, id DESC) AS rn,
+                ROW_NUMBER() OVER (PARTITION BY bucket ORDER BY created_at DESC, id DESC) AS bucket_rn,
+                MAX(id) FILTER (WHERE code IS NOT NULL OR blob_hash IS NOT NULL) OVER () AS keyframe_id
+            FROM (
+                SELECT id, code, delta, blob_hash, checkpoint, change_message, created_at,
+                    CASE
+                        WHEN created_at >= NOW() - make_interval(secs => %s) THEN 'all:' || id
+                        WHEN created_at >= NOW() - make_interval(secs => %s)
+                            THEN 'hour:' || date_trunc('hour', created_at)
+                        WHEN created_at >= NOW() - make_interval(secs => %s)
+                            THEN 'day:' || date_trunc('day', created_at)
+                    END AS bucket
+                FROM {SCHEMA}.project_history
+                WHERE project_id = %s
+            ) h
+        ) ranked
+        WHERE rn > 1 AND id <> keyframe_id AND NOT checkpoint
+            AND (bucket IS NULL OR bucket_rn > 1)
+            AND string_to_array(COALESCE(change_message, ''), '; ') <@ (%s::text[] || ''::text)
+        ORDER BY id DESC
+        LIMIT %s""",
+        (KEEP_ALL_SECONDS, KEEP_HOURLY_SECONDS, KEEP_DAILY_SECONDS, project_id, AUTO_MESSAGES, limit)
+    )
+    return cur.fetchall()
+
+
+def _store_keyframe(cur: Any, version_id: int, code: str) -> int:
+    code_hash = content_hash(code)
+    size = len(code.encode('utf-8'))
+    cur.execute(
+        f"""INSERT INTO {SCHEMA}.code_blobs (hash, code, size)
+        VALUES (%s, %s, %s) ON CONFLICT (hash) DO NOTHING RETURNING size""",
+        (code_hash, code, size)
+    )
+    added = size if cur.fetchone() else 0
+    cur.execute(
+        f"""UPDATE {SCHEMA}.project_history SET code = NULL, blob_hash = %s, base_id = NULL, delta = NULL
+        WHERE id = %s""",
+        (code_hash, version_id)
+    )
+    return added
+
+
+def _rebase_dependents(cur: Any, doomed: List[int]) -> Tuple[int, int]:
+    '''
+    Дельты, чей ключевой кадр удаляется: старшая становится новым кадром,
+    остальные перекодируются относительно неё. Возвращает (число строк, байты сверх прежних)
+    '''
+    cur.execute(
+        f"""SELECT d.id, d.base_id, d.delta, COALESCE(k.code, kb.code)
+        FROM {SCHEMA}.project_history d
+        JOIN {SCHEMA}.project_history k ON k.id = d.base_id
+        LEFT JOIN {SCHEMA}.code_blobs kb ON kb.hash = k.blob_hash
+        WHERE d.base_id = ANY(%s) AND NOT d.id = ANY(%s)
+        ORDER BY d.base_id, d.id
+        FOR UPDATE OF d""",
+        (doomed, doomed)
+    )
+    rebased = 0
+    added = 0
+    new_base: Optional[Tuple[int, int, str]] = None
+    for version_id, base_id, delta, base_code in cur.fetchall():
+        code = apply_delta(base_code, delta)
+        added -= len(delta.encode('utf-8'))
+        rebased += 1
+        if new_base is None or new_base[0] != base_id:
+            added += _store_keyframe(cur, version_id, code)
+            new_base = (base_id, version_id, code)
+            continue
+        new_delta = encode_delta(new_base[2], code)
+        if len(new_delta) > len(code) * MAX_DELTA_RATIO:
+            added += _store_keyframe(cur, version_id, code)
+            continue
+        cur.execute(
+            f"UPDATE {SCHEMA}.project_history SET base_id = %s, delta = %s WHERE id = %s",
+            (new_base[1], new_delta, version_id)
+        )
+        added += len(new_delta.encode('utf-8'))
+    return rebased, added
+
+
+def compact_project(conn: Any, project_id: Any, deadline: Optional[float] = None) -> Dict[str, Any]:
+    '''
+    Удаляет версии вне политики хранения партиями по BATCH_SIZE, каждая партия -
+    отдельная транзакция; после каждой удаляются осиротевшие блобы
+    '''
+    report = {'deleted_versions': 0, 'deleted_blobs': 0, 'rebased': 0, 'reclaimed_bytes': 0, 'complete': True}
+    with conn.cursor() as cur:
+        while True:
+            if deadline is not None and time.monotonic() > deadline:
+                report['complete'] = False
+                break
+            doomed = [row[0] for row in _candidates(cur, project_id, BATCH_SIZE)]
+            if not doomed:
+                break
+
+            rebased, added = _rebase_dependents(cur, doomed)
+            cur.execute(
+                f"""DELETE FROM {SCHEMA}.project_history WHERE id = ANY(%s)
+                RETURNING blob_hash, octet_length(COALESCE(code, '')) + octet_length(COALESCE(delta, ''))""",
+                (doomed,)
+            )
+            deleted = cur.fetchall()
+            hashes = list({row[0] for row in deleted if row[0]})
+            blobs: List[Tuple[int]] = []
+            if hashes:
+                cur.execute(
+                    f"""DELETE FROM {SCHEMA}.code_blobs b
+                    WHERE b.hash = ANY(%s)
+                        AND NOT EXISTS (SELECT 1 FROM {SCHEMA}.project_history h WHERE h.blob_hash = b.hash)
+                        AND NOT EXISTS (
+                            SELECT 1 FROM {SCHEMA}.projects p WHERE p.code_hash = b.hash AND p.code IS NULL
+                        )
+                    RETURNING size""",
+                    (hashes,)
+                )
+                blobs = cur.fetchall()
+            conn.commit()
+
+            report['deleted_versions'] += len(deleted)
+            report['deleted_blobs'] += len(blobs)
+            report['rebased'] += rebased
+            report['reclaimed_bytes'] += sum(row[1] for row in deleted) + sum(row[0] for row in blobs) - added
+            if len(deleted) < len(doomed) or len(doomed) < BATCH_SIZE:
+                break
+    return report
+
+
+def backfill_project(conn: Any, project_id: Any, deadline: Optional[float] = None) -> Dict[str, Any]:
+    '''
+    Перекодирует версии с полным кодом в строке (записанные до V0002/V0003) так же, как append_version:
+    дельта к предыдущему кадру, пока у него меньше KEYFRAME_INTERVAL - 1 зависимых и дельта выгодна,
+    иначе ключевой кадр в code_blobs. Кадрами остаются версии, на которые уже ссылаются дельты,
+    и последний кадр проекта - на него может писать append_version.
+    Партии по BATCH_SIZE в порядке id, каждая - отдельная транзакция
+    '''
+    report = {'reencoded': 0, 'reclaimed_bytes': 0, 'complete': True}
+    base: Optional[List[Any]] = None
+    with conn.cursor() as cur:
+        while True:
+            if deadline is not None and time.monotonic() > deadline:
+                report['complete'] = False
+                break
+            cur.execute(
+                f"""SELECT h.id, h.code,
+                    (SELECT COUNT(*) FROM {SCHEMA}.project_history d WHERE d.base_id = h.id),
+                    h.id = (
+                        SELECT MAX(k.id) FROM {SCHEMA}.project_history k
+                        WHERE k.project_id = h.project_id AND (k.code IS NOT NULL OR k.blob_hash IS NOT NULL)
+                    )
+                FROM {SCHEMA}.project_history h
+                WHERE h.project_id = %s AND h.code IS NOT NULL
+                ORDER BY h.id
+                LIMIT %s
+                FOR UPDATE""",
+                (project_id, BATCH_SIZE)
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+
+            reclaimed = 0
+            for version_id, code, dependents, latest_keyframe in rows:
+                reclaimed += len(code.encode('utf-8'))
+                delta = None
+                if base is not None and not dependents and not latest_keyframe and base[2] < KEYFRAME_INTERVAL - 1:
+                    delta = encode_delta(base[1], code)
+                    if len(delta) > len(code) * MAX_DELTA_RATIO:
+                        delta = None
+                if delta is None:
+                    reclaimed -= _store_keyframe(cur, version_id, code)
+                    base = [version_id, code, dependents]
+                    continue
+                cur.execute(
+                    f"""UPDATE {SCHEMA}.project_history SET code = NULL, base_id = %s, delta = %s
+                    WHERE id = %s""",
+                    (base[0], delta, version_id)
+                )
+                reclaimed -= len(delta.encode('utf-8'))
+                base[2] += 1
+            conn.commit()
+
+            report['reencoded'] += len(rows)
+            report['reclaimed_bytes'] += reclaimed
+            if len(rows) < BATCH_SIZE:
+                break
+    return report
+
+
+def backfill_legacy(conn: Any, project_id: Any = None, deadline: Optional[float] = None) -> Dict[str, Any]:
+    '''
+    backfill_project для одного проекта или всех, у которых остались версии с кодом в строке
+    (частичный индекс idx_project_history_legacy_code)
+    '''
+    if project_id is not None:
+        project_ids = [project_id]
+    else:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""SELECT DISTINCT project_id FROM {SCHEMA}.project_history
+                WHERE code IS NOT NULL
+                ORDER BY project_id"""
+            )
+            project_ids = [row[0] for row in cur.fetchall()]
+        conn.commit()
+
+    totals = {'reencoded': 0, 'reclaimed_bytes': 0, 'complete': True}
+    for pid in project_ids:
+        report = backfill_project(conn, pid, deadline)
+        totals['reencoded'] += report['reencoded']
+        totals['reclaimed_bytes'] += report['reclaimed_bytes']
+        if not report['complete']:
+            totals['complete'] = False
+            break
+    return totals
+
+
+def sweep_blobs(conn: Any, deadline: Optional[float] = None) -> Dict[str, Any]:
+    '''
+    Удаляет блобы, на которые не ссылаются ни версии, ни форки без своей копии кода
+    (projects.code IS NULL), - в том числе оставшиеся после сбоев и гонок, которые
+    compact_project не видит: он проверяет только блобы удаляемых версий.
+    Партии по BATCH_SIZE в порядке hash, каждая - отдельная транзакция; SKIP LOCKED
+    пропускает блобы, на которые сейчас ссылается незавершённая запись
+    '''
+    report = {'deleted_blobs': 0, 'reclaimed_bytes': 0, 'complete': True}
+    after = ''
+    with conn.cursor() as cur:
+        while True:
+            if deadline is not None and time.monotonic() > deadline:
+                report['complete'] = False
+                break
+            cur.execute(
+                f"""WITH orphaned AS (
+                    SELECT b.hash FROM {SCHEMA}.code_blobs b
+                    WHERE b.hash > %s
+                        AND NOT EXISTS (SELECT 1 FROM {SCHEMA}.project_history h WHERE h.blob_hash = b.hash)
+                        AND NOT EXISTS (
+                            SELECT 1 FROM {SCHEMA}.projects p WHERE p.code_hash = b.hash AND p.code IS NULL
+                        )
+                    ORDER BY b.hash
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ), scanned AS (
+                    SELECT MAX(hash) AS last FROM orphaned
+                ), deleted AS (
+                    DELETE FROM {SCHEMA}.code_blobs b USING orphaned o WHERE b.hash = o.hash
+                    RETURNING b.size
+                )
+                SELECT (SELECT last FROM scanned), COUNT(*), COALESCE(SUM(size), 0) FROM deleted""",
+                (after, BATCH_SIZE)
+            )
+            last, count, size = cur.fetchone()
+            conn.commit()
+
+            report['deleted_blobs'] += count
+            report['reclaimed_bytes'] += int(size)
+            if count < BATCH_SIZE or last is None:
+                break
+            after = last
+    return report
+
+
+def plan_project(conn: Any, project_id: Any) -> Dict[str, Any]:
+    '''
+    Пробный прогон: сколько версий и байт строк будет удалено (без блобов и перекодирования)
+    '''
+    with conn.cursor() as cur:
+        rows = _candidates(cur, project_id, None)
+    return {'deleted_versions': len(rows), 'reclaimed_bytes': sum(row[1] for row in rows)}
+
+
+def compact(
+    conn: Any,
+    project_id: Any = None,
+    dry_run: bool = False,
+    time_budget: Optional[float] = None
+) -> Dict[str, Any]:
+    '''
+    Сжатие истории одного или всех проектов, у которых есть версии старше KEEP_ALL_SECONDS,
+    затем перекодирование оставшихся версий с кодом в строке (backfill_legacy);
+    полный прогон в конце убирает все блобы без ссылок (sweep_blobs)
+    '''
+    deadline = time.monotonic() + time_budget if time_budget else None
+    if project_id is not None:
+        project_ids = [project_id]
+    else:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""SELECT DISTINCT project_id FROM {SCHEMA}.project_history
+                WHERE created_at < NOW() - make_interval(secs => %s)
+                ORDER BY project_id""",
+                (KEEP_ALL_SECONDS,)
+            )
+            project_ids = [row[0] for row in cur.fetchall()]
+        conn.commit()
+
+    totals: Dict[str, Any] = {'projects': 0, 'deleted_versions': 0, 'reclaimed_bytes': 0, 'dry_run': dry_run}
+    if not dry_run:
+        totals.update({'deleted_blobs': 0, 'rebased': 0, 'reencoded': 0, 'complete': True})
+    for pid in project_ids:
+        if dry_run:
+            report = plan_project(conn, pid)
+        else:
+            report = compact_project(conn, pid, deadline)
+        totals['projects'] += 1
+        for key, value in report.items():
+            if key == 'complete':
+                totals['complete'] = totals['complete'] and value
+            else:
+                totals[key] += value
+        if not dry_run and not totals['complete']:
+            break
+    if dry_run:
+        conn.rollback()
+        return totals
+    if totals['complete']:
+        backfill = backfill_legacy(conn, project_id, deadline)
+        totals['reencoded'] += backfill['reencoded']
+        totals['reclaimed_bytes'] += backfill['reclaimed_bytes']
+        totals['complete'] = backfill['complete']
+    if project_id is None and totals['complete']:
+        swept = sweep_blobs(conn, deadline)
+        totals['deleted_blobs'] += swept['deleted_blobs']
+        totals['reclaimed_bytes'] += swept['reclaimed_bytes']
+        totals['complete'] = swept['complete']
+    return totals
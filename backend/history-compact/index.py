@@ -0,0 +1,69 @@
+import hmac
+import json
+import os
+from typing import Dict, Any
+
+# первым: при IMPORT_PROFILE=1 timing замеряет загрузку остальных модулей
+from timing import instrumented
+from compaction import compact
+from db import get_db_connection, release_db_connection
+from response import error_response, get_header, json_response, options_response
+
+TIME_BUDGET = float(os.environ.get('HISTORY_COMPACT_TIME_BUDGET', '50'))
+
+@instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Сжатие project_history по политике хранения, запускается по расписанию
+    POST {project_id?, dry_run?} - один проект или все; X-Compact-Token = HISTORY_COMPACT_TOKEN, без него - 403
+    Работает не дольше HISTORY_COMPACT_TIME_BUDGET секунд, complete: false - продолжит следующий запуск
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return options_response('POST, OPTIONS', 'Content-Type, X-Compact-Token')
+    
+    if method != 'POST':
+        return error_response(405, 'Method not allowed')
+    
+    # без настроенного токена сжатие закрыто: оно удаляет версии и блобы
+    token = os.environ.get('HISTORY_COMPACT_TOKEN')
+    if not token or not hmac.compare_digest(get_header(event, 'X-Compact-Token') or '', token):
+        return error_response(403, 'Forbidden')
+    
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except ValueError:
+        return error_response(400, 'Invalid JSON')
+    
+    conn = get_db_connection()
+    error = None
+    try:
+        report = compact(
+            conn,
+            project_id=body.get('project_id'),
+            dry_run=bool(body.get('dry_run', False)),
+            time_budget=TIME_BUDGET
+        )
+        return json_response(200, report)
+    except Exception as e:
+        error = e
+        if not conn.closed:
+            conn.rollback()
+        return error_response(500, str(e))
+    finally:
+        release_db_connection(conn, error)
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Compact project_history according to the retention policy')
+    parser.add_argument('--project', type=int, help='compact a single project')
+    parser.add_argument('--dry-run', action='store_true', help='only report what would be deleted')
+    args = parser.parse_args()
+    
+    connection = get_db_connection()
+    try:
+        print(json.dumps(compact(connection, project_id=args.project, dry_run=args.dry_run), indent=2))
+    finally:
+        release_db_connection(connection)
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from timing import connection_factory, span
+
+
+class ConnectionPool:
+    '''
+    Пул соединений с Postgres, переживающий тёплые вызовы функции.
+    Соединения проверяются перед выдачей, сломанные пересоздаются.
+    psycopg2 импортируется при первом обращении к базе, а не при загрузке функции.
+    '''
+
+    def __init__(self, dsn: str, max_size: int = 4, check_after: float = 30.0):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.check_after = check_after
+        self._idle: List[Any] = []
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def acquire(self, timeout: float = 10.0) -> Any:
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._available:
+                while not self._idle and self._in_use >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError('Connection pool exhausted')
+                    self._available.wait(remaining)
+                self._in_use += 1
+                idle = self._idle.pop() if self._idle else None
+
+            if idle is None:
+                break
+            conn, released_at = idle
+            if self._is_healthy(conn, released_at):
+                with self._lock:
+                    self.hits += 1
+                return conn
+            with self._available:
+                self._in_use -= 1
+                self._discard(conn)
+                self._available.notify()
+
+        with self._lock:
+            self.misses += 1
+        try:
+            import psycopg2
+
+            with span('connect'):
+                return psycopg2.connect(self.dsn, connection_factory=connection_factory())
+        except Exception:
+            with self._available:
+                self._in_use -= 1
+                self._available.notify()
+            raise
+
+    def release(self, conn: Any, broken: bool = False) -> None:
+        import psycopg2.extensions
+
+        if not broken and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        with self._available:
+            self._in_use -= 1
+            if broken or conn.closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'discarded': self.discarded,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'max_size': self.max_size
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                conn.close()
+
+    def _is_healthy(self, conn: Any, released_at: float) -> bool:
+        import psycopg2
+
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn: Any) -> None:
+        import psycopg2
+
+        self.discarded += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    os.environ['DATABASE_URL'],
+                    max_size=int(os.environ.get('DB_POOL_MAX_SIZE', '4')),
+                    check_after=float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+                )
+    return _pool
+
+
+def get_db_connection() -> Any:
+    with span('pool'):
+        return get_pool().acquire()
+
+
+def release_db_connection(conn: Any, error: Optional[BaseException] = None) -> None:
+    '''
+    Возвращает соединение в пул; после ошибок соединения оно закрывается.
+    '''
+    import psycopg2
+
+    broken = isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+    get_pool().release(conn, broken=broken)
@@ -1,91 +1,151 @@
-import json
 import hashlib
-from typing import Dict, Any
+import hmac
+import os
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Any, Optional
 
+# первым: при IMPORT_PROFILE=1 timing замеряет загрузку остальных модулей
+from timing import instrumented
+from db import get_db_connection, release_db_connection
+from response import error_response, json_response, options_response
+
+# без ключа уведомления отклоняются: подпись с известным ключом-заглушкой мог бы собрать кто угодно
+SECRET_KEY = os.environ.get('FREEKASSA_SECRET_KEY_2')
+# цены тарифов, как в handlePayment на главной
+PLAN_PRICES = {'basic': Decimal('990'), 'pro': Decimal('2990'), 'enterprise': Decimal('9990')}
+
+def parse_form(body: str) -> Dict[str, str]:
+    from urllib.parse import parse_qs
+    return {key: values[0] for key, values in parse_qs(body, keep_blank_values=True).items()}
+
+def resolve_plan(requested: str, amount: Decimal) -> Optional[str]:
+    '''
+    Тариф из us_plan, если сумма совпадает с его ценой; без us_plan - по сумме
+    '''
+    if requested:
+        return requested if PLAN_PRICES.get(requested) == amount else None
+    for plan, price in PLAN_PRICES.items():
+        if price == amount:
+            return plan
+    return None
+
+def parse_user_id(value: str) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     FreeKassa payment webhook handler
     Обрабатывает уведомления о платежах от FreeKassa
+    Каждый MERCHANT_ORDER_ID записывается в payments один раз; тариф пользователя
+    (us_user_id или us_email) обновляется в той же транзакции.
+    Повторные уведомления возвращают записанный результат (duplicate: true) без повторной работы.
+    Без FREEKASSA_SECRET_KEY_2 - 500 до проверки подписи
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+        return options_response('GET, POST, OPTIONS')
     
     if method == 'POST':
+        if not SECRET_KEY:
+            return error_response(500, 'FREEKASSA_SECRET_KEY_2 is not configured')
+        
         body_str = event.get('body', '{}')
+        conn = None
+        error = None
         
         try:
             if event.get('isBase64Encoded'):
                 import base64
                 body_str = base64.b64decode(body_str).decode('utf-8')
             
-            params = {}
-            if body_str:
-                for pair in body_str.split('&'):
-                    if '=' in pair:
-                        key, value = pair.split('=', 1)
-                        params[key] = value
+            params = parse_form(body_str or '')
             
             merchant_id = params.get('MERCHANT_ID', '')
             amount = params.get('AMOUNT', '')
             order_id = params.get('MERCHANT_ORDER_ID', '')
             sign = params.get('SIGN', '')
             
-            secret_key = 'YOUR_SECRET_KEY_2'
             expected_sign = hashlib.md5(
-                f"{merchant_id}:{amount}:{secret_key}:{order_id}".encode()
+                f"{merchant_id}:{amount}:{SECRET_KEY}:{order_id}".encode()
             ).hexdigest()
             
-            if sign == expected_sign:
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({
-                        'status': 'success',
-                        'message': 'Payment verified',
-                        'order_id': order_id
-                    }),
-                    'isBase64Encoded': False
-                }
-            else:
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Invalid signature'}),
-                    'isBase64Encoded': False
-                }
-                
+            # подпись проверяется до любого обращения к базе
+            if not hmac.compare_digest(sign.lower().encode(), expected_sign.encode()):
+                return error_response(400, 'Invalid signature')
+            
+            try:
+                paid = Decimal(amount)
+            except InvalidOperation:
+                return error_response(400, 'Invalid amount')
+            if not order_id or not paid.is_finite():
+                return error_response(400, 'MERCHANT_ORDER_ID and AMOUNT required')
+            
+            plan = resolve_plan(params.get('us_plan', ''), paid)
+            user_id = parse_user_id(params.get('us_user_id', ''))
+            email = params.get('us_email') or None
+            
+            conn = get_db_connection()
+            cur = conn.cursor()
+            # один запрос: запись в журнал и смена тарифа либо происходят вместе, либо
+            # (повторное уведомление) не происходят вовсе и строка пользователя не блокируется
+            cur.execute(
+                """WITH target AS (
+                    SELECT id FROM t_p56286601_ai_app_creation_site.users
+                    WHERE id = %s OR (%s::int IS NULL AND email = %s)
+                    LIMIT 1
+                ), inserted AS (
+                    INSERT INTO t_p56286601_ai_app_creation_site.payments
+                        (order_id, merchant_id, amount, provider_payment_id, user_id, plan, status)
+                    SELECT %s, %s, %s, %s, (SELECT id FROM target), %s,
+                           CASE WHEN %s::text IS NULL THEN 'amount_mismatch'
+                                WHEN EXISTS (SELECT 1 FROM target) THEN 'applied'
+                                ELSE 'unassigned' END
+                    ON CONFLICT (order_id) DO NOTHING
+                    RETURNING status, user_id, plan
+                ), upgraded AS (
+                    UPDATE t_p56286601_ai_app_creation_site.users u
+                    SET plan = inserted.plan, updated_at = CURRENT_TIMESTAMP
+                    FROM inserted
+                    WHERE u.id = inserted.user_id AND inserted.status = 'applied'
+                )
+                SELECT status, user_id, plan FROM inserted""",
+                (user_id, user_id, email,
+                 order_id, merchant_id, paid, params.get('intid') or None, plan, plan)
+            )
+            row = cur.fetchone()
+            duplicate = row is None
+            if duplicate:
+                cur.execute(
+                    """SELECT status, user_id, plan FROM t_p56286601_ai_app_creation_site.payments
+                    WHERE order_id = %s""",
+                    (order_id,)
+                )
+                row = cur.fetchone()
+            conn.commit()
+            cur.close()
+            
+            return json_response(200, {
+                'status': 'success',
+                'message': 'Payment verified',
+                'order_id': order_id,
+                'payment_status': row[0],
+                'user_id': row[1],
+                'plan': row[2],
+                'duplicate': duplicate
+            })
+        
         except Exception as e:
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': str(e)}),
-                'isBase64Encoded': False
-            }
+            error = e
+            if conn and not conn.closed:
+                conn.rollback()
+            return error_response(500, str(e))
+        finally:
+            if conn:
+                release_db_connection(conn, error)
     
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps({'error': 'Method not allowed'}),
-        'isBase64Encoded': False
-    }
+    return error_response(405, 'Method not allowed')
@@ -0,0 +1,209 @@
+import importlib
+import json
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Optional
+
+from timing import span
+
+COMPRESS_MIN_BYTES = 1024
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+_optional_modules: Dict[str, Any] = {}
+
+
+def _optional(name: str) -> Any:
+    '''
+    orjson/brotli грузятся при первом использовании: OPTIONS и ошибки валидации их не импортируют.
+    None - модуль не установлен
+    '''
+    if name not in _optional_modules:
+        try:
+            _optional_modules[name] = importlib.import_module(name)
+        except ImportError:
+            _optional_modules[name] = None
+    return _optional_modules[name]
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    from decimal import Decimal
+
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(payload: Any) -> bytes:
+    '''
+    JSON в UTF-8: orjson, если установлен, иначе stdlib с тем же форматом дат
+    '''
+    orjson = _optional('orjson')
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def options_response(methods: str, allow_headers: str = 'Content-Type') -> Dict[str, Any]:
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': methods,
+            'Access-Control-Allow-Headers': allow_headers,
+            'Access-Control-Max-Age': '86400'
+        },
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+
+def raw_response(
+    status: int,
+    body: bytes,
+    content_type: str,
+    event: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    '''
+    Ответ с телом в UTF-8; крупные тела сжимаются br/gzip по Accept-Encoding клиента
+    '''
+    response_headers = {**CORS_HEADERS, 'Content-Type': content_type}
+    if headers:
+        response_headers.update(headers)
+
+    encoding = None
+    if event is not None and len(body) >= COMPRESS_MIN_BYTES:
+        accepted = (get_header(event, 'Accept-Encoding') or '').lower()
+        with span('compress'):
+            brotli = _optional('brotli') if 'br' in accepted else None
+            if brotli is not None:
+                encoding, body = 'br', brotli.compress(body, quality=4)
+            elif 'gzip' in accepted:
+                import gzip
+
+                encoding, body = 'gzip', gzip.compress(body, compresslevel=5)
+
+    if encoding is None:
+        return {
+            'statusCode': status,
+            'headers': response_headers,
+            'body': body.decode('utf-8'),
+            'isBase64Encoded': False
+        }
+
+    import base64
+
+    response_headers['Content-Encoding'] = encoding
+    response_headers['Vary'] = 'Accept-Encoding'
+    if 'ETag' in response_headers:
+        # сильный ETag различается для каждого представления
+        response_headers['ETag'] = response_headers['ETag'][:-1] + f'-{encoding}"'
+    return {
+        'statusCode': status,
+        'headers': response_headers,
+        'body': base64.b64encode(body).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+def make_etag(*parts: Any) -> str:
+    import hashlib
+
+    digest = hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def http_date(value: datetime) -> str:
+    '''
+    Время без зоны считается UTC. Колонки TIMESTAMP хранят локальное время сессии Postgres -
+    их нужно читать с зоной (history.project_stamp), а не передавать сюда как есть
+    '''
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    from email.utils import format_datetime
+
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime] = None) -> Dict[str, str]:
+    '''
+    ETag/Last-Modified с no-cache: браузер хранит ответ и перепроверяет его через If-None-Match
+    '''
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'private, no-cache',
+        'Access-Control-Expose-Headers': 'ETag, Last-Modified'
+    }
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def opaque_etag(tag: str) -> str:
+    '''
+    Тег без W/, кавычек и суффикса кодировки - в том виде, в каком его собирает make_etag
+    '''
+    tag = tag.strip()
+    tag = tag[2:] if tag.startswith('W/') else tag
+    tag = tag.strip('"')
+    for suffix in ('-br', '-gzip'):
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)]
+    return tag
+
+
+def matching_etag(event: Dict[str, Any], etag: str) -> Optional[str]:
+    '''
+    Слабое сравнение If-None-Match (RFC 9110): W/ и суффикс кодировки игнорируются.
+    Возвращает совпавший тег клиента - его и нужно отдать в 304
+    '''
+    header = get_header(event, 'If-None-Match')
+    if not header:
+        return None
+    opaque = etag.strip('"')
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return etag
+        if opaque_etag(candidate) == opaque:
+            return candidate
+    return None
+
+
+def not_modified_response(etag: str, last_modified: Optional[datetime] = None) -> Dict[str, Any]:
+    return {
+        'statusCode': 304,
+        'headers': {**CORS_HEADERS, **validator_headers(etag, last_modified)},
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+
+def json_response(
+    status: int,
+    payload: Any,
+    event: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    with span('serialize'):
+        body = dumps(payload)
+    return raw_response(status, body, 'application/json', event, headers)
+
+
+def error_response(status: int, message: str) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': dict(JSON_HEADERS),
+        'body': json.dumps({'error': message}, ensure_ascii=False, separators=(',', ':')),
+        'isBase64Encoded': False
+    }
@@ -1,140 +1,287 @@
 import json
-import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, List, Optional, Tuple
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+# первым: при IMPORT_PROFILE=1 timing замеряет загрузку остальных модулей
+from timing import instrumented
+from db import get_db_connection, release_db_connection
+from history import append_version, content_hash, fork_project, list_versions, project_code_sql, project_stamp
+from pagination import decode_cursor, encode_cursor, parse_keyset_cursor, parse_limit
+from search import parse_query, parse_search_cursor, search_projects
+from workspace import export_workspace, import_workspace
+from response import (
+    dumps, error_response, get_header, json_response, make_etag, matching_etag, not_modified_response,
+    opaque_etag, options_response, raw_response, validator_headers
+)
 
+PROJECT_FIELDS = (
+    'id', 'user_id', 'name', 'description', 'language', 'code', 'code_hash',
+    'status', 'version', 'forked_from', 'created_at', 'updated_at'
+)
+
+def select_columns(fields: Any) -> str:
+    '''
+    Список колонок для SELECT/RETURNING по projects; code форка без своих изменений берётся из блоба
+    '''
+    return ', '.join(f"{project_code_sql('projects')} AS code" if f == 'code' else f for f in fields)
+
+# явный список вместо *: служебные колонки (search_vector) в ответы не попадают
+PROJECT_COLUMNS = select_columns(PROJECT_FIELDS)
+DEFAULT_LIST_FIELDS = tuple(f for f in PROJECT_FIELDS if f != 'code')
+NDJSON = 'application/x-ndjson'
+
+def parse_fields(value: str) -> List[str]:
+    '''
+    Проекция для списка проектов; id и updated_at нужны курсору всегда
+    '''
+    requested = [f.strip() for f in value.split(',') if f.strip()] if value else list(DEFAULT_LIST_FIELDS)
+    for field in requested:
+        if field not in PROJECT_FIELDS:
+            raise ValueError(f'Unknown field: {field}')
+    return ['id', 'updated_at'] + [f for f in requested if f not in ('id', 'updated_at')]
+
+def request_lines(event: Dict[str, Any]) -> Any:
+    '''
+    Тело запроса построчно, без копии целиком: base64 и Content-Encoding: gzip разворачиваются потоком
+    '''
+    import io
+    
+    body = event.get('body') or ''
+    raw = body.encode('utf-8') if isinstance(body, str) else body
+    if event.get('isBase64Encoded'):
+        import base64
+        raw = base64.b64decode(raw)
+    stream: Any = io.BytesIO(raw)
+    if 'gzip' in (get_header(event, 'Content-Encoding') or '').lower():
+        import gzip
+        stream = gzip.GzipFile(fileobj=stream)
+    return stream
+
+def dict_cursor(conn: Any) -> Any:
+    from psycopg2.extras import RealDictCursor
+    return conn.cursor(cursor_factory=RealDictCursor)
+
+def parse_precondition(event: Dict[str, Any], data: Dict[str, Any]) -> Tuple[Optional[int], Optional[str]]:
+    '''
+    Условие PUT: (версия, None) из If-Match: "N" или expected_version в теле,
+    (None, тег) из If-Match с ETag ответа GET ?id=; (None, None) - без проверки
+    '''
+    value = get_header(event, 'If-Match')
+    if value:
+        if value.strip() == '*':
+            return None, None
+        value = opaque_etag(value)
+        if not value.isdigit():
+            return None, value
+    else:
+        value = data.get('expected_version')
+    if value is None:
+        return None, None
+    try:
+        return int(value), None
+    except (TypeError, ValueError):
+        raise ValueError('Invalid expected version')
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Projects API - управление проектами пользователей
-    GET /projects?user_id=X - получить все проекты пользователя
+    GET /projects?user_id=X - получить проекты пользователя (без кода)
+    GET /projects?user_id=X&cursor=C&limit=N&fields=a,b - следующая страница, проекция полей
+    GET /projects?user_id=X&q=текст - поиск по name/description/code: rank, headline и snippet с <mark>
+    GET /projects?templates=1&cursor=C&limit=N - шаблоны (status = 'template') всех пользователей
     POST /projects - создать новый проект
-    PUT /projects - обновить проект
-    GET /projects/:id - получить проект по ID
+    POST /projects {user_id, fork_of, name?} - форк своего проекта или шаблона без копирования кода
+    PUT /projects - обновить проект; If-Match: "N" / expected_version или ETag из GET ?id= -
+    409, если проект уже изменился
+    GET /projects/:id - получить проект по ID (ETag; If-None-Match - 304 без чтения кода)
+    GET /projects?user_id=X&export=ndjson&cursor=C&limit=N - выгрузка проектов с историей в NDJSON
+    порциями по N проектов; последняя строка {"type": "end", "next_cursor"}
+    POST /projects?user_id=X, Content-Type: application/x-ndjson - загрузка выгрузки (201, счётчики)
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+        return options_response('GET, POST, PUT, OPTIONS', 'Content-Type, Content-Encoding, If-None-Match, If-Match')
     
+    # соединение берётся только после валидации: ошибки 400 не трогают пул и не загружают psycopg2
     conn = None
+    cursor = None
+    error = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
         if method == 'GET':
             params = event.get('queryStringParameters') or {}
             user_id = params.get('user_id')
             project_id = params.get('id')
             
+            if user_id and params.get('export'):
+                if params['export'] != 'ndjson':
+                    return error_response(400, 'export must be ndjson')
+                try:
+                    after = decode_cursor(params.get('cursor'), 1)
+                    if after and not isinstance(after[0], int):
+                        raise ValueError('Invalid cursor')
+                    limit = parse_limit(params.get('limit'), 20, 100)
+                except ValueError as e:
+                    return error_response(400, str(e))
+                
+                import io
+                
+                buffer = io.BytesIO()
+                conn = get_db_connection()
+                report = export_workspace(conn, user_id, buffer.write, after[0] if after else None, limit)
+                conn.commit()
+                next_cursor = encode_cursor(report['last_id']) if report['projects'] == limit else None
+                buffer.write(dumps({
+                    'type': 'end', 'projects': report['projects'], 'versions': report['versions'],
+                    'next_cursor': next_cursor
+                }) + b'\n')
+                return raw_response(200, buffer.getvalue(), NDJSON, event, {
+                    'Content-Disposition': f'attachment; filename="workspace-{user_id}.ndjson"'
+                })
+            
             if project_id:
+                conn = get_db_connection()
+                cursor = dict_cursor(conn)
+                # валидатор читается до данных: при гонке тело окажется новее тега, а не наоборот
+                stamp = project_stamp(conn, project_id)
+                if not stamp:
+                    return error_response(404, 'Project not found')
+                
+                etag = make_etag('project', project_id, *stamp)
+                matched = matching_etag(event, etag)
+                if matched:
+                    return not_modified_response(matched, stamp[0])
+                
                 cursor.execute(
-                    'SELECT * FROM projects WHERE id = %s',
+                    f'SELECT {PROJECT_COLUMNS} FROM projects WHERE id = %s',
                     (project_id,)
                 )
                 project = cursor.fetchone()
                 
                 if project:
-                    cursor.execute(
-                        'SELECT * FROM project_history WHERE project_id = %s ORDER BY created_at DESC LIMIT 10',
-                        (project_id,)
-                    )
-                    history = cursor.fetchall()
+                    history, _ = list_versions(conn, project_id, 10)
                     
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'project': dict(project),
-                            'history': [dict(h) for h in history]
-                        }, default=str),
-                        'isBase64Encoded': False
-                    }
+                    return json_response(
+                        200, {'project': project, 'history': history}, event,
+                        validator_headers(etag, stamp[0])
+                    )
                 else:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Project not found'}),
-                        'isBase64Encoded': False
-                    }
-            
-            elif user_id:
+                    return error_response(404, 'Project not found')
+            
+            elif user_id or params.get('templates'):
+                try:
+                    fields = parse_fields(params.get('fields', ''))
+                    page_cursor = decode_cursor(params.get('cursor'))
+                    limit = parse_limit(params.get('limit'), 50, 100)
+                    query = parse_query(params.get('q')) if user_id else ''
+                    search_after = parse_search_cursor(page_cursor) if query else None
+                    list_after = parse_keyset_cursor(page_cursor) if not query else None
+                except ValueError as e:
+                    return error_response(400, str(e))
+                
+                conn = get_db_connection()
+                cursor = dict_cursor(conn)
+                
+                if query:
+                    projects = search_projects(cursor, user_id, query, fields, search_after, limit)
+                    next_cursor = None
+                    if len(projects) > limit:
+                        projects = projects[:limit]
+                        next_cursor = encode_cursor(projects[-1]['rank'], projects[-1]['id'])
+                    return json_response(200, {'projects': projects, 'next_cursor': next_cursor}, event)
+                
+                owner = 'user_id = %s' if user_id else "status = 'template'"
+                query_params: List[Any] = [user_id] if user_id else []
+                after = ''
+                if list_after:
+                    after = 'AND (updated_at, id) < (%s::timestamp, %s)'
+                    query_params.extend(list_after)
+                query_params.append(limit + 1)
+                
                 cursor.execute(
-                    'SELECT * FROM projects WHERE user_id = %s ORDER BY updated_at DESC',
-                    (user_id,)
+                    f'''SELECT {select_columns(fields)} FROM projects 
+                       WHERE {owner} {after} 
+                       ORDER BY updated_at DESC, id DESC 
+                       LIMIT %s''',
+                    tuple(query_params)
                 )
                 projects = cursor.fetchall()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({
-                        'projects': [dict(p) for p in projects]
-                    }, default=str),
-                    'isBase64Encoded': False
-                }
+                next_cursor = None
+                if len(projects) > limit:
+                    projects = projects[:limit]
+                    next_cursor = encode_cursor(projects[-1]['updated_at'], projects[-1]['id'])
+                
+                return json_response(200, {'projects': projects, 'next_cursor': next_cursor}, event)
             else:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id or id parameter required'}),
-                    'isBase64Encoded': False
-                }
+                return error_response(400, 'user_id or id parameter required')
+        
+        elif method == 'POST' and NDJSON in (get_header(event, 'Content-Type') or ''):
+            user_id = (event.get('queryStringParameters') or {}).get('user_id')
+            if not user_id:
+                return error_response(400, 'user_id is required')
+            
+            conn = get_db_connection()
+            try:
+                report = import_workspace(conn, user_id, request_lines(event))
+            except LookupError as e:
+                conn.rollback()
+                return error_response(404, str(e))
+            except ValueError as e:
+                conn.rollback()
+                return error_response(400, str(e))
+            conn.commit()
+            
+            return json_response(201, report, event)
         
         elif method == 'POST':
             body_str = event.get('body', '{}')
             data = json.loads(body_str)
             
             user_id = data.get('user_id')
+            fork_of = data.get('fork_of')
+            
+            if fork_of is not None:
+                if not user_id:
+                    return error_response(400, 'user_id is required')
+                
+                conn = get_db_connection()
+                cursor = dict_cursor(conn)
+                cursor.execute('SELECT user_id, status FROM projects WHERE id = %s', (fork_of,))
+                source = cursor.fetchone()
+                if not source:
+                    return error_response(404, 'Project not found')
+                if source['status'] != 'template' and str(source['user_id']) != str(user_id):
+                    return error_response(403, 'Only templates and your own projects can be forked')
+                
+                project_id = fork_project(conn, fork_of, user_id, data.get('name'))
+                if project_id is None:
+                    return error_response(404, 'Project not found')
+                cursor.execute(f'SELECT {PROJECT_COLUMNS} FROM projects WHERE id = %s', (project_id,))
+                project = cursor.fetchone()
+                conn.commit()
+                
+                return json_response(201, {'project': project}, event)
+            
             name = data.get('name', 'Untitled Project')
             description = data.get('description', '')
             language = data.get('language', 'javascript')
             code = data.get('code', '')
             
             if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id is required'}),
-                    'isBase64Encoded': False
-                }
+                return error_response(400, 'user_id is required')
             
+            conn = get_db_connection()
+            cursor = dict_cursor(conn)
             cursor.execute(
-                '''INSERT INTO projects (user_id, name, description, language, code, status) 
-                   VALUES (%s, %s, %s, %s, %s, %s) RETURNING *''',
-                (user_id, name, description, language, code, 'draft')
+                '''INSERT INTO projects (user_id, name, description, language, code, code_hash, status) 
+                   VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING ''' + PROJECT_COLUMNS,
+                (user_id, name, description, language, code, content_hash(code), 'draft')
             )
             project = cursor.fetchone()
             conn.commit()
             
-            return {
-                'statusCode': 201,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'project': dict(project)}, default=str),
-                'isBase64Encoded': False
-            }
+            return json_response(201, {'project': project}, event)
         
         elif method == 'PUT':
             body_str = event.get('body', '{}')
@@ -149,15 +296,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             change_message = data.get('change_message')
             
             if not project_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'project id is required'}),
-                    'isBase64Encoded': False
-                }
+                return error_response(400, 'project id is required')
+            
+            try:
+                expected_version, expected_etag = parse_precondition(event, data)
+            except ValueError as e:
+                return error_response(400, str(e))
             
             update_fields = []
-            update_values = []
+            update_values: List[Any] = []
             
             if name is not None:
                 update_fields.append('name = %s')
@@ -169,58 +316,118 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 update_fields.append('language = %s')
                 update_values.append(language)
             if code is not None:
+                code_hash = content_hash(code)
                 update_fields.append('code = %s')
                 update_values.append(code)
+                update_fields.append('code_hash = %s')
+                update_values.append(code_hash)
             if status is not None:
                 update_fields.append('status = %s')
                 update_values.append(status)
             
+            update_fields.append('version = version + 1')
             update_fields.append('updated_at = CURRENT_TIMESTAMP')
-            update_values.append(project_id)
+            # id для блокировки prev и для самого UPDATE
+            update_values.extend((project_id, project_id))
             
-            if update_fields:
-                query = f"UPDATE projects SET {', '.join(update_fields)} WHERE id = %s RETURNING *"
-                cursor.execute(query, tuple(update_values))
-                project = cursor.fetchone()
-                
-                if code is not None:
-                    cursor.execute(
-                        'INSERT INTO project_history (project_id, code, change_message) VALUES (%s, %s, %s)',
-                        (project_id, code, change_message or 'Code updated')
-                    )
-                
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'project': dict(project)}, default=str),
-                    'isBase64Encoded': False
-                }
+            conn = get_db_connection()
+            cursor = dict_cursor(conn)
+            
+            if expected_etag is not None:
+                # тег собирается из нескольких таблиц: строка блокируется до сравнения,
+                # и UPDATE ниже проверяет уже версию, под которой тег совпал
+                cursor.execute('SELECT version FROM projects WHERE id = %s FOR UPDATE', (project_id,))
+                current = cursor.fetchone()
+                if not current:
+                    return error_response(404, 'Project not found')
+                stamp = project_stamp(conn, project_id)
+                if opaque_etag(make_etag('project', project_id, *stamp)) != expected_etag:
+                    return json_response(409, {
+                        'error': 'Version conflict',
+                        'current_version': current['version']
+                    })
+                expected_version = current['version']
+            
+            version_check = ''
+            if expected_version is not None:
+                version_check = 'AND version = %s'
+                update_values.append(expected_version)
+            
+            # prev блокирует строку до чтения: параллельный PUT ждёт и сравнивает уже с новым кодом
+            cursor.execute(
+                f"""UPDATE projects SET {', '.join(update_fields)}
+                FROM (SELECT code_hash AS prev_hash FROM projects WHERE id = %s FOR UPDATE) prev
+                WHERE id = %s {version_check}
+                RETURNING {PROJECT_COLUMNS}, prev.prev_hash""",
+                tuple(update_values)
+            )
+            project = cursor.fetchone()
+            
+            if not project:
+                cursor.execute('SELECT version FROM projects WHERE id = %s', (project_id,))
+                current = cursor.fetchone()
+                if not current:
+                    return error_response(404, 'Project not found')
+                return json_response(409, {
+                    'error': 'Version conflict',
+                    'current_version': current['version']
+                })
+            
+            version_id = None
+            prev_hash = project.pop('prev_hash')
+            if code is not None and prev_hash != code_hash:
+                # неизменный код версию не создаёт; дельта или ключевой кадр - по правилам истории
+                version_id = append_version(conn, project_id, code, change_message or 'Code updated')
+            conn.commit()
+            
+            return json_response(200, {'project': project, 'version_id': version_id}, event)
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+        return error_response(405, 'Method not allowed')
         
     except Exception as e:
-        if conn:
+        error = e
+        if conn and not conn.closed:
             conn.rollback()
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+        return error_response(500, str(e))
     finally:
         if conn:
-            cursor.close()
-            conn.close()
+            if cursor and not conn.closed:
+                cursor.close()
+            release_db_connection(conn, error)
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    
+    parser = argparse.ArgumentParser(description='Export or import a user workspace as NDJSON')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='stream projects and history to a file or stdout')
+    export_parser.add_argument('--user-id', type=int, required=True)
+    export_parser.add_argument('--output', default='-', help='file path (.gz is compressed), - for stdout')
+    import_parser = commands.add_parser('import', help='load an export into a user workspace')
+    import_parser.add_argument('--user-id', type=int, required=True)
+    import_parser.add_argument('input', help='file path (.gz is decompressed), - for stdin')
+    args = parser.parse_args()
+    
+    def open_file(path: str, mode: str) -> Any:
+        if path == '-':
+            return sys.stdout.buffer if 'w' in mode else sys.stdin.buffer
+        if path.endswith('.gz'):
+            import gzip
+            return gzip.open(path, mode)
+        return open(path, mode)
+    
+    connection = get_db_connection()
+    try:
+        if args.command == 'export':
+            out = open_file(args.output, 'wb')
+            result = export_workspace(connection, args.user_id, out.write)
+            if out is not sys.stdout.buffer:
+                out.close()
+        else:
+            source = open_file(args.input, 'rb')
+            result = import_workspace(connection, args.user_id, source)
+        connection.commit()
+        print(json.dumps(result), file=sys.stderr)
+    finally:
+        release_db_connection(connection)
@@ -0,0 +1,52 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+
+def encode_cursor(*values: Any) -> str:
+    '''
+    Непрозрачный курсор для keyset-пагинации по (timestamp, id)
+    '''
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: Optional[str], size: int = 2) -> Optional[List[Any]]:
+    '''
+    Возвращает значения курсора; ValueError для повреждённого токена
+    '''
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def parse_keyset_cursor(values: Optional[List[Any]]) -> Optional[Tuple[datetime, int]]:
+    '''
+    Курсор (timestamp, id) из decode_cursor с проверкой типов: значения уходят в SQL как %s::timestamp,
+    и строка не в формате ISO иначе дала бы 500 с текстом ошибки базы вместо 400
+    '''
+    if values is None:
+        return None
+    moment, row_id = values
+    if not isinstance(moment, str) or isinstance(row_id, bool) or not isinstance(row_id, int):
+        raise ValueError('Invalid cursor')
+    try:
+        return datetime.fromisoformat(moment), row_id
+    except ValueError:
+        raise ValueError('Invalid cursor')
+
+
+def parse_limit(value: Optional[str], default: int, maximum: int) -> int:
+    try:
+        limit = int(value) if value else default
+    except ValueError:
+        raise ValueError('Invalid limit')
+    return max(1, min(limit, maximum))
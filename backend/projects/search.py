@@ -0,0 +1,144 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from history import project_code_sql
+
+MAX_QUERY_LENGTH = 200
+# ts_headline разбирает весь переданный текст: ему отдаётся окно кода вокруг первого вхождения
+# первого слова запроса, а не весь код (на 30 КБ кода это ~4 мс на строку)
+SNIPPET_CONTEXT_CHARS = 200
+SNIPPET_SOURCE_CHARS = 2000
+FALLBACK_SNIPPET_CHARS = 160
+
+# маркеры подсветки из ts_headline; в ответ уходят как <mark> поверх экранированного текста
+START_SEL = '⟦'
+STOP_SEL = '⟧'
+HEADLINE_OPTIONS = f'StartSel={START_SEL}, StopSel={STOP_SEL}, HighlightAll=true'
+SNIPPET_OPTIONS = (
+    f'StartSel={START_SEL}, StopSel={STOP_SEL}, MaxFragments=2, MaxWords=18, MinWords=6, '
+    'FragmentDelimiter=" … "'
+)
+
+# выражение совпадает с idx_projects_search_text_trgm (если pg_trgm есть), иначе индекс не используется
+SEARCH_TEXT = "(p.name || ' ' || coalesce(p.description, ''))"
+# подстрока в названии поднимает проект выше других совпадений
+NAME_MATCH_BONUS = 0.5
+
+
+def parse_query(value: Optional[str]) -> str:
+    query = ' '.join((value or '').split())
+    if len(query) > MAX_QUERY_LENGTH:
+        raise ValueError(f'q must be at most {MAX_QUERY_LENGTH} characters')
+    return query
+
+
+def parse_search_cursor(values: Optional[List[Any]]) -> Optional[Tuple[float, int]]:
+    '''
+    Курсор поиска - (rank, id); курсор списка (updated_at, id) сюда не подходит
+    '''
+    if values is None:
+        return None
+    rank, project_id = values
+    if isinstance(rank, bool) or not isinstance(rank, (int, float)) or not isinstance(project_id, int):
+        raise ValueError('Invalid cursor')
+    return float(rank), project_id
+
+
+def like_pattern(query: str) -> str:
+    return '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def search_projects(
+    cursor: Any, user_id: Any, query: str, fields: List[str],
+    after: Optional[Tuple[float, int]], limit: int
+) -> List[Dict[str, Any]]:
+    '''
+    Поиск по проектам пользователя: полнотекстовый по name/description/code с префиксами слов
+    ("dash" находит "Dashboard"). Совпадения собираются UNION'ом, чтобы каждая ветка шла по своему индексу:
+    search_vector - по GIN idx_projects_search_vector; форки без своих изменений (code = NULL) -
+    отдельной веткой по проектам пользователя, их вектор кода строится из общего блоба на лету;
+    подстрока в name/description ("board" находит "Dashboard", а также запросы без слов с пустым tsquery) -
+    ILIKE по триграммному индексу idx_projects_search_text_trgm при pg_trgm, иначе по строкам пользователя.
+    OR этих условий в одном WHERE индексами не обслуживается.
+    Ранг - ts_rank плюс NAME_MATCH_BONUS за подстроку в name; подсветка считается только для строк страницы;
+    без полнотекстового совпадения headline/snippet - name и начало description.
+    Возвращает до limit + 1 строк, отсортированных по (rank, id) по убыванию
+    '''
+    keyset = ''
+    params: List[Any] = [query, like_pattern(query), query, user_id, user_id, user_id, NAME_MATCH_BONUS]
+    if after:
+        keyset = 'WHERE (rank, id) < (%s, %s)'
+        params.extend(after)
+    params.append(limit + 1)
+    columns = ', '.join('code.code' if field == 'code' else f'p.{field}' for field in fields)
+
+    cursor.execute(
+        f"""WITH query AS (
+            SELECT (
+                SELECT to_tsquery('simple', string_agg(quote_literal(lexeme) || ':*', ' & '))
+                FROM unnest(to_tsvector('simple', %s))
+            ) AS tsq, %s::text AS pattern, lower(split_part(%s, ' ', 1)) AS word
+        ), matches AS (
+            -- tsquery - скалярный подзапрос (параметр плана), а не строка CTE в соединении:
+            -- только так условие @@ может идти по GIN-индексу
+            SELECT p.id FROM projects p
+            WHERE p.user_id = %s AND p.search_vector @@ (SELECT tsq FROM query)
+            UNION
+            SELECT p.id FROM projects p
+            JOIN code_blobs b ON b.hash = p.code_hash
+            WHERE p.user_id = %s AND p.code IS NULL
+              AND to_tsvector('simple', left(b.code, 100000)) @@ (SELECT tsq FROM query)
+            UNION
+            SELECT p.id FROM projects p
+            WHERE p.user_id = %s AND {SEARCH_TEXT} ILIKE (SELECT pattern FROM query)
+        ), ranked AS (
+            SELECT p.id,
+                   (coalesce(ts_rank(
+                       CASE WHEN shared.vector IS NULL THEN p.search_vector ELSE p.search_vector || shared.vector END,
+                       query.tsq
+                   ), 0)
+                    + CASE WHEN p.name ILIKE query.pattern THEN %s ELSE 0 END)::float8 AS rank
+            FROM matches
+            JOIN projects p ON p.id = matches.id
+            LEFT JOIN LATERAL (
+                SELECT setweight(to_tsvector('simple', left(b.code, 100000)), 'C') AS vector
+                FROM code_blobs b
+                WHERE p.code IS NULL AND b.hash = p.code_hash
+            ) shared ON TRUE, query
+        ), page AS (
+            SELECT id, rank FROM ranked {keyset}
+            ORDER BY rank DESC, id DESC
+            LIMIT %s
+        )
+        SELECT {columns}, page.rank,
+               coalesce(ts_headline('simple', p.name, query.tsq, '{HEADLINE_OPTIONS}'), p.name) AS headline,
+               coalesce(ts_headline(
+                   'simple',
+                   concat_ws(E'\\n', p.description, substr(
+                       code.code,
+                       greatest(1, strpos(lower(code.code), query.word) - {SNIPPET_CONTEXT_CHARS}),
+                       {SNIPPET_SOURCE_CHARS}
+                   )),
+                   query.tsq, '{SNIPPET_OPTIONS}'
+               ), left(p.description, {FALLBACK_SNIPPET_CHARS}), '') AS snippet
+        FROM page
+        JOIN projects p ON p.id = page.id
+        CROSS JOIN LATERAL (
+            SELECT {project_code_sql('p')} AS code
+        ) code, query
+        ORDER BY page.rank DESC, page.id DESC""",
+        tuple(params)
+    )
+    rows = cursor.fetchall()
+    for row in rows:
+        row['headline'] = render_highlight(row['headline'])
+        row['snippet'] = render_highlight(row['snippet'])
+    return rows
+
+
+def render_highlight(text: str) -> str:
+    '''
+    Экранирует HTML (в сниппетах код) и превращает маркеры ts_headline в <mark>
+    '''
+    from html import escape
+
+    return escape(text).replace(START_SEL, '<mark>').replace(STOP_SEL, '</mark>')
@@ -0,0 +1,240 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+PROFILE_IMPORTS = os.environ.get('IMPORT_PROFILE', '').lower() in ('1', 'true', 'yes')
+ENABLED = PROFILE_IMPORTS or os.environ.get('REQUEST_TIMING', '').lower() in ('1', 'true', 'yes')
+SQL_SAMPLE_CHARS = 160
+IMPORT_REPORT_SIZE = 15
+
+_current: contextvars.ContextVar[Optional['Trace']] = contextvars.ContextVar('request_trace', default=None)
+_connection_class: Any = None
+_imports: List[Tuple[str, float, float, bool]] = []
+_import_stack = threading.local()
+
+
+def _profile_imports() -> None:
+    '''
+    IMPORT_PROFILE=1: оборачивает __import__ и записывает время загрузки каждого нового модуля
+    (полное и собственное, без вложенных импортов), в том числе отложенных импортов внутри запросов
+    '''
+    import builtins
+
+    original_import = builtins.__import__
+
+    def timed_import(name: str, globals: Any = None, locals: Any = None, fromlist: Any = (), level: int = 0) -> Any:
+        stack = _import_stack.__dict__.setdefault('frames', [])
+        loaded = len(sys.modules)
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            if len(sys.modules) != loaded:
+                if level:
+                    name = f"{(globals or {}).get('__package__') or ''}.{name}"
+                _imports.append((name, elapsed, elapsed - nested, not stack))
+
+    builtins.__import__ = timed_import
+
+
+def take_imports() -> Dict[str, Any]:
+    '''
+    Импорты с прошлого вызова: суммарное время верхнего уровня и самые медленные модули
+    '''
+    records = _imports[:]
+    del _imports[:len(records)]
+    slowest = sorted(records, key=lambda record: record[2], reverse=True)[:IMPORT_REPORT_SIZE]
+    return {
+        'import_ms': round(sum(record[1] for record in records if record[3]), 2),
+        'imports': [{'module': r[0], 'ms': round(r[1], 2), 'self_ms': round(r[2], 2)} for r in slowest]
+    }
+
+
+if PROFILE_IMPORTS:
+    _profile_imports()
+
+
+class Trace:
+    '''
+    Замеры одного вызова handler'а: суммарное время по фазам и по отпечаткам SQL
+    '''
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, Dict[str, float]] = {}
+        self.queries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, ms: float) -> None:
+        with self._lock:
+            span = self.spans.setdefault(name, {'count': 0, 'ms': 0.0})
+            span['count'] += 1
+            span['ms'] += ms
+
+    def add_query(self, sql: str, ms: float, rows: int) -> None:
+        key, text = fingerprint(sql)
+        with self._lock:
+            query = self.queries.setdefault(key, {'fingerprint': key, 'sql': text, 'count': 0, 'ms': 0.0, 'rows': 0})
+            query['count'] += 1
+            query['ms'] += ms
+            query['rows'] += max(rows, 0)
+
+    def server_timing(self, total_ms: float) -> str:
+        parts = [f'{name};dur={span["ms"]:.1f}' for name, span in self.spans.items()]
+        if self.queries:
+            count = sum(q['count'] for q in self.queries.values())
+            db_ms = sum(q['ms'] for q in self.queries.values())
+            parts.append(f'db;dur={db_ms:.1f};desc="{count} queries"')
+        parts.append(f'total;dur={total_ms:.1f}')
+        return ', '.join(parts)
+
+    def record(self, total_ms: float) -> Dict[str, Any]:
+        queries = sorted(self.queries.values(), key=lambda q: q['ms'], reverse=True)
+        return {
+            'total_ms': round(total_ms, 2),
+            'spans': {name: {'count': s['count'], 'ms': round(s['ms'], 2)} for name, s in self.spans.items()},
+            'db': {
+                'queries': sum(q['count'] for q in queries),
+                'ms': round(sum(q['ms'] for q in queries), 2),
+                'rows': sum(q['rows'] for q in queries)
+            },
+            'queries': [{**q, 'ms': round(q['ms'], 2)} for q in queries]
+        }
+
+
+def fingerprint(sql: str) -> Tuple[str, str]:
+    '''
+    Отпечаток запроса без литералов и пробелов: одинаковые запросы с разными параметрами совпадают
+    '''
+    import hashlib
+    import re
+
+    text = re.sub(r'\s+', ' ', sql).strip()
+    text = re.sub(r"'(?:[^']|'')*'", '?', text)
+    text = re.sub(r'\b\d+\b', '?', text)
+    return hashlib.md5(text.encode('utf-8')).hexdigest()[:12], text[:SQL_SAMPLE_CHARS]
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, (time.perf_counter() - started) * 1000)
+
+
+def bind(fn: Callable[..., Any]) -> Callable[..., Any]:
+    '''
+    Переносит текущий Trace в поток пула (contextvars не наследуются ThreadPoolExecutor)
+    '''
+    trace = _current.get()
+    if trace is None:
+        return fn
+
+    @wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        token = _current.set(trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return wrapper
+
+
+def connection_factory() -> Any:
+    '''
+    Класс соединения psycopg2, замеряющий execute и commit; None, если замеры выключены
+    '''
+    global _connection_class
+    if not ENABLED:
+        return None
+    if _connection_class is None:
+        import psycopg2.extensions
+
+        cursor_classes: Dict[type, type] = {}
+
+        def timed_cursor(base: type) -> type:
+            if base not in cursor_classes:
+                class TimedCursor(base):
+                    def execute(self, query: Any, vars: Any = None) -> Any:
+                        trace = _current.get()
+                        if trace is None:
+                            return super().execute(query, vars)
+                        started = time.perf_counter()
+                        try:
+                            return super().execute(query, vars)
+                        finally:
+                            sql = query if isinstance(query, str) else query.as_string(self)
+                            trace.add_query(sql, (time.perf_counter() - started) * 1000, self.rowcount)
+
+                cursor_classes[base] = TimedCursor
+            return cursor_classes[base]
+
+        class TimedConnection(psycopg2.extensions.connection):
+            def cursor(self, *args: Any, **kwargs: Any) -> Any:
+                base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+                kwargs['cursor_factory'] = timed_cursor(base)
+                return super().cursor(*args, **kwargs)
+
+            def commit(self) -> None:
+                with span('commit'):
+                    super().commit()
+
+        _connection_class = TimedConnection
+    return _connection_class
+
+
+def instrumented(handler: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+    '''
+    REQUEST_TIMING=1: заголовок Server-Timing в ответе и одна JSON-строка в лог на вызов.
+    IMPORT_PROFILE=1 добавляет к ним импорты, случившиеся до и во время вызова.
+    Без переменных handler возвращается как есть
+    '''
+    if not ENABLED:
+        return handler
+    function = os.path.basename(os.path.dirname(os.path.abspath(handler.__code__.co_filename)))
+
+    @wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        trace = Trace()
+        token = _current.set(trace)
+        response: Optional[Dict[str, Any]] = None
+        try:
+            response = handler(event, context)
+            return response
+        finally:
+            _current.reset(token)
+            total_ms = (time.perf_counter() - trace.started) * 1000
+            imports = take_imports() if PROFILE_IMPORTS else {}
+            if imports.get('import_ms'):
+                trace.add('import', imports['import_ms'])
+            if isinstance(response, dict):
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = trace.server_timing(total_ms)
+                headers['Timing-Allow-Origin'] = '*'
+            print(json.dumps({
+                'event': 'request_timing',
+                'function': function,
+                'method': event.get('httpMethod'),
+                'status': response.get('statusCode') if isinstance(response, dict) else None,
+                'request_id': getattr(context, 'request_id', None),
+                **trace.record(total_ms),
+                **imports
+            }, ensure_ascii=False, default=str), flush=True)
+    return wrapper
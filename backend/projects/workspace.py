@@ -0,0 +1,273 @@
+import io
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from history import project_code_sql
+from response import dumps
+
+FORMAT_VERSION = 1
+EXPORT_ITERSIZE = 50
+IMPORT_BATCH_RECORDS = int(os.environ.get('WORKSPACE_IMPORT_BATCH', '500'))
+IMPORT_BATCH_BYTES = 4 * 1024 * 1024
+EXPORT_PROJECT_FIELDS = (
+    'id', 'name', 'description', 'language', 'code', 'status', 'version', 'created_at', 'updated_at'
+)
+IMPORT_PROJECT_COLUMNS = ('old_id', 'name', 'description', 'language', 'code', 'status', 'created_at', 'updated_at')
+IMPORT_VERSION_COLUMNS = (
+    'old_id', 'old_project_id', 'old_base_id', 'code', 'delta', 'content_hash', 'code_size',
+    'change_message', 'checkpoint', 'created_at'
+)
+
+
+def export_workspace(
+    conn: Any,
+    user_id: Any,
+    write: Callable[[bytes], Any],
+    after: Optional[int] = None,
+    limit: Optional[int] = None
+) -> Dict[str, Any]:
+    '''
+    Пишет проекты пользователя и их историю строками NDJSON: заголовок workspace,
+    затем project и его version по порядку id. Версии хранятся как есть - ключевой кадр
+    с кодом или дельта к base_id, поэтому выгрузка не раздувает историю.
+    Строки читаются именованными (серверными) курсорами порциями по EXPORT_ITERSIZE -
+    память не зависит от размера workspace. after/limit - страница по id проекта
+    '''
+    # один снимок на всю выгрузку: проекты и версии согласованы между собой
+    with conn.cursor() as cur:
+        cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+
+    if after is None:
+        write(dumps({
+            'type': 'workspace', 'format': FORMAT_VERSION, 'user_id': user_id,
+            'exported_at': datetime.now(timezone.utc)
+        }) + b'\n')
+
+    report: Dict[str, Any] = {'projects': 0, 'versions': 0, 'last_id': None}
+    with conn.cursor(name='workspace_projects') as projects:
+        projects.itersize = EXPORT_ITERSIZE
+        projects.execute(
+            f"""SELECT {', '.join(
+                project_code_sql('projects') if f == 'code' else f for f in EXPORT_PROJECT_FIELDS
+            )} FROM projects
+            WHERE user_id = %s AND id > %s
+            ORDER BY id
+            LIMIT %s""",
+            (user_id, after or 0, limit)
+        )
+        for row in projects:
+            project = dict(zip(EXPORT_PROJECT_FIELDS, row))
+            write(dumps({'type': 'project', **project}) + b'\n')
+            report['projects'] += 1
+            report['last_id'] = project['id']
+            report['versions'] += _export_versions(conn, project['id'], write)
+    return report
+
+
+def _export_versions(conn: Any, project_id: int, write: Callable[[bytes], Any]) -> int:
+    count = 0
+    with conn.cursor(name='workspace_versions') as versions:
+        versions.itersize = EXPORT_ITERSIZE
+        versions.execute(
+            """SELECT h.id, COALESCE(h.code, b.code), h.base_id, h.delta, h.content_hash, h.code_size,
+                h.change_message, h.checkpoint, h.created_at
+            FROM project_history h
+            LEFT JOIN code_blobs b ON b.hash = h.blob_hash
+            WHERE h.project_id = %s
+            ORDER BY h.id""",
+            (project_id,)
+        )
+        for version_id, code, base_id, delta, hash_, size, message, checkpoint, created_at in versions:
+            record: Dict[str, Any] = {'type': 'version', 'project_id': project_id, 'id': version_id}
+            if code is not None:
+                record['code'] = code
+            else:
+                record['base_id'] = base_id
+                record['delta'] = delta
+            record.update(
+                hash=hash_, size=size, change_message=message, checkpoint=checkpoint, created_at=created_at
+            )
+            write(dumps(record) + b'\n')
+            count += 1
+    return count
+
+
+def _copy_value(value: Any) -> str:
+    '''
+    Значение в текстовом формате COPY: NULL - \\N, спецсимволы экранируются
+    '''
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+def _copy_rows(rows: List[Tuple[Any, ...]]) -> io.StringIO:
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(v) for v in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+
+def _project_row(record: Dict[str, Any]) -> Tuple[Any, ...]:
+    if not isinstance(record.get('id'), int) or not record.get('name'):
+        raise ValueError('Project record requires integer id and name')
+    return (
+        record['id'], record['name'], record.get('description'), record.get('language') or 'javascript',
+        record.get('code') or '', record.get('status') or 'draft', record.get('created_at'), record.get('updated_at')
+    )
+
+
+def _version_row(record: Dict[str, Any]) -> Tuple[Any, ...]:
+    if not isinstance(record.get('id'), int) or not isinstance(record.get('project_id'), int):
+        raise ValueError('Version record requires integer id and project_id')
+    code = record.get('code')
+    if code is None and (not isinstance(record.get('base_id'), int) or record.get('delta') is None):
+        raise ValueError(f"Version {record['id']} has neither code nor base_id with delta")
+    return (
+        record['id'], record['project_id'], None if code is not None else record['base_id'],
+        code, None if code is not None else record['delta'], record.get('hash'), record.get('size'),
+        record.get('change_message'), bool(record.get('checkpoint')), record.get('created_at')
+    )
+
+
+def import_workspace(conn: Any, user_id: Any, lines: Iterable[Any]) -> Dict[str, int]:
+    '''
+    Загружает выгрузку export_workspace в проекты пользователя user_id одной транзакцией.
+    Строки копятся пачками (IMPORT_BATCH_RECORDS записей или IMPORT_BATCH_BYTES) и уходят
+    через COPY во временные таблицы; новые id выдаются из последовательностей, соответствие
+    старых и новых id хранится в базе - память клиента не растёт с размером выгрузки.
+    LookupError - пользователя нет, ValueError - повреждённая выгрузка
+    '''
+    with conn.cursor() as cur:
+        cur.execute('SELECT 1 FROM users WHERE id = %s', (user_id,))
+        if cur.fetchone() is None:
+            raise LookupError('User not found')
+        cur.execute(
+            """CREATE TEMP TABLE import_projects (
+                old_id INTEGER, name TEXT, description TEXT, language TEXT, code TEXT, status TEXT,
+                created_at TIMESTAMP, updated_at TIMESTAMP
+            ) ON COMMIT DROP;
+            CREATE TEMP TABLE import_versions (
+                old_id INTEGER, old_project_id INTEGER, old_base_id INTEGER, code TEXT, delta TEXT,
+                content_hash CHAR(64), code_size INTEGER, change_message TEXT, checkpoint BOOLEAN,
+                created_at TIMESTAMP
+            ) ON COMMIT DROP;
+            CREATE TEMP TABLE import_project_ids (old_id INTEGER PRIMARY KEY, new_id INTEGER) ON COMMIT DROP;
+            CREATE TEMP TABLE import_version_ids (old_id INTEGER PRIMARY KEY, new_id INTEGER) ON COMMIT DROP;"""
+        )
+
+    report = {'projects': 0, 'versions': 0}
+    projects: List[Tuple[Any, ...]] = []
+    versions: List[Tuple[Any, ...]] = []
+    pending_bytes = 0
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ValueError(f'Line {number} is not valid JSON')
+        kind = record.get('type') if isinstance(record, dict) else None
+        if kind == 'workspace' and record.get('format') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported export format: {record.get('format')}")
+        if kind == 'project':
+            projects.append(_project_row(record))
+        elif kind == 'version':
+            versions.append(_version_row(record))
+        else:
+            continue
+        pending_bytes += len(line)
+        if len(projects) + len(versions) >= IMPORT_BATCH_RECORDS or pending_bytes >= IMPORT_BATCH_BYTES:
+            _load_batch(conn, user_id, projects, versions, report)
+            projects, versions, pending_bytes = [], [], 0
+    _load_batch(conn, user_id, projects, versions, report)
+    return report
+
+
+def _load_batch(
+    conn: Any,
+    user_id: Any,
+    projects: List[Tuple[Any, ...]],
+    versions: List[Tuple[Any, ...]],
+    report: Dict[str, int]
+) -> None:
+    '''
+    Пачка через COPY: проекты, затем версии. Новые id выдаются в порядке старых - порядок версий
+    сохраняется; базы дельт приходят раньше дельт, поэтому находятся в import_version_ids
+    из этой или прошлых пачек
+    '''
+    with conn.cursor() as cur:
+        if projects:
+            cur.copy_expert(
+                f"COPY import_projects ({', '.join(IMPORT_PROJECT_COLUMNS)}) FROM STDIN", _copy_rows(projects)
+            )
+            cur.execute(
+                """INSERT INTO import_project_ids (old_id, new_id)
+                SELECT old_id, nextval(pg_get_serial_sequence('projects', 'id'))
+                FROM (SELECT old_id FROM import_projects ORDER BY old_id) ordered
+                ON CONFLICT (old_id) DO NOTHING"""
+            )
+            if cur.rowcount != len(projects):
+                raise ValueError('Duplicate project id in import')
+            cur.execute(
+                """INSERT INTO projects
+                    (id, user_id, name, description, language, code, code_hash, status, created_at, updated_at)
+                SELECT m.new_id, %s, i.name, i.description, i.language, i.code,
+                    encode(sha256(convert_to(i.code, 'UTF8')), 'hex'), i.status,
+                    COALESCE(i.created_at, NOW()), COALESCE(i.updated_at, NOW())
+                FROM import_projects i
+                JOIN import_project_ids m ON m.old_id = i.old_id""",
+                (user_id,)
+            )
+            report['projects'] += cur.rowcount
+
+        if versions:
+            cur.copy_expert(
+                f"COPY import_versions ({', '.join(IMPORT_VERSION_COLUMNS)}) FROM STDIN", _copy_rows(versions)
+            )
+            # хеш и размер ключевых кадров пересчитываются: по ним адресуются code_blobs
+            cur.execute(
+                """UPDATE import_versions
+                SET content_hash = encode(sha256(convert_to(code, 'UTF8')), 'hex'), code_size = octet_length(code)
+                WHERE code IS NOT NULL;
+                INSERT INTO code_blobs (hash, code, size)
+                SELECT DISTINCT ON (content_hash) content_hash, code, code_size
+                FROM import_versions WHERE code IS NOT NULL
+                ON CONFLICT (hash) DO NOTHING"""
+            )
+            cur.execute(
+                """INSERT INTO import_version_ids (old_id, new_id)
+                SELECT old_id, nextval(pg_get_serial_sequence('project_history', 'id'))
+                FROM (SELECT old_id FROM import_versions ORDER BY old_id) ordered
+                ON CONFLICT (old_id) DO NOTHING"""
+            )
+            if cur.rowcount != len(versions):
+                raise ValueError('Duplicate version id in import')
+            cur.execute(
+                """INSERT INTO project_history
+                    (id, project_id, blob_hash, base_id, delta, content_hash, code_size,
+                     change_message, checkpoint, created_at)
+                SELECT vm.new_id, pm.new_id, CASE WHEN v.code IS NOT NULL THEN v.content_hash END,
+                    bm.new_id, v.delta, v.content_hash, v.code_size,
+                    v.change_message, v.checkpoint, COALESCE(v.created_at, NOW())
+                FROM import_versions v
+                JOIN import_version_ids vm ON vm.old_id = v.old_id
+                JOIN import_project_ids pm ON pm.old_id = v.old_project_id
+                LEFT JOIN import_version_ids bm ON bm.old_id = v.old_base_id
+                WHERE v.code IS NOT NULL OR bm.new_id IS NOT NULL"""
+            )
+            if cur.rowcount != len(versions):
+                raise ValueError('Version references a project or base version missing from the import')
+            report['versions'] += cur.rowcount
+
+        cur.execute('TRUNCATE import_projects, import_versions')
@@ -0,0 +1,110 @@
+import glob
+import os
+import random
+import sys
+import tempfile
+from typing import Any, Callable, Dict, Tuple
+from urllib.parse import quote
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA = 't_p56286601_ai_app_creation_site'
+
+
+def provision() -> Tuple[str, Callable[[], None]]:
+    '''
+    BENCH_DATABASE_URL, если задан; иначе встроенный Postgres из пакета pgserver.
+    Возвращает (dsn, cleanup)
+    '''
+    url = os.environ.get('BENCH_DATABASE_URL')
+    if url:
+        return url, lambda: None
+    try:
+        import pgserver
+    except ImportError:
+        raise SystemExit('Set BENCH_DATABASE_URL or install pgserver (pip install pgserver)')
+    server = pgserver.get_server(tempfile.mkdtemp(prefix='bench-pg-'), cleanup_mode='delete')
+    return server.get_uri(), server.cleanup
+
+
+def with_search_path(dsn: str) -> str:
+    '''
+    projects пишет таблицы без схемы - handler получает DSN с search_path на схему приложения
+    '''
+    option = f'-csearch_path={SCHEMA},public'
+    if '://' in dsn:
+        separator = '&' if '?' in dsn else '?'
+        return f'{dsn}{separator}options={quote(option)}'
+    return f"{dsn} options='{option}'"
+
+
+def reset_schema(dsn: str) -> None:
+    '''
+    Пересоздаёт схему приложения и применяет db_migrations по порядку
+    '''
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        cur.execute(f'CREATE SCHEMA {SCHEMA}')
+        cur.execute(f'SET search_path TO {SCHEMA}, public')
+        for path in sorted(glob.glob(os.path.join(ROOT, 'db_migrations', '*.sql'))):
+            with open(path, encoding='utf-8') as migration:
+                cur.execute(migration.read())
+    conn.close()
+
+
+def make_code(lines: int, rng: random.Random) -> str:
+    return ''.join(
+        f'export function handler{i}(event) {{ return {{ status: {rng.randrange(200, 600)}, id: {i} }}; }}\n'
+        for i in range(lines)
+    )
+
+
+def seed(dsn: str, users: int, projects_per_user: int, lines: int, history: int) -> Dict[str, Any]:
+    '''
+    Пользователи, проекты с кодом из lines строк и history версиями через history.append_version,
+    чтобы дельты и ключевые кадры были как в проде. Возвращает id для генераторов событий
+    '''
+    sys.path.insert(0, os.path.join(ROOT, 'backend', 'code-save'))
+    try:
+        from history import append_version, content_hash
+    finally:
+        sys.path.pop(0)
+
+    rng = random.Random(42)
+    context: Dict[str, Any] = {'user_ids': [], 'project_ids': [], 'versions': [], 'lines': lines}
+    conn = psycopg2.connect(with_search_path(dsn))
+    with conn.cursor() as cur:
+        for u in range(users):
+            cur.execute(
+                'INSERT INTO users (email, name, plan) VALUES (%s, %s, %s) RETURNING id',
+                (f'bench{u}@example.com', f'Bench {u}', 'basic')
+            )
+            user_id = cur.fetchone()[0]
+            context['user_ids'].append(user_id)
+            for p in range(projects_per_user):
+                code = make_code(lines, rng)
+                cur.execute(
+                    '''INSERT INTO projects (user_id, name, description, language, code, code_hash, status)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id''',
+                    (user_id, f'Project {u}-{p}', 'Benchmark project', 'javascript', code, content_hash(code), 'draft')
+                )
+                project_id = cur.fetchone()[0]
+                context['project_ids'].append(project_id)
+                code_lines = code.splitlines(keepends=True)
+                for v in range(history):
+                    for _ in range(3):
+                        code_lines[rng.randrange(lines)] = f'// edit {v} {rng.random()}\n'
+                    version_id = append_version(conn, project_id, ''.join(code_lines), 'Автосохранение')
+                    if v % 10 == 0:
+                        context['versions'].append([project_id, version_id])
+                final = ''.join(code_lines)
+                cur.execute(
+                    'UPDATE projects SET code = %s, code_hash = %s WHERE id = %s',
+                    (final, content_hash(final), project_id)
+                )
+            conn.commit()
+    conn.close()
+    return context
@@ -0,0 +1,66 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Tuple
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    '''
+    Минимальный /v1/chat/completions: обычный ответ и stream, фиксированная задержка
+    '''
+    latency = 0.05
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        time.sleep(self.latency)
+
+        prompt = request.get('messages', [{}])[-1].get('content', '')
+        content = '```javascript\n' + '\n'.join(
+            f'console.log({json.dumps(prompt[:40])}, {line});' for line in range(20)
+        ) + '\n```'
+        usage = {'prompt_tokens': 40, 'completion_tokens': 200, 'total_tokens': 240}
+        base = {'id': 'chatcmpl-bench', 'created': int(time.time()), 'model': request.get('model', '')}
+
+        if request.get('stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for i in range(0, len(content), 16):
+                chunk = {**base, 'object': 'chat.completion.chunk', 'choices': [
+                    {'index': 0, 'delta': {'content': content[i:i + 16]}, 'finish_reason': None}
+                ]}
+                self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+            final = {**base, 'object': 'chat.completion.chunk', 'usage': usage, 'choices': [
+                {'index': 0, 'delta': {}, 'finish_reason': 'stop'}
+            ]}
+            self.wfile.write(f'data: {json.dumps(final)}\n\ndata: [DONE]\n\n'.encode('utf-8'))
+            self.close_connection = True
+            return
+
+        body = json.dumps({**base, 'object': 'chat.completion', 'usage': usage, 'choices': [
+            {'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}
+        ]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start(latency: float = 0.05) -> Tuple[ThreadingHTTPServer, str]:
+    '''
+    Запускает сервер в фоновом потоке; возвращает (server, base_url для OPENAI_BASE_URL)
+    '''
+    handler = type('BenchOpenAIHandler', (FakeOpenAIHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/v1'
+
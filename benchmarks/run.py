@@ -0,0 +1,146 @@
+'''
+Бенчмарк backend/*/index.py: локальный Postgres с засеянными проектами и историей,
+фейковый OpenAI, каждый сценарий - в отдельном процессе.
+
+    python benchmarks/run.py --requests 200 --concurrency 8
+    python benchmarks/run.py --only projects --save baseline.json
+    python benchmarks/run.py --baseline baseline.json --tolerance 0.25
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import database
+import fake_openai
+from scenarios import COMPACT_TOKEN, FREEKASSA_SECRET, SCENARIOS
+
+COLUMNS = (
+    ('scenario', 28), ('p50_ms', 9), ('p95_ms', 9), ('p99_ms', 9), ('rps', 8),
+    ('queries_per_request', 8), ('body_bytes', 10), ('statuses', 20)
+)
+HEADERS = {'queries_per_request': 'queries', 'body_bytes': 'bytes'}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark backend handlers locally')
+    parser.add_argument('--only', action='append', default=[], help='run scenarios whose name contains this')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent requests per instance')
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests before each run')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--projects', type=int, default=5, help='projects per user')
+    parser.add_argument('--lines', type=int, default=400, help='lines of code per project')
+    parser.add_argument('--history', type=int, default=40, help='history versions per project')
+    parser.add_argument('--openai-latency', type=float, default=50, help='fake OpenAI latency, ms')
+    parser.add_argument('--save', help='write results as JSON')
+    parser.add_argument('--baseline', help='compare with a saved run; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown vs baseline')
+    return parser.parse_args()
+
+
+def format_row(values: Dict[str, Any]) -> str:
+    cells = []
+    for key, width in COLUMNS:
+        value = values.get(key, '')
+        if key == 'statuses' and isinstance(value, dict):
+            value = ' '.join(f'{status}x{count}' for status, count in sorted(value.items()))
+        cells.append(str(value).ljust(width) if key in ('scenario', 'statuses') else str(value).rjust(width))
+    return '  '.join(cells)
+
+
+def run_scenario(name: str, args: argparse.Namespace, context: Dict[str, Any], env: Dict[str, str]) -> Dict[str, Any]:
+    spec = {
+        'scenario': name,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'warmup': args.warmup,
+        'context': context
+    }
+    process = subprocess.run(
+        [sys.executable, os.path.join(BENCH_DIR, 'worker.py')],
+        input=json.dumps(spec), capture_output=True, text=True, env=env
+    )
+    if process.returncode != 0:
+        return {'scenario': name, 'error': process.stderr.strip().splitlines()[-1:]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path, encoding='utf-8') as baseline_file:
+        baseline = {r['scenario']: r for r in json.load(baseline_file)['results']}
+    regressions = []
+    for result in results:
+        before = baseline.get(result['scenario'])
+        if not before or 'error' in result or 'error' in before:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{result['scenario']}: p95 {before['p95_ms']} -> {result['p95_ms']} ms")
+        if result['queries_per_request'] > before['queries_per_request']:
+            regressions.append(
+                f"{result['scenario']}: queries {before['queries_per_request']} -> {result['queries_per_request']}"
+            )
+    return regressions
+
+
+def main() -> int:
+    args = parse_args()
+    selected = [s.name for s in SCENARIOS if not args.only or any(f in s.name for f in args.only)]
+    if not selected:
+        print('No scenarios match --only', file=sys.stderr)
+        return 2
+
+    dsn, cleanup = database.provision()
+    server, openai_url = fake_openai.start(args.openai_latency / 1000)
+    try:
+        started = time.perf_counter()
+        database.reset_schema(dsn)
+        context = database.seed(dsn, args.users, args.projects, args.lines, args.history)
+        print(
+            f'seeded {len(context["project_ids"])} projects x {args.history} versions '
+            f'in {time.perf_counter() - started:.1f}s'
+        )
+
+        env = {
+            **os.environ,
+            'DATABASE_URL': database.with_search_path(dsn),
+            'OPENAI_API_KEY': 'sk-bench',
+            'OPENAI_BASE_URL': openai_url,
+            # сценарии гоняют сотни запросов с одного IP - лимиты тарифов исказили бы замеры
+            'AI_ADMISSION': '0',
+            'FREEKASSA_SECRET_KEY_2': FREEKASSA_SECRET,
+            'HISTORY_COMPACT_TOKEN': COMPACT_TOKEN,
+            'PYTHONDONTWRITEBYTECODE': '1'
+        }
+        print(format_row({key: HEADERS.get(key, key) for key, _ in COLUMNS}))
+        results = []
+        for name in selected:
+            result = run_scenario(name, args, context, env)
+            results.append(result)
+            print(format_row(result) if 'error' not in result else f'{name.ljust(28)}  ERROR {result["error"]}')
+    finally:
+        server.shutdown()
+        cleanup()
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as out:
+            json.dump({'args': vars(args), 'results': results}, out, indent=2)
+
+    failed = [r['scenario'] for r in results if 'error' in r]
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            return 1
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlencode
+
+Event = Dict[str, Any]
+Context = Dict[str, Any]
+FORM = {'Content-Type': 'application/x-www-form-urlencoded'}
+# FREEKASSA_SECRET_KEY_2 воркеров: без ключа payment отклоняет все уведомления
+FREEKASSA_SECRET = 'bench-freekassa-secret'
+# HISTORY_COMPACT_TOKEN воркеров: без токена history-compact отвечает 403
+COMPACT_TOKEN = 'bench-compact-token'
+
+
+@dataclass
+class Scenario:
+    '''
+    Один endpoint: функция из backend/, генератор событий build(context, i)
+    и необязательная подготовка setup(handler, context) внутри воркера
+    '''
+    name: str
+    function: str
+    build: Callable[[Context, int], Event]
+    setup: Optional[Callable[[Callable[..., Any], Context], None]] = None
+
+
+def _get(params: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Event:
+    return {
+        'httpMethod': 'GET',
+        'queryStringParameters': {key: str(value) for key, value in params.items()},
+        'headers': headers or {}
+    }
+
+
+def _post(body: Any, method: str = 'POST', headers: Optional[Dict[str, str]] = None) -> Event:
+    return {
+        'httpMethod': method,
+        'body': body if isinstance(body, str) else json.dumps(body),
+        'headers': {'Content-Type': 'application/json', **(headers or {})}
+    }
+
+
+def _pick(items: List[Any], i: int) -> Any:
+    return items[i % len(items)]
+
+
+def _edited_code(context: Context, i: int) -> str:
+    return ''.join(
+        f'export function handler{n}(event) {{ return {{ request: {i}, id: {n} }}; }}\n'
+        for n in range(context['lines'])
+    )
+
+
+def _signed_payment(order_id: str, amount: str) -> str:
+    '''
+    Уведомление FreeKassa, подписанное ключом FREEKASSA_SECRET
+    '''
+    sign = hashlib.md5(f'1:{amount}:{FREEKASSA_SECRET}:{order_id}'.encode()).hexdigest()
+    return urlencode({
+        'MERCHANT_ID': '1', 'AMOUNT': amount, 'MERCHANT_ORDER_ID': order_id,
+        'SIGN': sign, 'us_email': 'bench0@example.com', 'us_plan': 'pro'
+    })
+
+
+def _collect_etags(handler: Callable[..., Any], context: Context) -> None:
+    etags = {}
+    for project_id in context['project_ids']:
+        response = handler(_get({'id': project_id}), None)
+        etags[project_id] = response['headers'].get('ETag')
+    context['etags'] = etags
+
+
+def _publish_template(handler: Callable[..., Any], context: Context) -> None:
+    template_id = context['project_ids'][0]
+    handler(_post({'id': template_id, 'status': 'template'}, 'PUT'), None)
+    context['template_id'] = template_id
+
+
+def _warm_cache(handler: Callable[..., Any], context: Context) -> None:
+    handler(_post({'prompt': 'Cached benchmark prompt', 'language': 'javascript'}), None)
+
+
+SCENARIOS = [
+    Scenario(
+        'projects.list', 'projects',
+        lambda ctx, i: _get({'user_id': _pick(ctx['user_ids'], i)})
+    ),
+    Scenario(
+        'projects.search', 'projects',
+        lambda ctx, i: _get({'user_id': _pick(ctx['user_ids'], i), 'q': _pick(['handler', 'project', 'ject'], i)})
+    ),
+    Scenario(
+        'projects.export', 'projects',
+        lambda ctx, i: _get({'user_id': _pick(ctx['user_ids'], i), 'export': 'ndjson'}, {'Accept-Encoding': 'gzip'})
+    ),
+    Scenario(
+        'projects.get', 'projects',
+        lambda ctx, i: _get({'id': _pick(ctx['project_ids'], i)}, {'Accept-Encoding': 'gzip'})
+    ),
+    Scenario(
+        'projects.get.not-modified', 'projects',
+        lambda ctx, i: _get(
+            {'id': _pick(ctx['project_ids'], i)},
+            {'If-None-Match': ctx['etags'][_pick(ctx['project_ids'], i)]}
+        ),
+        _collect_etags
+    ),
+    Scenario(
+        'projects.create', 'projects',
+        lambda ctx, i: _post({
+            'user_id': _pick(ctx['user_ids'], i),
+            'name': f'Bench {i}',
+            'code': _edited_code(ctx, i)
+        })
+    ),
+    Scenario(
+        'projects.fork', 'projects',
+        lambda ctx, i: _post({'user_id': _pick(ctx['user_ids'], i), 'fork_of': ctx['template_id']}),
+        _publish_template
+    ),
+    Scenario(
+        'projects.update', 'projects',
+        lambda ctx, i: _post({
+            'id': _pick(ctx['project_ids'], i),
+            'code': _edited_code(ctx, i),
+            'change_message': 'Benchmark update'
+        }, 'PUT')
+    ),
+    Scenario(
+        'code-save.save', 'code-save',
+        lambda ctx, i: _post({'project_id': _pick(ctx['project_ids'], i), 'code': _edited_code(ctx, i)})
+    ),
+    Scenario(
+        'code-save.history', 'code-save',
+        lambda ctx, i: _get({'project_id': _pick(ctx['project_ids'], i)}, {'Accept-Encoding': 'gzip'})
+    ),
+    Scenario(
+        'code-save.version', 'code-save',
+        lambda ctx, i: _get({
+            'project_id': _pick(ctx['versions'], i)[0],
+            'version_id': _pick(ctx['versions'], i)[1]
+        })
+    ),
+    Scenario(
+        'ai-generate.generate', 'ai-generate',
+        lambda ctx, i: _post({'prompt': f'Benchmark prompt {i}', 'language': 'javascript', 'cache': False})
+    ),
+    Scenario(
+        'ai-generate.cached', 'ai-generate',
+        lambda ctx, i: _post({'prompt': 'Cached benchmark prompt', 'language': 'javascript'}),
+        _warm_cache
+    ),
+    Scenario(
+        'ai-generate.stream', 'ai-generate',
+        lambda ctx, i: _post({'prompt': f'Streamed prompt {i}', 'stream': True, 'cache': False})
+    ),
+    Scenario(
+        'ai-generate.context', 'ai-generate',
+        lambda ctx, i: _post({
+            'prompt': f'Context prompt {i}',
+            'project_id': _pick(ctx['project_ids'], i),
+            'cursor': 2000,
+            'cache': False
+        })
+    ),
+    Scenario(
+        'ai-generate.submit', 'ai-generate',
+        lambda ctx, i: _post({'prompt': f'Queued prompt {i}', 'async': True, 'cache': False})
+    ),
+    Scenario(
+        'ai-generate.batch', 'ai-generate',
+        lambda ctx, i: _post({
+            'items': [{'prompt': f'Batch prompt {i}-{n}'} for n in range(4)],
+            'cache': False
+        })
+    ),
+    Scenario(
+        'payment.webhook', 'payment',
+        lambda ctx, i: _post(
+            f'MERCHANT_ID=1&AMOUNT=990&MERCHANT_ORDER_ID=ORDER-{i}&SIGN=invalid',
+            headers=FORM
+        )
+    ),
+    Scenario(
+        'payment.webhook.retry', 'payment',
+        lambda ctx, i: _post(_signed_payment(f'RETRY-{i % 5}', '2990'), headers=FORM)
+    ),
+    Scenario(
+        'history-compact.dry-run', 'history-compact',
+        lambda ctx, i: _post(
+            {'project_id': _pick(ctx['project_ids'], i), 'dry_run': True},
+            headers={'X-Compact-Token': COMPACT_TOKEN}
+        )
+    ),
+]
+
+
+def get_scenario(name: str) -> Scenario:
+    for scenario in SCENARIOS:
+        if scenario.name == name:
+            return scenario
+    raise KeyError(name)
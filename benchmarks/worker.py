@@ -0,0 +1,134 @@
+'''
+Прогон одного сценария в отдельном процессе: чистые модули handler'а,
+собственный пул соединений и кеши, как у отдельного инстанса функции.
+Спецификация приходит JSON в stdin, итог - одна JSON-строка в stdout
+'''
+import importlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+_counter = threading.local()
+
+
+def install_query_counter() -> None:
+    '''
+    Оборачивает psycopg2.connect: каждый execute/executemany/copy увеличивает счётчик потока
+    '''
+    import psycopg2
+    import psycopg2.extensions
+
+    counting_classes: Dict[type, type] = {}
+
+    def counting(cursor_class: type) -> type:
+        if cursor_class not in counting_classes:
+            def count(method_name: str) -> Any:
+                method = getattr(cursor_class, method_name)
+
+                def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+                    _counter.queries = getattr(_counter, 'queries', 0) + 1
+                    return method(self, *args, **kwargs)
+                return wrapper
+
+            counting_classes[cursor_class] = type(f'Counting{cursor_class.__name__}', (cursor_class,), {
+                name: count(name)
+                for name in ('execute', 'executemany', 'copy_expert', 'copy_from', 'copy_to')
+                if hasattr(cursor_class, name)
+            })
+        return counting_classes[cursor_class]
+
+    connection_classes: Dict[type, type] = {}
+
+    def counting_connection(connection_class: type) -> type:
+        if connection_class not in connection_classes:
+            class CountingConnection(connection_class):
+                def cursor(self, *args: Any, **kwargs: Any) -> Any:
+                    factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+                    kwargs['cursor_factory'] = counting(factory)
+                    return super().cursor(*args, **kwargs)
+
+            connection_classes[connection_class] = CountingConnection
+        return connection_classes[connection_class]
+
+    original_connect = psycopg2.connect
+
+    def connect(*args: Any, **kwargs: Any) -> Any:
+        base = kwargs.get('connection_factory') or psycopg2.extensions.connection
+        kwargs['connection_factory'] = counting_connection(base)
+        return original_connect(*args, **kwargs)
+
+    psycopg2.connect = connect
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run(spec: Dict[str, Any]) -> Dict[str, Any]:
+    sys.path.insert(0, BENCH_DIR)
+    from scenarios import get_scenario
+
+    scenario = get_scenario(spec['scenario'])
+    sys.path.insert(0, os.path.join(ROOT, 'backend', scenario.function))
+
+    # холодный импорт handler'а: счётчик ставится после, чтобы не загрузить psycopg2 заранее
+    started = time.perf_counter()
+    index = importlib.import_module('index')
+    import_ms = (time.perf_counter() - started) * 1000
+    install_query_counter()
+    context = spec['context']
+
+    if scenario.setup is not None:
+        scenario.setup(index.handler, context)
+
+    def call(i: int) -> Any:
+        event = scenario.build(context, i)
+        _counter.queries = 0
+        begin = time.perf_counter()
+        response = index.handler(event, None)
+        elapsed = (time.perf_counter() - begin) * 1000
+        return elapsed, response.get('statusCode'), _counter.queries, len(response.get('body') or '')
+
+    for i in range(spec['warmup']):
+        call(i)
+
+    offset = spec['warmup']
+    with ThreadPoolExecutor(max_workers=spec['concurrency']) as pool:
+        begin = time.perf_counter()
+        results = list(pool.map(call, range(offset, offset + spec['requests'])))
+        wall = time.perf_counter() - begin
+
+    latencies = sorted(r[0] for r in results)
+    statuses: Dict[str, int] = {}
+    for r in results:
+        statuses[str(r[1])] = statuses.get(str(r[1]), 0) + 1
+    return {
+        'scenario': scenario.name,
+        'requests': len(results),
+        'concurrency': spec['concurrency'],
+        'statuses': statuses,
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'max_ms': round(latencies[-1], 2) if latencies else 0.0,
+        'rps': round(len(results) / wall, 1) if wall else 0.0,
+        'queries_per_request': round(sum(r[2] for r in results) / max(len(results), 1), 2),
+        'body_bytes': round(sum(r[3] for r in results) / max(len(results), 1)),
+        'import_ms': round(import_ms, 1)
+    }
+
+
+if __name__ == '__main__':
+    result = run(json.load(sys.stdin))
+    sys.stdout.write(json.dumps(result) + '\n')
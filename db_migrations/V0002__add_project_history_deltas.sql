@@ -0,0 +1,10 @@
+-- Store history versions as keyframes (full code) or deltas against a keyframe
+ALTER TABLE project_history ALTER COLUMN code DROP NOT NULL;
+ALTER TABLE project_history ADD COLUMN IF NOT EXISTS base_id INTEGER REFERENCES project_history(id);
+ALTER TABLE project_history ADD COLUMN IF NOT EXISTS delta TEXT;
+
+-- Every existing row holds full code and is therefore already a keyframe
+ALTER TABLE project_history ADD CONSTRAINT chk_project_history_payload
+    CHECK (code IS NOT NULL OR (base_id IS NOT NULL AND delta IS NOT NULL));
+
+CREATE INDEX IF NOT EXISTS idx_project_history_base_id ON project_history(base_id);
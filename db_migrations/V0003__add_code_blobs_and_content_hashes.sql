@@ -0,0 +1,28 @@
+-- Content-addressed storage for keyframe code, shared by identical versions
+CREATE TABLE IF NOT EXISTS code_blobs (
+    hash CHAR(64) PRIMARY KEY,
+    code TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS code_hash CHAR(64);
+ALTER TABLE project_history ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+ALTER TABLE project_history ADD COLUMN IF NOT EXISTS code_size INTEGER;
+ALTER TABLE project_history ADD COLUMN IF NOT EXISTS blob_hash CHAR(64) REFERENCES code_blobs(hash);
+
+ALTER TABLE project_history DROP CONSTRAINT IF EXISTS chk_project_history_payload;
+ALTER TABLE project_history ADD CONSTRAINT chk_project_history_payload
+    CHECK (code IS NOT NULL OR blob_hash IS NOT NULL OR (base_id IS NOT NULL AND delta IS NOT NULL));
+
+-- Backfill hashes (sha256 of UTF-8 code, same as the handlers compute)
+UPDATE projects
+SET code_hash = encode(sha256(convert_to(COALESCE(code, ''), 'UTF8')), 'hex')
+WHERE code_hash IS NULL;
+
+UPDATE project_history
+SET content_hash = encode(sha256(convert_to(code, 'UTF8')), 'hex'),
+    code_size = octet_length(code)
+WHERE code IS NOT NULL AND content_hash IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_project_history_blob_hash ON project_history(blob_hash);
@@ -0,0 +1,3 @@
+-- Keyset pagination over a project's history: ORDER BY created_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_project_history_project_created
+    ON project_history(project_id, created_at DESC, id DESC);
@@ -0,0 +1,3 @@
+-- Keyset pagination of a user's projects: ORDER BY updated_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_projects_user_updated
+    ON projects(user_id, updated_at DESC, id DESC);
@@ -0,0 +1,2 @@
+-- Checkpoint versions are never coalesced with later autosaves
+ALTER TABLE project_history ADD COLUMN IF NOT EXISTS checkpoint BOOLEAN NOT NULL DEFAULT FALSE;
@@ -0,0 +1,9 @@
+-- Shared cache of AI generations keyed on normalised prompt, language, model and sampling params
+CREATE TABLE IF NOT EXISTS ai_generation_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    response TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_ai_generation_cache_expires_at ON ai_generation_cache(expires_at);
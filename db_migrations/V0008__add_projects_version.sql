@@ -0,0 +1,2 @@
+-- Optimistic concurrency for PUT /projects: every write bumps the counter
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
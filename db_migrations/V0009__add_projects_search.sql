@@ -0,0 +1,25 @@
+-- Server-side search over a user's projects: GET /projects?user_id=X&q=...
+-- Full-text: weighted tsvector over name (A), description (B) and the head of the code (C);
+-- 'simple' config because names and code mix Russian, English and identifiers
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+        || setweight(to_tsvector('simple', left(coalesce(code, ''), 100000)), 'C')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_projects_search_vector ON projects USING GIN (search_vector);
+
+-- Substring matches inside words ("board" in "Dashboard") are plain ILIKE on name and description;
+-- where pg_trgm is available a trigram index serves them, otherwise they scan the user's rows
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS idx_projects_search_text_trgm
+            ON projects USING GIN ((name || ' ' || coalesce(description, '')) gin_trgm_ops);
+    END IF;
+EXCEPTION WHEN insufficient_privilege THEN
+    RAISE NOTICE 'pg_trgm not installed: substring search runs without a trigram index';
+END
+$$;
@@ -0,0 +1,15 @@
+-- Ledger of FreeKassa notifications: one row per MERCHANT_ORDER_ID, written with
+-- INSERT ... ON CONFLICT DO NOTHING so retried notifications return the recorded outcome
+CREATE TABLE IF NOT EXISTS payments (
+    order_id VARCHAR(100) PRIMARY KEY,
+    merchant_id VARCHAR(50) NOT NULL,
+    amount NUMERIC(12, 2) NOT NULL,
+    provider_payment_id VARCHAR(100),
+    user_id INTEGER REFERENCES users(id),
+    plan VARCHAR(50),
+    -- applied: users.plan updated; unassigned: no matching user; amount_mismatch: amount is not a plan price
+    status VARCHAR(20) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_payments_user_id ON payments(user_id);
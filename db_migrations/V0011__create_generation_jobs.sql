@@ -0,0 +1,25 @@
+-- Queue of asynchronous AI generations: POST /ai-generate {async: true} enqueues,
+-- workers claim with FOR UPDATE SKIP LOCKED under a lease, clients poll by id
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    -- queued | running | done | failed; a running job whose lease expired is claimed again,
+    -- a queued retry waits until locked_until
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    prompt TEXT NOT NULL,
+    language VARCHAR(50) NOT NULL,
+    use_cache BOOLEAN NOT NULL DEFAULT TRUE,
+    result JSONB,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    locked_until TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Claim order; only unfinished jobs are indexed, so the index stays small
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_pending
+    ON generation_jobs(created_at) WHERE status IN ('queued', 'running');
+
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_finished_at
+    ON generation_jobs(finished_at) WHERE finished_at IS NOT NULL;
@@ -0,0 +1,19 @@
+-- Shared token buckets for ai-generate admission control (AI_ADMISSION_BACKEND=postgres):
+-- one row per "<user:id|ip:addr>:<requests|tokens>", refilled lazily from updated_at
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    bucket_key VARCHAR(255) PRIMARY KEY,
+    -- may go negative: token usage is charged after the response, so the bucket runs into debt
+    level DOUBLE PRECISION NOT NULL,
+    -- outcome of the last take, returned by the same upsert
+    admitted BOOLEAN NOT NULL DEFAULT TRUE,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Jobs remember who queued them: the worker charges tokens to the owner and paid plans are claimed first
+ALTER TABLE generation_jobs ADD COLUMN IF NOT EXISTS owner VARCHAR(255);
+ALTER TABLE generation_jobs ADD COLUMN IF NOT EXISTS plan VARCHAR(50);
+ALTER TABLE generation_jobs ADD COLUMN IF NOT EXISTS priority SMALLINT NOT NULL DEFAULT 0;
+
+DROP INDEX IF EXISTS idx_generation_jobs_pending;
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_pending
+    ON generation_jobs(priority DESC, created_at) WHERE status IN ('queued', 'running');
@@ -0,0 +1,10 @@
+-- Copy-on-write forks: a fork keeps code NULL and shares the parent's blob via code_hash
+-- until its first write with different code
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS forked_from INTEGER REFERENCES projects(id);
+
+-- Blob garbage collection must keep blobs that undiverged forks still read through code_hash
+CREATE INDEX IF NOT EXISTS idx_projects_shared_code_hash ON projects(code_hash) WHERE code IS NULL;
+
+-- Template gallery: projects with status 'template', newest first
+CREATE INDEX IF NOT EXISTS idx_projects_templates_updated
+    ON projects(updated_at DESC, id DESC) WHERE status = 'template';
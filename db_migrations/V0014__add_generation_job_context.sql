@@ -0,0 +1,3 @@
+-- Project context assembled when the job was enqueued (mode, excerpt, replace range, max_tokens),
+-- so the worker generates against the code the client saw; NULL for bare prompts
+ALTER TABLE generation_jobs ADD COLUMN IF NOT EXISTS context JSONB;
@@ -0,0 +1,4 @@
+-- Versions that still hold full code inline (written before V0002/V0003);
+-- history-compact re-encodes them into code_blobs keyframes and deltas and uses this index to find them
+CREATE INDEX IF NOT EXISTS idx_project_history_legacy_code
+    ON project_history(project_id, id) WHERE code IS NOT NULL;
@@ -13,14 +13,19 @@ interface VersionHistoryProps {
 
 interface Version {
   id: number;
-  code: string;
   change_message: string;
   created_at: string;
+  size: number | null;
+  hash: string | null;
 }
 
+const CODE_SAVE_URL = 'https://functions.poehali.dev/bfd0ac98-4e04-4b43-9b93-0fcc836f6d5e';
+
 export default function VersionHistory({ projectId, onRestore }: VersionHistoryProps) {
   const [versions, setVersions] = useState<Version[]>([]);
   const [loading, setLoading] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [restoringId, setRestoringId] = useState<number | null>(null);
   const [selectedVersion, setSelectedVersion] = useState<number | null>(null);
   const { toast } = useToast();
 
@@ -28,17 +33,20 @@ export default function VersionHistory({ projectId, onRestore }: VersionHistoryP
     loadHistory();
   }, [projectId]);
 
-  const loadHistory = async () => {
+  const loadHistory = async (cursor?: string) => {
     setLoading(true);
     
     try {
+      const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
       const response = await fetch(
-        `https://functions.poehali.dev/bfd0ac98-4e04-4b43-9b93-0fcc836f6d5e?project_id=${projectId}`
+        `${CODE_SAVE_URL}?project_id=${projectId}${cursorParam}`
       );
       
       if (response.ok) {
         const data = await response.json();
-        setVersions(data.history || []);
+        const page: Version[] = data.history || [];
+        setVersions(cursor ? (prev) => [...prev, ...page] : page);
+        setNextCursor(data.next_cursor || null);
       }
     } catch (error) {
       console.error('Failed to load history:', error);
@@ -52,12 +60,34 @@ export default function VersionHistory({ projectId, onRestore }: VersionHistoryP
     }
   };
 
-  const handleRestore = (version: Version) => {
-    onRestore(version.code);
-    toast({
-      title: "Версия восстановлена",
-      description: `Код восстановлен из версии от ${new Date(version.created_at).toLocaleString()}`,
-    });
+  const handleRestore = async (version: Version) => {
+    setRestoringId(version.id);
+    
+    try {
+      const response = await fetch(
+        `${CODE_SAVE_URL}?project_id=${projectId}&version_id=${version.id}`
+      );
+      
+      if (!response.ok) {
+        throw new Error('Failed to load version');
+      }
+      
+      const data = await response.json();
+      onRestore(data.code);
+      toast({
+        title: "Версия восстановлена",
+        description: `Код восстановлен из версии от ${new Date(version.created_at).toLocaleString()}`,
+      });
+    } catch (error) {
+      console.error('Failed to restore version:', error);
+      toast({
+        title: "Ошибка",
+        description: "Не удалось загрузить версию",
+        variant: "destructive",
+      });
+    } finally {
+      setRestoringId(null);
+    }
   };
 
   const formatDate = (dateString: string) => {
@@ -81,9 +111,10 @@ export default function VersionHistory({ projectId, onRestore }: VersionHistoryP
     });
   };
 
-  const getCodePreview = (code: string) => {
-    const lines = code.split('\n').slice(0, 3);
-    return lines.join('\n').substring(0, 100) + (code.length > 100 ? '...' : '');
+  const formatSize = (size: number | null) => {
+    if (size === null) return '';
+    if (size < 1024) return `${size} Б`;
+    return `${(size / 1024).toFixed(1)} КБ`;
   };
 
   return (
@@ -102,7 +133,7 @@ export default function VersionHistory({ projectId, onRestore }: VersionHistoryP
           <Button
             variant="outline"
             size="sm"
-            onClick={loadHistory}
+            onClick={() => loadHistory()}
             disabled={loading}
           >
             {loading ? (
@@ -115,7 +146,7 @@ export default function VersionHistory({ projectId, onRestore }: VersionHistoryP
       </CardHeader>
       <CardContent>
         <ScrollArea className="h-[400px] pr-4">
-          {loading ? (
+          {loading && versions.length === 0 ? (
             <div className="flex items-center justify-center py-8">
               <Icon name="Loader2" size={24} className="animate-spin text-muted-foreground" />
             </div>
@@ -153,9 +184,10 @@ export default function VersionHistory({ projectId, onRestore }: VersionHistoryP
                         </span>
                       </div>
                       <p className="text-sm font-medium mb-2">{version.change_message}</p>
-                      <pre className="text-xs text-muted-foreground bg-background/50 p-2 rounded overflow-hidden">
-                        {getCodePreview(version.code)}
-                      </pre>
+                      <p className="text-xs text-muted-foreground font-mono">
+                        {formatSize(version.size)}
+                        {version.hash && ` · ${version.hash.substring(0, 8)}`}
+                      </p>
                     </div>
                     <Button
                       size="sm"
@@ -164,14 +196,35 @@ export default function VersionHistory({ projectId, onRestore }: VersionHistoryP
                         e.stopPropagation();
                         handleRestore(version);
                       }}
+                      disabled={restoringId === version.id}
                       className="opacity-0 group-hover:opacity-100 transition-opacity"
                     >
-                      <Icon name="Undo2" size={16} className="mr-2" />
+                      {restoringId === version.id ? (
+                        <Icon name="Loader2" size={16} className="mr-2 animate-spin" />
+                      ) : (
+                        <Icon name="Undo2" size={16} className="mr-2" />
+                      )}
                       Восстановить
                     </Button>
                   </div>
                 </div>
               ))}
+              {nextCursor && (
+                <Button
+                  variant="outline"
+                  size="sm"
+                  className="w-full"
+                  onClick={() => loadHistory(nextCursor)}
+                  disabled={loading}
+                >
+                  {loading ? (
+                    <Icon name="Loader2" size={16} className="mr-2 animate-spin" />
+                  ) : (
+                    <Icon name="ChevronDown" size={16} className="mr-2" />
+                  )}
+                  Показать ещё
+                </Button>
+              )}
             </div>
           )}
         </ScrollArea>
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card';
@@ -19,11 +19,18 @@ interface Project {
   status: string;
   created_at: string;
   updated_at: string;
+  forked_from?: number | null;
+  headline?: string;
+  snippet?: string;
 }
 
 const Dashboard = () => {
   const [projects, setProjects] = useState<Project[]>([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [search, setSearch] = useState('');
+  const requestRef = useRef(0);
   const [user, setUser] = useState<any>(null);
   const [newProject, setNewProject] = useState({
     name: '',
@@ -45,13 +52,27 @@ const Dashboard = () => {
     }
   }, [navigate]);
 
-  const loadProjects = async (userId: number) => {
+  useEffect(() => {
+    if (!user) return;
+    const timer = setTimeout(() => loadProjects(1, undefined, search), 300);
+    return () => clearTimeout(timer);
+  }, [search]);
+
+  const loadProjects = async (userId: number, cursor?: string, query: string = search) => {
+    if (cursor) setLoadingMore(true);
+    const request = ++requestRef.current;
+    
     try {
+      const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+      const queryParam = query.trim() ? `&q=${encodeURIComponent(query.trim())}` : '';
       const response = await fetch(
-        `https://functions.poehali.dev/888d0941-ac77-4476-be5b-3d14c55b9602?user_id=${userId}`
+        `https://functions.poehali.dev/888d0941-ac77-4476-be5b-3d14c55b9602?user_id=${userId}${queryParam}${cursorParam}`
       );
       const data = await response.json();
-      setProjects(data.projects || []);
+      if (request !== requestRef.current) return;
+      const page: Project[] = data.projects || [];
+      setProjects(cursor ? (prev) => [...prev, ...page] : page);
+      setNextCursor(data.next_cursor || null);
     } catch (error) {
       toast({
         title: "Ошибка",
@@ -60,6 +81,7 @@ const Dashboard = () => {
       });
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -106,6 +128,40 @@ const Dashboard = () => {
     }
   };
 
+  const forkProject = async (project: Project) => {
+    try {
+      const response = await fetch(
+        'https://functions.poehali.dev/888d0941-ac77-4476-be5b-3d14c55b9602',
+        {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({
+            user_id: 1,
+            fork_of: project.id,
+            name: `${project.name} (копия)`
+          })
+        }
+      );
+
+      const data = await response.json();
+
+      if (!response.ok) {
+        throw new Error(data.error);
+      }
+      setProjects([data.project, ...projects]);
+      toast({
+        title: "Копия создана",
+        description: `${data.project.name} готов к редактированию`,
+      });
+    } catch (error) {
+      toast({
+        title: "Ошибка",
+        description: "Не удалось скопировать сайт",
+        variant: "destructive",
+      });
+    }
+  };
+
   const openProject = (projectId: number) => {
     navigate(`/editor?project=${projectId}`);
   };
@@ -242,10 +298,24 @@ const Dashboard = () => {
           </Dialog>
         </div>
 
+        <div className="relative mb-6 max-w-md">
+          <Icon name="Search" size={18} className="absolute left-3 top-1/2 -translate-y-1/2 text-muted-foreground" />
+          <Input
+            placeholder="Поиск по названию, описанию и коду"
+            value={search}
+            onChange={(e) => setSearch(e.target.value)}
+            className="pl-10 bg-background/50"
+          />
+        </div>
+
         {loading ? (
           <div className="flex items-center justify-center py-20">
             <Icon name="Loader2" size={48} className="animate-spin text-primary" />
           </div>
+        ) : projects.length === 0 && search.trim() ? (
+          <div className="text-center text-muted-foreground py-20">
+            Ничего не найдено по запросу «{search.trim()}»
+          </div>
         ) : projects.length === 0 ? (
           <Card className="border-primary/30 bg-card/50 backdrop-blur border-dashed">
             <CardContent className="flex flex-col items-center justify-center py-20">
@@ -278,19 +348,35 @@ const Dashboard = () => {
                       variant="ghost"
                       size="icon"
                       className="opacity-0 group-hover:opacity-100 transition-opacity"
+                      title="Создать копию"
                       onClick={(e) => {
                         e.stopPropagation();
+                        forkProject(project);
                       }}
                     >
-                      <Icon name="MoreVertical" size={18} />
+                      <Icon name="Copy" size={18} />
                     </Button>
                   </div>
-                  <CardTitle className="text-xl group-hover:text-primary transition-colors">
-                    {project.name}
-                  </CardTitle>
-                  <CardDescription className="line-clamp-2">
-                    {project.description || 'Без описания'}
-                  </CardDescription>
+                  {project.headline ? (
+                    <CardTitle
+                      className="text-xl group-hover:text-primary transition-colors [&_mark]:bg-primary/30 [&_mark]:text-inherit"
+                      dangerouslySetInnerHTML={{ __html: project.headline }}
+                    />
+                  ) : (
+                    <CardTitle className="text-xl group-hover:text-primary transition-colors">
+                      {project.name}
+                    </CardTitle>
+                  )}
+                  {project.snippet ? (
+                    <CardDescription
+                      className="line-clamp-2 font-mono text-xs [&_mark]:bg-primary/30 [&_mark]:text-inherit"
+                      dangerouslySetInnerHTML={{ __html: project.snippet }}
+                    />
+                  ) : (
+                    <CardDescription className="line-clamp-2">
+                      {project.description || 'Без описания'}
+                    </CardDescription>
+                  )}
                 </CardHeader>
                 <CardContent>
                   <div className="flex items-center justify-between text-sm text-muted-foreground">
@@ -308,6 +394,19 @@ const Dashboard = () => {
             ))}
           </div>
         )}
+
+        {!loading && nextCursor && (
+          <div className="flex justify-center mt-8">
+            <Button variant="outline" onClick={() => loadProjects(1, nextCursor)} disabled={loadingMore}>
+              {loadingMore ? (
+                <Icon name="Loader2" size={18} className="mr-2 animate-spin" />
+              ) : (
+                <Icon name="ChevronDown" size={18} className="mr-2" />
+              )}
+              Показать ещё
+            </Button>
+          </div>
+        )}
       </div>
     </div>
   );
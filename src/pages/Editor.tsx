@@ -11,6 +11,40 @@ import Icon from '@/components/ui/icon';
 import { useToast } from '@/hooks/use-toast';
 import VersionHistory from '@/components/VersionHistory';
 
+const CODE_SAVE_URL = 'https://functions.poehali.dev/bfd0ac98-4e04-4b43-9b93-0fcc836f6d5e';
+const AI_GENERATE_URL = 'https://functions.poehali.dev/9022cc63-3649-4249-821b-bbb6276aef84';
+
+// Не дольше JOB_WAIT_LIMIT_MS: задачу из очереди разбирает воркер по расписанию, и без него она не завершится
+const JOB_WAIT_LIMIT_MS = 120000;
+
+// 202 с job_id - генерация в очереди: long-poll статуса, пока не done/failed или не истёк срок
+const waitForJob = async (jobId: string) => {
+  const deadline = Date.now() + JOB_WAIT_LIMIT_MS;
+  while (Date.now() < deadline) {
+    const wait = Math.min(20, Math.ceil((deadline - Date.now()) / 1000));
+    const response = await fetch(`${AI_GENERATE_URL}?job_id=${jobId}&wait=${wait}`);
+    const job = await response.json();
+    if (!response.ok) throw new Error(job.error || 'Ошибка генерации');
+    if (job.status === 'done') return job.result;
+    if (job.status === 'failed') throw new Error(job.error || 'Ошибка генерации');
+  }
+  throw new Error('Генерация не завершилась вовремя, попробуйте ещё раз');
+};
+
+const diffEdit = (base: string, next: string) => {
+  let start = 0;
+  const maxStart = Math.min(base.length, next.length);
+  while (start < maxStart && base[start] === next[start]) start++;
+  let end = 0;
+  const maxEnd = Math.min(base.length, next.length) - start;
+  while (end < maxEnd && base[base.length - 1 - end] === next[next.length - 1 - end]) end++;
+  return { start, end: base.length - end, text: next.slice(start, next.length - end) };
+};
+
+// ai-generate считает смещения в символах Unicode, Monaco и строки JS - в UTF-16
+const toCodePoints = (text: string, index: number) => Array.from(text.slice(0, index)).length;
+const fromCodePoints = (text: string, count: number) => Array.from(text).slice(0, count).join('').length;
+
 const CodeEditor = () => {
   const [searchParams] = useSearchParams();
   const projectId = searchParams.get('project');
@@ -24,6 +58,8 @@ const CodeEditor = () => {
   const [saving, setSaving] = useState(false);
   const [lastSaved, setLastSaved] = useState<Date | null>(null);
   const saveTimerRef = useRef<NodeJS.Timeout | null>(null);
+  const savedRef = useRef<{ code: string; hash: string } | null>(null);
+  const editorRef = useRef<any>(null);
   const navigate = useNavigate();
   const { toast } = useToast();
 
@@ -61,12 +97,13 @@ const CodeEditor = () => {
     if (!projectId) return;
     
     try {
-      const response = await fetch(
-        `https://functions.poehali.dev/bfd0ac98-4e04-4b43-9b93-0fcc836f6d5e?project_id=${projectId}`
-      );
+      const response = await fetch(`${CODE_SAVE_URL}?project_id=${projectId}`);
       
       if (response.ok) {
         const data = await response.json();
+        if (data.code_hash) {
+          savedRef.current = { code: data.current_code || '', hash: data.code_hash };
+        }
         if (data.current_code) {
           setCode(data.current_code);
           setLastSaved(data.updated_at ? new Date(data.updated_at) : null);
@@ -82,21 +119,28 @@ const CodeEditor = () => {
     
     setSaving(true);
     
+    const snapshot = code;
+    const post = (payload: object) =>
+      fetch(CODE_SAVE_URL, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ project_id: projectId, change_message: 'Автосохранение', ...payload })
+      });
+    
     try {
-      const response = await fetch(
-        'https://functions.poehali.dev/bfd0ac98-4e04-4b43-9b93-0fcc836f6d5e',
-        {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            project_id: projectId,
-            code: code,
-            change_message: 'Автосохранение'
-          })
-        }
-      );
+      const saved = savedRef.current;
+      const edit = saved ? diffEdit(saved.code, snapshot) : null;
+      let response = saved && edit && edit.text.length < snapshot.length / 2
+        ? await post({ base_hash: saved.hash, edits: [edit] })
+        : await post({ code: snapshot });
+      
+      if (response.status === 409 || (response.status === 400 && saved)) {
+        response = await post({ code: snapshot });
+      }
       
       if (response.ok) {
+        const data = await response.json();
+        savedRef.current = data.hash ? { code: snapshot, hash: data.hash } : null;
         setLastSaved(new Date());
       }
     } catch (error) {
@@ -119,22 +163,50 @@ const CodeEditor = () => {
     setAiLoading(true);
     
     try {
+      // контекст собирается на сервере из сохранённого кода - несохранённые правки сначала сохраняются
+      if (projectId && savedRef.current?.code !== code) {
+        await saveCode();
+      }
+      const saved = savedRef.current;
+      const snapshot = code;
+      const editor = editorRef.current;
+      const selection = editor?.getSelection();
+      const model = editor?.getModel();
+      let context = {};
+      if (projectId && saved && saved.code === snapshot) {
+        const start = selection && model ? toCodePoints(snapshot, model.getOffsetAt(selection.getStartPosition())) : null;
+        const end = selection && model ? toCodePoints(snapshot, model.getOffsetAt(selection.getEndPosition())) : null;
+        context = {
+          project_id: Number(projectId),
+          base_hash: saved.hash,
+          ...(start !== null && end !== null && (start < end ? { selection: { start, end } } : { cursor: start }))
+        };
+      }
+      
       const response = await fetch(
-        'https://functions.poehali.dev/9022cc63-3649-4249-821b-bbb6276aef84',
+        AI_GENERATE_URL,
         {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
+          headers: {
+            'Content-Type': 'application/json',
+            ...(user?.id && { 'X-User-Id': String(user.id) })
+          },
           body: JSON.stringify({
             prompt: aiPrompt,
-            language: language
+            language: language,
+            ...context
           })
         }
       );
 
-      const data = await response.json();
+      const submitted = await response.json();
+      const data = response.status === 202 ? await waitForJob(submitted.job_id) : submitted;
       
       if (response.ok && data.code) {
-        setCode(data.code);
+        setCode(data.context
+          ? snapshot.slice(0, fromCodePoints(snapshot, data.context.replace_start)) + data.code
+            + snapshot.slice(fromCodePoints(snapshot, data.context.replace_end))
+          : data.code);
         toast({
           title: data.demo ? "Изменения применены (Demo)" : "Сайт обновлён!",
           description: data.demo ? "Для полной работы добавьте OPENAI_API_KEY" : "ИИ обновил дизайн по вашему запросу",
@@ -290,6 +362,7 @@ const CodeEditor = () => {
                     language={language}
                     value={code}
                     onChange={(value) => setCode(value || '')}
+                    onMount={(editor) => { editorRef.current = editor; }}
                     theme="vs-dark"
                     options={{
                       minimap: { enabled: false },
@@ -106,6 +106,8 @@ const Index = () => {
       'enterprise': 9990
     };
 
+    const storedUser = localStorage.getItem('user');
+    const user = storedUser ? JSON.parse(storedUser) : null;
     const orderId = generateOrderId();
     const paymentUrl = createFreeKassaPaymentUrl({
       merchantId: 'YOUR_MERCHANT_ID',
@@ -113,7 +115,9 @@ const Index = () => {
       orderId: orderId,
       secretKey: 'YOUR_SECRET_KEY',
       description: `Тариф ${selectedPlan.name} - AI Dev Platform`,
-      email: ''
+      email: user?.email || '',
+      userId: user?.id,
+      plan: planId
     });
 
     window.open(paymentUrl, '_blank');
@@ -8,6 +8,8 @@ export interface FreeKassaPaymentData {
   currency?: string;
   description?: string;
   email?: string;
+  userId?: number;
+  plan?: string;
 }
 
 export const generateFreeKassaSignature = (
@@ -28,7 +30,9 @@ export const createFreeKassaPaymentUrl = (data: FreeKassaPaymentData): string =>
     secretKey,
     currency = 'RUB',
     description = 'Оплата тарифа AI Dev Platform',
-    email = ''
+    email = '',
+    userId,
+    plan
   } = data;
 
   const signature = generateFreeKassaSignature(merchantId, amount, secretKey, orderId);
@@ -40,7 +44,9 @@ export const createFreeKassaPaymentUrl = (data: FreeKassaPaymentData): string =>
     s: signature,
     currency: currency,
     us_description: description,
-    ...(email && { us_email: email })
+    ...(email && { us_email: email }),
+    ...(userId && { us_user_id: userId.toString() }),
+    ...(plan && { us_plan: plan })
   });
 
   return `https://pay.freekassa.ru/?${params.toString()}`;
@@ -0,0 +1,69 @@
+import importlib
+import os
+import sys
+from typing import Any, Callable, Iterator
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, 'backend')
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+def load_backend(function: str, module: str = 'index') -> Any:
+    '''
+    Модуль функции из backend/<function>. Одноимённые модули (db, history, response) у функций свои,
+    поэтому модули, загруженные из других функций, выгружаются
+    '''
+    for name, loaded in list(sys.modules.items()):
+        if (getattr(loaded, '__file__', None) or '').startswith(BACKEND + os.sep):
+            del sys.modules[name]
+    sys.path[:] = [path for path in sys.path if not path.startswith(BACKEND + os.sep)]
+    sys.path.insert(0, os.path.join(BACKEND, function))
+    return importlib.import_module(module)
+
+
+@pytest.fixture(scope='session')
+def dsn() -> Iterator[str]:
+    '''
+    Postgres как у бенчмарков: BENCH_DATABASE_URL или встроенный pgserver; без них тесты с базой пропускаются
+    '''
+    pytest.importorskip('psycopg2')
+    from database import provision, with_search_path
+
+    try:
+        url, cleanup = provision()
+    except SystemExit as e:
+        pytest.skip(str(e))
+    yield with_search_path(url)
+    cleanup()
+
+
+@pytest.fixture
+def conn(dsn: str) -> Iterator[Any]:
+    '''
+    Соединение с пересозданной схемой
+    '''
+    import psycopg2
+    from database import reset_schema
+
+    reset_schema(dsn)
+    connection = psycopg2.connect(dsn)
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def user_id(conn: Any) -> int:
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO users (email, name) VALUES ('test@example.com', 'Test') RETURNING id")
+        user = cur.fetchone()[0]
+    conn.commit()
+    return user
+
+
+@pytest.fixture
+def backend() -> Callable[..., Any]:
+    return load_backend
@@ -0,0 +1,32 @@
+from typing import Any, Callable
+
+
+def test_excerpt_lines_agree_with_offsets_on_carriage_returns(backend: Callable[..., Any]) -> None:
+    context = backend('ai-generate', 'context')
+    # \r без \n - splitlines() считал бы каждую из этих строк отдельной
+    header = ''.join(f'// note {n}\r' for n in range(50))
+    body = ''.join(f'const value{n} = {n};\n' for n in range(400))
+    code = header + '\n' + body
+    start = code.index('const value300')
+    end = code.index('\n', start)
+
+    result = context.build_context(code, start, end, 300, 1500)
+
+    assert result.mode == 'selection'
+    assert result.truncated is True
+    excerpt = result.text.split('\n')
+    selected = next(i for i, line in enumerate(excerpt) if context.SELECTION_START in line)
+    assert excerpt[selected] == f'{context.SELECTION_START}const value300 = 300;{context.SELECTION_END}'
+    # окно вокруг выделения - соседние строки файла по порядку
+    assert excerpt[selected - 1] == 'const value299 = 299;'
+    assert excerpt[selected + 1] == 'const value301 = 301;'
+    assert result.tokens <= 300
+
+
+def test_excerpt_keeps_whole_file_unchanged(backend: Callable[..., Any]) -> None:
+    context = backend('ai-generate', 'context')
+    code = 'a\rb\n c\nd\n'
+    result = context.build_context(code, 0, 1, 1000, 1500)
+
+    assert result.truncated is False
+    assert result.text == context.SELECTION_START + 'a' + context.SELECTION_END + '\rb\n c\nd\n'
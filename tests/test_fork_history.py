@@ -0,0 +1,56 @@
+from typing import Any, Callable
+
+
+def _project(conn: Any, user_id: int, code: str) -> int:
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO projects (user_id, name, code, code_hash) VALUES (%s, 'Parent', %s, encode(sha256(%s::bytea), 'hex')) RETURNING id",
+            (user_id, code, code)
+        )
+        project_id = cur.fetchone()[0]
+    conn.commit()
+    return project_id
+
+
+def test_fork_history_includes_parent_versions_up_to_fork(
+    conn: Any, user_id: int, backend: Callable[..., Any]
+) -> None:
+    history = backend('code-save', 'history')
+    parent = _project(conn, user_id, 'v2\n')
+    first = history.append_version(conn, parent, 'v1\n', 'First')
+    second = history.append_version(conn, parent, 'v2\n', 'Second')
+    conn.commit()
+    fork = history.fork_project(conn, parent, user_id)
+    # правка родителя после форка в историю форка не попадает
+    after_fork = history.append_version(conn, parent, 'v3\n', 'After fork')
+    conn.commit()
+
+    versions, _ = history.list_versions(conn, fork, 10)
+    assert [(v['project_id'], v['change_message']) for v in versions] == [
+        (fork, f'Forked from project {parent}'), (parent, 'Second'), (parent, 'First')
+    ]
+    assert history.fetch_version(conn, fork, first)['code'] == 'v1\n'
+    assert history.fetch_version(conn, fork, second)['project_id'] == parent
+    assert history.fetch_version(conn, fork, after_fork) is None
+
+    page, next_key = history.list_versions(conn, fork, 2)
+    rest, _ = history.list_versions(conn, fork, 2, tuple(next_key))
+    assert [v['id'] for v in page + rest] == [v['id'] for v in versions]
+
+
+def test_fork_of_foreign_template_starts_its_own_history(
+    conn: Any, user_id: int, backend: Callable[..., Any]
+) -> None:
+    history = backend('code-save', 'history')
+    parent = _project(conn, user_id, 'draft\n')
+    draft = history.append_version(conn, parent, 'draft\n', 'Draft')
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO users (email, name) VALUES ('other@example.com', 'Other') RETURNING id")
+        other = cur.fetchone()[0]
+    conn.commit()
+    fork = history.fork_project(conn, parent, other)
+    conn.commit()
+
+    versions, _ = history.list_versions(conn, fork, 10)
+    assert [v['project_id'] for v in versions] == [fork]
+    assert history.fetch_version(conn, fork, draft) is None
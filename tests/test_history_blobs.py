@@ -0,0 +1,121 @@
+from typing import Any, Callable
+
+
+def _create_project(conn: Any, user_id: int) -> int:
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO projects (user_id, name, code) VALUES (%s, 'Blobs', '') RETURNING id", (user_id,)
+        )
+        project_id = cur.fetchone()[0]
+    conn.commit()
+    return project_id
+
+
+def _blobs(conn: Any) -> int:
+    with conn.cursor() as cur:
+        cur.execute('SELECT COUNT(*) FROM code_blobs')
+        return cur.fetchone()[0]
+
+
+def _code(n: int) -> str:
+    # каждая версия переписывает все строки - дельта невыгодна, пишется ключевой кадр
+    return ''.join(f'export const value{line} = {n * 1000 + line};\n' for line in range(200))
+
+
+def test_coalesced_keyframe_rewrites_keep_one_blob(conn: Any, user_id: int, backend: Callable[..., Any]) -> None:
+    history = backend('code-save', 'history')
+    project_id = _create_project(conn, user_id)
+    for n in range(10):
+        history.append_version(conn, project_id, _code(n), 'Автосохранение', coalesce_window=60)
+        conn.commit()
+
+    with conn.cursor() as cur:
+        cur.execute('SELECT COUNT(*) FROM project_history WHERE project_id = %s', (project_id,))
+        assert cur.fetchone()[0] == 1
+    assert _blobs(conn) == 1
+
+
+def test_sweep_reclaims_orphaned_coalesce_blobs(conn: Any, user_id: int, backend: Callable[..., Any]) -> None:
+    project_id = _create_project(conn, user_id)
+    history = backend('history-compact', 'history')
+    compaction = backend('history-compact', 'compaction')
+    history.append_version(conn, project_id, _code(0), 'Автосохранение', coalesce_window=60)
+    conn.commit()
+    # блобы, осиротевшие при перезаписи кадров до исправления append_version
+    with conn.cursor() as cur:
+        for n in range(1, 10):
+            code = _code(n)
+            cur.execute(
+                'INSERT INTO code_blobs (hash, code, size) VALUES (%s, %s, %s)',
+                (history.content_hash(code), code, len(code))
+            )
+        # форк без своей копии кода держит блоб без ссылок из истории
+        shared = _code(100)
+        cur.execute(
+            'INSERT INTO code_blobs (hash, code, size) VALUES (%s, %s, %s)',
+            (history.content_hash(shared), shared, len(shared))
+        )
+        cur.execute(
+            "INSERT INTO projects (user_id, name, code, code_hash) VALUES (%s, 'Fork', NULL, %s)",
+            (user_id, history.content_hash(shared))
+        )
+    conn.commit()
+    assert _blobs(conn) == 11
+
+    report = compaction.compact(conn)
+
+    assert report['deleted_blobs'] == 9
+    assert report['complete'] is True
+    assert _blobs(conn) == 2
+    assert compaction.compact(conn, dry_run=True)['reclaimed_bytes'] == 0
+
+
+def test_sweep_is_bounded_by_deadline(conn: Any, backend: Callable[..., Any]) -> None:
+    compaction = backend('history-compact', 'compaction')
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO code_blobs (hash, code, size) VALUES (repeat('a', 64), 'x', 1)")
+    conn.commit()
+
+    assert compaction.sweep_blobs(conn, deadline=0) == {'deleted_blobs': 0, 'reclaimed_bytes': 0, 'complete': False}
+    assert compaction.sweep_blobs(conn)['deleted_blobs'] == 1
+
+
+def test_backfill_reencodes_inline_history(conn: Any, user_id: int, backend: Callable[..., Any]) -> None:
+    history = backend('history-compact', 'history')
+    compaction = backend('history-compact', 'compaction')
+    project_id = _create_project(conn, user_id)
+    base = ''.join(f'export const value{line} = {line};\n' for line in range(200))
+    codes = [base + f'export const step = {n};\n' for n in range(6)]
+    with conn.cursor() as cur:
+        ids = []
+        for code in codes:
+            cur.execute(
+                """INSERT INTO project_history (project_id, code, content_hash, code_size, change_message)
+                VALUES (%s, %s, %s, %s, 'Legacy') RETURNING id""",
+                (project_id, code, history.content_hash(code), len(code))
+            )
+            ids.append(cur.fetchone()[0])
+        # дельта эпохи V0002 к первой версии: та должна остаться кадром
+        cur.execute(
+            """INSERT INTO project_history (project_id, base_id, delta, content_hash, code_size, change_message)
+            VALUES (%s, %s, %s, %s, %s, 'Legacy') RETURNING id""",
+            (project_id, ids[0], history.encode_delta(codes[0], codes[5]), history.content_hash(codes[5]), 1)
+        )
+        ids.append(cur.fetchone()[0])
+    conn.commit()
+
+    report = compaction.compact(conn)
+    assert report['reencoded'] == 6 and report['reclaimed_bytes'] > 0
+    with conn.cursor() as cur:
+        cur.execute(
+            'SELECT id, blob_hash IS NOT NULL, base_id FROM project_history WHERE project_id = %s AND code IS NULL '
+            'ORDER BY id', (project_id,)
+        )
+        rows = cur.fetchall()
+    assert len(rows) == 7
+    # первая - кадр в блобе (на неё ссылается дельта), последняя - кадр, на который пишет append_version
+    assert rows[0][1] and rows[5][1]
+    assert [row[2] for row in rows[1:5]] == [ids[0]] * 4
+    for version_id, code in zip(ids, codes + [codes[5]]):
+        assert history.fetch_version(conn, project_id, version_id)['code'] == code
+    assert compaction.compact(conn)['reencoded'] == 0
@@ -0,0 +1,29 @@
+import json
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable
+
+import pytest
+
+
+def test_last_modified_is_utc_in_non_utc_session(
+    dsn: str, conn: Any, user_id: int, backend: Callable[..., Any], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    from psycopg2.extensions import make_dsn, parse_dsn
+
+    # NOW() пишет updated_at в зоне сессии; Last-Modified всё равно должен быть в UTC
+    options = f"{parse_dsn(dsn).get('options', '')} -ctimezone=Europe/Moscow".strip()
+    monkeypatch.setenv('DATABASE_URL', make_dsn(dsn, options=options))
+    projects = backend('projects')
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO projects (user_id, name, code) VALUES (%s, 'Zone', '') RETURNING id", (user_id,))
+        project_id = cur.fetchone()[0]
+    conn.commit()
+
+    put = projects.handler({'httpMethod': 'PUT', 'body': json.dumps({'id': project_id, 'name': 'Moved'})}, None)
+    assert put['statusCode'] == 200
+    response = projects.handler(
+        {'httpMethod': 'GET', 'queryStringParameters': {'id': str(project_id)}, 'headers': {}}, None
+    )
+    last_modified = parsedate_to_datetime(response['headers']['Last-Modified'])
+    assert abs((datetime.now(timezone.utc) - last_modified).total_seconds()) < 60
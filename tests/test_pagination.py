@@ -0,0 +1,66 @@
+import json
+from datetime import datetime
+from typing import Any, Callable
+
+import pytest
+
+
+def test_keyset_cursor_round_trip(backend: Callable[..., Any]) -> None:
+    pagination = backend('code-save', 'pagination')
+    moment = datetime(2026, 1, 2, 3, 4, 5, 678000)
+    token = pagination.encode_cursor(moment, 42)
+    assert pagination.parse_keyset_cursor(pagination.decode_cursor(token)) == (moment, 42)
+    assert pagination.parse_keyset_cursor(None) is None
+
+
+@pytest.mark.parametrize('values', [['x', 1], [1, 1], ['2026-01-02T03:04:05', '1'], ['2026-01-02T03:04:05', True]])
+def test_keyset_cursor_rejects_wrong_types(backend: Callable[..., Any], values: Any) -> None:
+    pagination = backend('code-save', 'pagination')
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        pagination.parse_keyset_cursor(pagination.decode_cursor(pagination.encode_cursor(*values)))
+
+
+def test_history_rejects_malformed_cursor(backend: Callable[..., Any], monkeypatch: pytest.MonkeyPatch) -> None:
+    # курсор проверяется до подключения к базе
+    monkeypatch.setenv('DATABASE_URL', 'postgresql://unused')
+    code_save = backend('code-save')
+    cursor = code_save.encode_cursor('x', 1)
+    response = code_save.handler(
+        {'httpMethod': 'GET', 'queryStringParameters': {'project_id': '1', 'cursor': cursor}}, None
+    )
+    assert response['statusCode'] == 400
+    assert json.loads(response['body']) == {'error': 'Invalid cursor'}
+
+
+def test_project_list_rejects_malformed_cursor(backend: Callable[..., Any], monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv('DATABASE_URL', 'postgresql://unused')
+    projects = backend('projects')
+    for cursor in (projects.encode_cursor('x', 1), projects.encode_cursor(0.5, 1)):
+        response = projects.handler(
+            {'httpMethod': 'GET', 'queryStringParameters': {'user_id': '1', 'cursor': cursor}}, None
+        )
+        assert response['statusCode'] == 400
+        assert json.loads(response['body']) == {'error': 'Invalid cursor'}
+
+
+def test_project_list_pages_with_keyset_cursor(
+    dsn: str, conn: Any, user_id: int, backend: Callable[..., Any], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv('DATABASE_URL', dsn)
+    projects = backend('projects')
+    with conn.cursor() as cur:
+        for n in range(5):
+            cur.execute("INSERT INTO projects (user_id, name) VALUES (%s, %s)", (user_id, f'Page {n}'))
+    conn.commit()
+
+    names, cursor = [], None
+    while True:
+        params = {'user_id': str(user_id), 'limit': '2', 'fields': 'id,name'}
+        if cursor:
+            params['cursor'] = cursor
+        body = json.loads(projects.handler({'httpMethod': 'GET', 'queryStringParameters': params}, None)['body'])
+        names.extend(project['name'] for project in body['projects'])
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+    assert sorted(names) == [f'Page {n}' for n in range(5)]
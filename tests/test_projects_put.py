@@ -0,0 +1,93 @@
+import json
+from typing import Any, Callable, Dict, Optional
+
+import pytest
+
+
+@pytest.fixture
+def projects(dsn: str, conn: Any, backend: Callable[..., Any], monkeypatch: pytest.MonkeyPatch) -> Any:
+    monkeypatch.setenv('DATABASE_URL', dsn)
+    return backend('projects')
+
+
+def _create(conn: Any, user_id: int, code: str = 'const a = 1;\n') -> int:
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO projects (user_id, name, code) VALUES (%s, 'Put', %s) RETURNING id", (user_id, code)
+        )
+        project_id = cur.fetchone()[0]
+    conn.commit()
+    return project_id
+
+
+def _put(projects: Any, body: Dict[str, Any], if_match: Optional[str] = None) -> Dict[str, Any]:
+    headers = {'If-Match': if_match} if if_match else {}
+    return projects.handler({'httpMethod': 'PUT', 'body': json.dumps(body), 'headers': headers}, None)
+
+
+def test_put_accepts_etag_from_get(conn: Any, user_id: int, projects: Any) -> None:
+    project_id = _create(conn, user_id)
+    response = projects.handler(
+        {'httpMethod': 'GET', 'queryStringParameters': {'id': str(project_id)}, 'headers': {}}, None
+    )
+    etag = response['headers']['ETag']
+
+    assert _put(projects, {'id': project_id, 'name': 'Renamed'}, etag)['statusCode'] == 200
+    stale = _put(projects, {'id': project_id, 'name': 'Again'}, etag)
+    assert stale['statusCode'] == 409
+    assert json.loads(stale['body'])['current_version'] == 2
+    # сжатое представление несёт тот же тег с суффиксом кодировки
+    fresh = projects.handler(
+        {'httpMethod': 'GET', 'queryStringParameters': {'id': str(project_id)}, 'headers': {}}, None
+    )['headers']['ETag']
+    assert _put(projects, {'id': project_id, 'name': 'Gzip'}, fresh[:-1] + '-gzip"')['statusCode'] == 200
+
+
+def test_put_accepts_integer_version(conn: Any, user_id: int, projects: Any) -> None:
+    project_id = _create(conn, user_id)
+    assert _put(projects, {'id': project_id, 'name': 'One'}, '"1"')['statusCode'] == 200
+    assert _put(projects, {'id': project_id, 'name': 'Two', 'expected_version': 1})['statusCode'] == 409
+    assert _put(projects, {'id': project_id, 'name': 'Two', 'expected_version': 'x'})['statusCode'] == 400
+
+
+def _history(conn: Any, project_id: int) -> Any:
+    with conn.cursor() as cur:
+        cur.execute(
+            'SELECT blob_hash IS NOT NULL, base_id IS NOT NULL FROM project_history WHERE project_id = %s ORDER BY id',
+            (project_id,)
+        )
+        return cur.fetchall()
+
+
+def test_put_appends_delta_versions(conn: Any, user_id: int, projects: Any) -> None:
+    base = ''.join(f'export const value{n} = {n};\n' for n in range(100))
+    project_id = _create(conn, user_id)
+    assert _put(projects, {'id': project_id, 'code': base})['statusCode'] == 200
+    assert _put(projects, {'id': project_id, 'code': base + 'export const extra = 1;\n'})['statusCode'] == 200
+    unchanged = _put(projects, {'id': project_id, 'code': base + 'export const extra = 1;\n', 'name': 'Same'})
+    assert json.loads(unchanged['body'])['version_id'] is None
+    # ключевой кадр, затем дельта к нему
+    assert _history(conn, project_id) == [(True, False), (False, True)]
+
+
+def test_concurrent_puts_of_same_code_add_one_version(conn: Any, user_id: int, projects: Any) -> None:
+    import threading
+
+    project_id = _create(conn, user_id)
+    with conn.cursor() as cur:
+        cur.execute('SELECT 1 FROM projects WHERE id = %s FOR UPDATE', (project_id,))
+    results = []
+    workers = [
+        threading.Thread(target=lambda: results.append(_put(projects, {'id': project_id, 'code': 'const b = 2;\n'})))
+        for _ in range(2)
+    ]
+    for worker in workers:
+        worker.start()
+    # оба PUT ждут блокировку строки, затем выполняются по очереди
+    threading.Event().wait(0.5)
+    conn.commit()
+    for worker in workers:
+        worker.join()
+
+    assert sorted(r['statusCode'] for r in results) == [200, 200]
+    assert len(_history(conn, project_id)) == 1
@@ -0,0 +1,86 @@
+from typing import Any, Callable, List, Tuple
+
+
+class CapturingCursor:
+    '''
+    Запоминает SQL и параметры search_projects, чтобы выполнить их под EXPLAIN
+    '''
+
+    def execute(self, sql: str, params: Tuple[Any, ...]) -> None:
+        self.sql, self.params = sql, params
+
+    def fetchall(self) -> List[Any]:
+        return []
+
+
+def _project(cur: Any, user_id: int, name: str, code: str = '', description: str = '') -> int:
+    cur.execute(
+        'INSERT INTO projects (user_id, name, description, code) VALUES (%s, %s, %s, %s) RETURNING id',
+        (user_id, name, description, code)
+    )
+    return cur.fetchone()[0]
+
+
+def _search(conn: Any, search: Any, user_id: int, query: str) -> List[str]:
+    from psycopg2.extras import RealDictCursor
+
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        return [row['name'] for row in search.search_projects(cur, user_id, query, ['id', 'name'], None, 20)]
+
+
+def test_search_matches_vector_forks_and_empty_tsquery(conn: Any, user_id: int, backend: Callable[..., Any]) -> None:
+    history = backend('projects', 'history')
+    search = backend('projects', 'search')
+    shared = 'function renderInvoiceTable() {}\n'
+    with conn.cursor() as cur:
+        _project(cur, user_id, 'Dashboard', description='Admin panel')
+        _project(cur, user_id, 'Landing', code='const hero = 1;')
+        _project(cur, user_id, 'a_b')
+        cur.execute(
+            'INSERT INTO code_blobs (hash, code, size) VALUES (%s, %s, %s)',
+            (history.content_hash(shared), shared, len(shared))
+        )
+        cur.execute(
+            "INSERT INTO projects (user_id, name, code, code_hash) VALUES (%s, 'Invoices fork', NULL, %s)",
+            (user_id, history.content_hash(shared))
+        )
+    conn.commit()
+
+    assert _search(conn, search, user_id, 'dash') == ['Dashboard']
+    # подстрока внутри слова - префиксный tsquery её не находит, находит ветка ILIKE
+    assert _search(conn, search, user_id, 'board') == ['Dashboard']
+    assert _search(conn, search, user_id, 'hero') == ['Landing']
+    assert _search(conn, search, user_id, 'renderinvoicetable') == ['Invoices fork']
+    # в запросе нет слов - tsquery пуст, работает подстрока по name/description
+    assert _search(conn, search, user_id, '_') == ['a_b']
+
+
+def test_search_match_uses_gin_index(conn: Any, user_id: int, backend: Callable[..., Any]) -> None:
+    search = backend('projects', 'search')
+    with conn.cursor() as cur:
+        for n in range(500):
+            _project(cur, user_id, f'Project {n}', code=f'export const value{n} = {n};')
+        cur.execute('ANALYZE projects')
+    conn.commit()
+
+    captured = CapturingCursor()
+    search.search_projects(captured, user_id, 'value42', ['id', 'name'], None, 20)
+    with conn.cursor() as cur:
+        # без индексов по user_id и без seq scan совпадения можно найти только через GIN по search_vector;
+        # прежний OR по LATERAL-вектору здесь уходил в Seq Scan on projects
+        cur.execute('DROP INDEX idx_projects_user_id, idx_projects_user_updated')
+        cur.execute('SET LOCAL enable_seqscan = off')
+        cur.execute('EXPLAIN (ANALYZE, COSTS OFF) ' + captured.sql, captured.params)
+        plan = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT to_regclass('idx_projects_search_text_trgm') IS NOT NULL")
+        has_trigram_index = cur.fetchone()[0]
+    conn.rollback()
+
+    assert any('Bitmap Index Scan on idx_projects_search_vector' in line for line in plan)
+    # ILIKE идёт по триграммному индексу; без pg_trgm - единственный Seq Scan, и он фильтрует ILIKE (~~*)
+    scans = [n for n, line in enumerate(plan) if 'Seq Scan on projects' in line and 'never executed' not in line]
+    if has_trigram_index:
+        assert any('idx_projects_search_text_trgm' in line for line in plan)
+        assert scans == []
+    else:
+        assert len(scans) == 1 and '~~*' in plan[scans[0] + 1]